@@ -1,15 +1,71 @@
-from fastapi import FastAPI            #type:ignore
-from pydantic import BaseModel         #type:ignore
-from ml import run_inference
-from db import write_to_influx
+import os
+import time
+import asyncio
+import threading
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Header, HTTPException, Request   #type:ignore
+from fastapi.responses import PlainTextResponse               #type:ignore
+from pydantic import BaseModel, Field  #type:ignore
+import numpy as np
+from ml import engineer_features, engineer_features_batch, get_features, ready_rows, DEFAULT_DEVICE
+from registry import registry, MODEL_WATCH_INTERVAL
+from db import write_to_influx, write_batch_to_influx, receipt_times, writer, rollups
+from batcher import MicroBatcher
+from online import online
+from ingest import Ingest
+import packed
+import metrics
 
-app = FastAPI(title="Air Quality Backend")
+batcher = MicroBatcher()
+
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+
+#Load models, start the Influx writer, rollups, scoring pool, model
+#watcher, online refits and binary ingest, flush everything on shutdown
+@asynccontextmanager
+async def lifespan(app):
+    if MODEL_WARMUP:
+        await asyncio.to_thread(registry.warmup)
+    writer.start()
+    rollups.start()
+    batcher.start()
+
+    stop_watch = threading.Event()
+    if MODEL_WATCH_INTERVAL > 0:
+        threading.Thread(
+            target=registry.watch,
+            args=(stop_watch, MODEL_WATCH_INTERVAL),
+            name="model-watch",
+            daemon=True
+        ).start()
+
+    online.start()
+    await ingest.start()
+
+    yield
+    await ingest.close()
+    stop_watch.set()
+    await asyncio.to_thread(online.close)
+    await batcher.close()
+    await asyncio.to_thread(rollups.close)
+    await asyncio.to_thread(writer.close)
+
+app = FastAPI(title="Air Quality Backend", lifespan=lifespan)
 
 #Input schema
 class SensorInput(BaseModel):
+    device_id: str = Field(DEFAULT_DEVICE, min_length=1)
     temp: float
     hum: float
     mq: float
+    ts: float | None = None     # unix seconds, defaults to time of receipt
+
+class BatchInput(BaseModel):
+    readings: list[SensorInput]
+
+class ReloadInput(BaseModel):
+    version: str | None = None  # defaults to the latest in MODEL_DIR
 
 AQ_LABELS = {
     0: "Good",
@@ -17,17 +73,33 @@ AQ_LABELS = {
     2: "Poor",
     3: "Hazardous"
 }
+WARMUP_LABEL = "Warmup"         # first WINDOW - 1 readings of a device, not scored
+
+#INFLUX_QUEUE_POLICY=block may wait for queue space: do that off the
+#event loop, so only this request waits and not every other one
+async def write(fn, *args):
+    if writer.policy == "block":
+        return await asyncio.to_thread(fn, *args)
+    return fn(*args)
 
 #Inference endpoint
 @app.post("/infer")
-def infer(data: SensorInput):
+async def infer(data: SensorInput):
+    start = time.perf_counter()
 
-    feats, aq_level, confidence, anomaly, anomaly_score = run_inference(
-        data.temp, data.hum, data.mq
-    )
+    feats = engineer_features(data.temp, data.hum, data.mq, data.device_id)
+    row = np.array([[feats[f] for f in get_features()]])
+
+    if ready_rows(row)[0]:
+        aq_level, confidence, anomaly, anomaly_score, model_version = await batcher.score(row)
+        online.observe(data.device_id, row[0], aq_level)
+    else:
+        aq_level, confidence, anomaly, anomaly_score, model_version = None, np.nan, None, np.nan, None
 
     #write
-    write_to_influx(
+    await write(
+        write_to_influx,
+        data.device_id,
         data.temp,
         data.hum,
         data.mq,
@@ -35,13 +107,147 @@ def infer(data: SensorInput):
         aq_level,
         confidence,
         anomaly,
-        anomaly_score
+        anomaly_score,
+        data.ts,
+        model_version
     )
+    metrics.REQUESTS.labels("infer").inc()
+    metrics.REQUEST_SECONDS.labels("infer").observe(time.perf_counter() - start)
 
     #Response for ESP32
     return {
         "temp": data.temp,
         "hum": data.hum,
-        "aq_label": AQ_LABELS[aq_level],
-        "anomaly": bool(anomaly)
+        "aq_label": AQ_LABELS[aq_level] if aq_level is not None else WARMUP_LABEL,
+        "anomaly": bool(anomaly),
+        "model_version": model_version
+    }
+
+#Score and write readings given as columns; returns the results in
+#time order, shared by the batch endpoints
+async def infer_readings(device_ids, ts, temp, hum, mq):
+    order = np.argsort(ts, kind="stable")
+    device_ids = [device_ids[i] for i in order]
+    ts = np.asarray(ts, dtype=float)[order]
+    temp = np.asarray(temp, dtype=float)[order]
+    hum = np.asarray(hum, dtype=float)[order]
+    mq = np.asarray(mq, dtype=float)[order]
+
+    X = engineer_features_batch(temp, hum, mq, device_ids)
+    aq_levels, confidence, anomalies, anomaly_scores, model_version = await batcher.score_many(X)
+    online.observe_batch(device_ids, X, aq_levels)
+
+    #write
+    await write(
+        write_batch_to_influx,
+        device_ids,
+        ts,
+        temp,
+        hum,
+        mq,
+        X,
+        get_features(),
+        aq_levels,
+        confidence,
+        anomalies,
+        anomaly_scores,
+        model_version
+    )
+    metrics.BATCH_SIZE.labels("request").observe(len(device_ids))
+    return device_ids, ts, temp, hum, aq_levels, anomalies, model_version
+
+#UDP/TCP frames (see ingest.py) go through the same pipeline
+ingest = Ingest(infer_readings, receipt_times)
+
+def aq_label(level):
+    return WARMUP_LABEL if np.isnan(level) else AQ_LABELS[int(level)]
+
+#Batch inference endpoint
+@app.post("/infer/batch")
+async def infer_batch(data: BatchInput):
+    start = time.perf_counter()
+    if not data.readings:
+        return {"results": []}
+
+    #Readings without ts are taken as received in input order
+    missing = [i for i, r in enumerate(data.readings) if r.ts is None]
+    ts = [r.ts for r in data.readings]
+    for i, t in zip(missing, receipt_times(len(missing)).tolist()):
+        ts[i] = t
+
+    device_ids, ts, temp, hum, aq_levels, anomalies, model_version = await infer_readings(
+        [r.device_id for r in data.readings],
+        ts,
+        [r.temp for r in data.readings],
+        [r.hum for r in data.readings],
+        [r.mq for r in data.readings]
+    )
+    metrics.REQUESTS.labels("infer_batch").inc()
+    metrics.REQUEST_SECONDS.labels("infer_batch").observe(time.perf_counter() - start)
+
+    #Results in time order
+    return {
+        "model_version": model_version,
+        "results": [
+            {
+                "device_id": device_ids[i],
+                "ts": float(ts[i]),
+                "temp": float(temp[i]),
+                "hum": float(hum[i]),
+                "aq_label": aq_label(aq_levels[i]),
+                "anomaly": bool(anomalies[i] == 1)
+            }
+            for i in range(len(device_ids))
+        ]
     }
+
+#Packed batch from the firmware ring buffer, see packed.py. The reply is
+#a summary: the device shows the newest reading's result.
+@app.post("/infer/packed")
+async def infer_packed(request: Request):
+    start = time.perf_counter()
+    try:
+        device_id, ts, temp, hum, mq = packed.decode(await request.body())
+    except (ValueError, UnicodeDecodeError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if not len(ts):
+        return {"accepted": 0}
+
+    _, _, _, _, aq_levels, anomalies, model_version = await infer_readings([device_id] * len(ts), ts, temp, hum, mq)
+    metrics.REQUESTS.labels("infer_packed").inc()
+    metrics.REQUEST_SECONDS.labels("infer_packed").observe(time.perf_counter() - start)
+
+    return {
+        "accepted": len(ts),
+        "model_version": model_version,
+        "aq_label": aq_label(aq_levels[-1]),
+        "anomaly": bool(anomalies[-1] == 1),
+        "anomalies": int(np.sum(anomalies == 1))
+    }
+
+#Admin: load, check and swap in a model version without a restart
+@app.post("/admin/reload")
+async def reload_models(data: ReloadInput, x_admin_token: str | None = Header(default=None)):
+    if ADMIN_TOKEN and x_admin_token != ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="bad admin token")
+
+    previous = registry.version
+    try:
+        version = await asyncio.to_thread(registry.reload, data.version)
+    except (OSError, ValueError, KeyError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return {"previous": previous, "model_version": version}
+
+@app.get("/admin/models")
+async def list_models():
+    return {
+        "model_version": registry.version,
+        "latest": registry.latest_version(),
+        "available": registry.versions()
+    }
+
+#Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
@@ -0,0 +1,145 @@
+import os
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from cache import result_cache
+import metrics
+
+#CONFIG
+INFER_WORKERS = int(os.getenv("INFER_WORKERS", 0))                 # 0 = score on a thread in this process
+BATCH_MAX_SIZE = int(os.getenv("INFER_BATCH_MAX_SIZE", 256))
+BATCH_MAX_WAIT = float(os.getenv("INFER_BATCH_MAX_WAIT_MS", 2)) / 1000
+
+#Worker processes load the models once, on start
+def _init_worker():
+    from registry import registry
+    registry.warmup()
+
+#Runs in a worker: switch to the API process's model version first.
+#Stage timings are sent back so the API process can record them.
+def _score_in_worker(X, version):
+    import ml
+    from registry import registry
+    timings = []
+    result = ml.score_features(X, registry.ensure(version), timings)
+    return result, timings
+
+def _score_here(X, models):
+    import ml
+    return ml.score_features(X, models)
+
+#Coalesces rows from concurrent requests into one model call.
+#Feature engineering stays in the API process (it owns the per-device
+#rolling state); only the stateless scoring is sent to the pool.
+class MicroBatcher:
+    def __init__(self, workers=INFER_WORKERS, max_size=BATCH_MAX_SIZE, max_wait=BATCH_MAX_WAIT, cache=result_cache):
+        self.workers = workers
+        self.max_size = max_size
+        self.max_wait = max_wait
+        self.cache = cache
+
+        self._executor = None
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    def start(self):
+        if self.workers > 0 and self._executor is None:
+            # spawn, not fork: the API process already runs the writer thread
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker
+            )
+
+    async def close(self):
+        if self._pending:
+            self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._executor is not None:
+            await asyncio.to_thread(self._executor.shutdown)
+            self._executor = None
+
+    #One feature row, resolved with (aq_level, confidence, anomaly,
+    #anomaly_score, model_version) once its micro-batch is scored.
+    #Cached rows return straight away, without joining a batch.
+    async def score(self, row):
+        from registry import registry
+        version = registry.version
+        cached = self.cache.get(row[0], version)
+        if cached is not None:
+            return (*cached, version)
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((row, future))
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    #A whole matrix, already a batch, scored in one call.
+    #Returns the four result arrays and the model version used;
+    #warm-up rows (NaN features) come back as NaN. Only rows missing
+    #from the result cache reach the models.
+    async def score_many(self, X):
+        from registry import registry
+        models = registry.get()
+        hit, cached = self.cache.get_many(X, models["version"])
+        if not hit.any():
+            return (*await self._score(X, models), models["version"])
+
+        miss = ~hit
+        if miss.any():
+            cached[miss] = np.column_stack(await self._score(X[miss], models))
+        return (*cached.T, models["version"])
+
+    async def _score(self, X, models):
+        import ml
+        loop = asyncio.get_running_loop()
+        metrics.BATCH_SIZE.labels("score").observe(len(X))
+        if self._executor is None:
+            result = await loop.run_in_executor(None, _score_here, X, models)
+        else:
+            result, timings = await loop.run_in_executor(self._executor, _score_in_worker, X, models["version"])
+            if timings:
+                ml.observe_score_timings(timings)
+        self.cache.put_many(X, models["version"], result)
+        return result
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.ensure_future(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch):
+        from registry import registry
+        X = np.vstack([row for row, _ in batch])
+        try:
+            models = registry.get()
+            version = models["version"]
+            aq_levels, confidence, is_anomaly, anomaly_scores = await self._score(X, models)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for i, (_, future) in enumerate(batch):
+            if not future.done():
+                future.set_result((
+                    int(aq_levels[i]),
+                    float(confidence[i]),
+                    bool(is_anomaly[i]),
+                    float(anomaly_scores[i]),
+                    version
+                ))
@@ -0,0 +1,116 @@
+import os
+from collections import OrderedDict
+import numpy as np
+import metrics
+
+#CONFIG
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", 16384))     # entries, 0 = off
+RESULT_CACHE_BITS = int(os.getenv("RESULT_CACHE_BITS", 23))        # float32 mantissa bits kept in the key, 23 = exact rows only
+
+#Model results for feature rows seen before.
+#DHT11 readings are integers and the MQ135 an integer ADC count, so a
+#device in steady state keeps producing the same window and with it the
+#same feature row. Rows are keyed on their float64 bytes, plus the model
+#version; a new version empties the cache. (Not float32: the anomaly
+#model scales in float64 first, so rows equal in float32 can still
+#score differently.) Least recently used entries go first once `size`
+#is reached. With bits < 23 the key is the float32 row with its
+#mantissas rounded, so near-identical rows share a result as well (which
+#may then differ from scoring them).
+#Only touched from the event loop, so there is no lock.
+class ResultCache:
+    def __init__(self, size=RESULT_CACHE_SIZE, bits=RESULT_CACHE_BITS):
+        self.size = size
+        self.bits = bits
+        self.entries = OrderedDict()
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    def _check_version(self, version):
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def keys(self, X):
+        if self.bits >= 23:
+            X = np.ascontiguousarray(X, dtype=np.float64)
+        else:
+            drop = 23 - self.bits
+            X = np.ascontiguousarray(X, dtype=np.float32).view(np.uint32)
+            X = ((X + np.uint32(1 << (drop - 1))) & np.uint32((0xFFFFFFFF << drop) & 0xFFFFFFFF))
+        return [row.tobytes() for row in X]
+
+    #(aq_level, confidence, is_anomaly, anomaly_score) or None
+    def get(self, row, version):
+        if not self.enabled or np.isnan(row).any():
+            return None
+        self._check_version(version)
+        key = self.keys(np.asarray(row).reshape(1, -1))[0]
+        result = self.entries.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    #Hit mask and an (n, 4) float matrix of results, NaN where missed
+    def get_many(self, X, version):
+        out = np.full((len(X), 4), np.nan)
+        hit = np.zeros(len(X), dtype=bool)
+        if not self.enabled:
+            return hit, out
+        self._check_version(version)
+        ready = ~np.isnan(X).any(axis=1)
+        entries = self.entries
+        for i, key in enumerate(self.keys(X)):
+            if not ready[i]:
+                continue
+            result = entries.get(key)
+            if result is not None:
+                entries.move_to_end(key)
+                out[i] = result
+                hit[i] = True
+        n_hits = int(hit.sum())
+        self.hits += n_hits
+        self.misses += int(ready.sum()) - n_hits
+        return hit, out
+
+    def put_many(self, X, version, results):
+        if not self.enabled:
+            return
+        self._check_version(version)
+        aq_levels, confidence, is_anomaly, anomaly_scores = results
+        entries = self.entries
+        for i, key in enumerate(self.keys(X)):
+            if aq_levels[i] == aq_levels[i]:            # warm-up rows are NaN
+                entries[key] = (
+                    int(aq_levels[i]), float(confidence[i]), bool(is_anomaly[i]), float(anomaly_scores[i])
+                )
+                entries.move_to_end(key)
+        while len(entries) > self.size:
+            entries.popitem(last=False)
+
+    def hit_ratio(self):
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+result_cache = ResultCache()
+
+metrics.Counter(
+    "aq_result_cache_lookups_total", "Result cache lookups for scorable rows", ["result"],
+    fn=lambda: [(("hit",), result_cache.hits), (("miss",), result_cache.misses)]
+)
+metrics.Gauge(
+    "aq_result_cache_hit_ratio", "Result cache hits / lookups since start",
+    fn=lambda: [((), result_cache.hit_ratio())]
+)
+metrics.Gauge(
+    "aq_result_cache_entries", "Rows in the result cache",
+    fn=lambda: [((), len(result_cache.entries))]
+)
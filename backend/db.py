@@ -1,8 +1,17 @@
 import time
 import os
+import queue
+import logging
+import threading
 from dotenv import load_dotenv                                                                                         #type:ignore                                                     
-from influxdb_client import InfluxDBClient, Point                                                                      #type:ignore
+import numpy as np
+from influxdb_client import InfluxDBClient                                                                             #type:ignore
 from influxdb_client.client.write_api import SYNCHRONOUS                                                               #type:ignore
+from influxdb_client.rest import ApiException                                                                          #type:ignore
+from lineproto import field_template, encode_line, encode_lines
+from spool import Spool
+from rollup import Rollups
+import metrics
 load_dotenv()
 
 INFLUX_URL = os.getenv("INFLUX_URL")
@@ -10,13 +19,348 @@ INFLUX_TOKEN = os.getenv("INFLUX_TOKEN")
 ORG = os.getenv("INFLUX_ORG")
 BUCKET = os.getenv("INFLUX_BUCKET")
 
+#Background writer
+WRITE_QUEUE_SIZE = int(os.getenv("INFLUX_QUEUE_SIZE", 10000))          # points, however they are batched
+WRITE_QUEUE_POLICY = os.getenv("INFLUX_QUEUE_POLICY", "drop_oldest")   # drop_oldest | drop_newest | block
+WRITE_BLOCK_TIMEOUT = float(os.getenv("INFLUX_BLOCK_TIMEOUT", 0.05))   # seconds, for policy=block
+WRITE_BATCH_SIZE = int(os.getenv("INFLUX_BATCH_SIZE", 500))
+WRITE_FLUSH_INTERVAL = float(os.getenv("INFLUX_FLUSH_INTERVAL", 1.0))  # seconds
+WRITE_MAX_RETRIES = int(os.getenv("INFLUX_MAX_RETRIES", 5))
+WRITE_RETRY_DELAY = float(os.getenv("INFLUX_RETRY_DELAY", 0.5))        # seconds, doubled per retry
+WRITE_RETRY_MAX_DELAY = float(os.getenv("INFLUX_RETRY_MAX_DELAY", 60))  # seconds, cap while InfluxDB is down
+
+#Disk spool for when InfluxDB is down or slow ("" disables it)
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 4 * 1024 * 1024))
+SPOOL_MAX_BYTES = int(os.getenv("SPOOL_MAX_BYTES", 512 * 1024 * 1024))
+SPOOL_HIGH_WATER = float(os.getenv("SPOOL_HIGH_WATER", 0.5))            # queue fill ratio that diverts batches to disk
+SPOOL_REPLAY_LINES = int(os.getenv("SPOOL_REPLAY_LINES", 5000))         # lines per replayed write
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "0") == "1"
+
+logger = logging.getLogger(__name__)
+
 #DB
 client = InfluxDBClient(url=INFLUX_URL,token=INFLUX_TOKEN,org=ORG)
 
 write_api = client.write_api(write_options=SYNCHRONOUS)
 
+_STOP = object()
+
+#InfluxDB refused the data itself (bad line, field type conflict, too
+#large), so sending it again can never succeed
+REJECTED_STATUS = (400, 413, 422)
+#Bad or rotated token, missing bucket: data is fine, keep it until fixed
+CONFIG_STATUS = (401, 403, 404)
+
+def _status(e):
+    return getattr(e, "status", None) if isinstance(e, ApiException) else None
+
+def is_rejected(e):
+    return _status(e) in REJECTED_STATUS
+
+#Queues line-protocol chunks and writes them from a background thread,
+#so request handlers never wait on InfluxDB. A chunk may hold one point
+#or a whole batch, so the queue is bounded by points (queue_size), not
+#by chunks.
+class InfluxWriter:
+    def __init__(
+        self,
+        write_api,
+        bucket,
+        queue_size=WRITE_QUEUE_SIZE,
+        policy=WRITE_QUEUE_POLICY,
+        batch_size=WRITE_BATCH_SIZE,
+        flush_interval=WRITE_FLUSH_INTERVAL,
+        max_retries=WRITE_MAX_RETRIES,
+        retry_delay=WRITE_RETRY_DELAY,
+        spool=None
+    ):
+        if policy not in ("drop_oldest", "drop_newest", "block"):
+            raise ValueError(f"unknown queue policy: {policy}")
+
+        self.write_api = write_api
+        self.bucket = bucket
+        self.queue = queue.Queue()
+        self.max_lines = queue_size
+        self.queued = 0                 # points in the queue
+        self._space = threading.Condition()
+        self.policy = policy
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.spool = spool
+
+        self.dropped = 0
+        self.failed = 0
+        self.written = 0
+        self.writes = 0
+        self.spooled = 0
+        self.replayed = 0
+
+        self._backoff = retry_delay
+        self._down_until = 0.0
+
+        self._thread = None
+        self._lock = threading.Lock()
+        self._closing = threading.Event()
+
+    def start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._closing.clear()
+                self._thread = threading.Thread(target=self._run, name="influx-writer", daemon=True)
+                self._thread.start()
+
+    def submit(self, data, lines=1):
+        if self._thread is None:
+            self.start()
+
+        with self._space:
+            if not self._fits(lines):
+                # blocks the calling thread: app.py submits off the event loop
+                if self.policy == "block":
+                    self._space.wait_for(lambda: self._fits(lines), WRITE_BLOCK_TIMEOUT)
+                elif self.policy == "drop_oldest":
+                    self._drop_oldest(lines)
+                if not self._fits(lines):
+                    self.dropped += lines
+                    return
+            self.queue.put_nowait((data, lines))
+            self.queued += lines
+
+    #An empty queue takes any chunk, however large
+    def _fits(self, lines):
+        return self.queued == 0 or self.queued + lines <= self.max_lines
+
+    def _drop_oldest(self, lines):
+        while not self._fits(lines):
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                return
+            if item is _STOP:
+                self.queue.put_nowait(_STOP)
+                return
+            self.queued -= item[1]
+            self.dropped += item[1]
+
+    def _taken(self, lines):
+        with self._space:
+            self.queued -= lines
+            self._space.notify_all()
+
+    def close(self, timeout=10.0):
+        """Flush what is queued and stop the thread."""
+        if self._thread is None:
+            return
+        self._closing.set()
+        self.queue.put_nowait(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+        if self.spool is not None:
+            self.spool.close()
+
+    def _run(self):
+        batch = []
+        lines = 0
+        deadline = time.monotonic() + self.flush_interval
+
+        while True:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0.0))
+            except queue.Empty:
+                item = None
+
+            if item is _STOP:
+                # drain anything still queued behind the sentinel
+                while True:
+                    try:
+                        item = self.queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if item is not _STOP:
+                        self._taken(item[1])
+                        batch.append(item[0])
+                        lines += item[1]
+                if batch:
+                    self._write(batch, lines)
+                return
+
+            if item is not None:
+                self._taken(item[1])
+                batch.append(item[0])
+                lines += item[1]
+
+            if lines >= self.batch_size or time.monotonic() >= deadline:
+                if batch:
+                    self._write(batch, lines)
+                    batch = []
+                    lines = 0
+                deadline = time.monotonic() + self.flush_interval
+                self._replay()
+
+    def _send(self, payload, lines):
+        start = time.perf_counter()
+        self.write_api.write(bucket=self.bucket, record=payload)
+        metrics.INFLUX_WRITE_TIME.observe(time.perf_counter() - start)
+        metrics.BATCH_SIZE.labels("influx_write").observe(lines)
+        self.written += lines
+        self.writes += 1
+
+    def _backlogged(self):
+        return self.queued > SPOOL_HIGH_WATER * self.max_lines
+
+    def _mark_down(self, e):
+        self._down_until = time.monotonic() + self._backoff
+        if _status(e) in CONFIG_STATUS:
+            logger.error(
+                "influx refused the write (%s): check INFLUX_TOKEN, INFLUX_ORG and INFLUX_BUCKET; spooling for %.1fs",
+                e, self._backoff
+            )
+        else:
+            logger.warning("influx write failed (%s), spooling for %.1fs", e, self._backoff)
+        self._backoff = min(self._backoff * 2, WRITE_RETRY_MAX_DELAY)
+
+    def _replay(self):
+        if not self.spool or self._closing.is_set():
+            return
+        if time.monotonic() < self._down_until or self._backlogged():
+            return
+
+        before = self.written
+        try:
+            self.spool.replay(self._send, SPOOL_REPLAY_LINES, max_lines=self.batch_size * 20, rejected=self._rejected)
+            self._backoff = self.retry_delay
+        except Exception as e:
+            self._mark_down(e)
+        finally:
+            self.replayed += self.written - before
+        self.spool.compact()
+
+    #Count and log a write InfluxDB refused for good; False for anything
+    #worth retrying. On a partial write InfluxDB has kept the valid lines.
+    def _rejected(self, e, lines):
+        if not is_rejected(e):
+            return False
+        self.failed += lines
+        logger.error("influx rejected %d points, not retrying: %s", lines, e)
+        return True
+
+    def _write(self, batch, lines):
+        payload = b"\n".join(batch)
+        if self.spool is not None:
+            return self._write_or_spool(payload, lines)
+
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                self._send(payload, lines)
+                return True
+            except Exception as e:
+                if self._rejected(e, lines):
+                    return False
+                if attempt == self.max_retries or self._closing.is_set():
+                    self.failed += lines
+                    logger.error("influx write of %d points failed: %s", lines, e)
+                    return False
+                logger.warning("influx write failed (%s), retrying in %.1fs", e, delay)
+                time.sleep(delay)
+                delay *= 2
+
+    #With a spool nothing blocks: batches go to disk while InfluxDB is
+    #down or the queue is backing up, and are replayed once it recovers
+    def _write_or_spool(self, payload, lines):
+        if time.monotonic() >= self._down_until and not self._backlogged():
+            try:
+                self._send(payload, lines)
+                self._backoff = self.retry_delay
+                return True
+            except Exception as e:
+                if self._rejected(e, lines):
+                    return False
+                self._mark_down(e)
+
+        try:
+            self.spool.append(payload)
+            self.spooled += lines
+        except OSError as e:
+            self.failed += lines
+            logger.error("spool append of %d points failed: %s", lines, e)
+        return False
+
+writer = InfluxWriter(
+    write_api,
+    BUCKET,
+    spool=Spool(SPOOL_DIR, SPOOL_SEGMENT_BYTES, SPOOL_MAX_BYTES, SPOOL_FSYNC) if SPOOL_DIR else None
+)
+
+#air_quality_1m / _1h rollups of everything written, see rollup.py
+rollups = Rollups(writer.submit)
+
+#Writer state, read when /metrics is scraped
+metrics.Gauge(
+    "aq_influx_queue_depth", "Points waiting for the Influx writer",
+    fn=lambda: [((), writer.queued)]
+)
+metrics.Counter(
+    "aq_influx_points_total", "Points by outcome", ["outcome"],
+    fn=lambda: [
+        (("written",), writer.written),
+        (("failed",), writer.failed),
+        (("dropped",), writer.dropped),
+        (("spooled",), writer.spooled),
+        (("replayed",), writer.replayed)
+    ]
+)
+metrics.Counter(
+    "aq_influx_writes_total", "Write requests sent to InfluxDB",
+    fn=lambda: [((), writer.writes)]
+)
+metrics.Gauge(
+    "aq_spool_bytes", "Bytes waiting in the disk spool",
+    fn=lambda: [((), writer.spool.pending_bytes() if writer.spool is not None else 0)]
+)
+metrics.Counter(
+    "aq_rollup_points_total", "Rollup points written (a bucket is rewritten as it fills)",
+    fn=lambda: [((), rollups.written)]
+)
+metrics.Counter(
+    "aq_rollup_late_readings_total", "Readings left out of a rollup, their bucket already closed", ["interval"],
+    fn=lambda: [((name,), n) for name, n in rollups.late.items()]
+)
+metrics.Gauge(
+    "aq_rollup_buckets", "Rollup buckets held in memory",
+    fn=lambda: [((), rollups.buckets())]
+)
+
+#Receipt time for readings sent without one. InfluxDB keeps one point per
+#series and timestamp, so readings stamped in the same instant are spread
+#RECEIPT_STEP apart, and never before a time handed out earlier.
+RECEIPT_STEP = 1e-6             # seconds, survives the float64 -> ns conversion
+
+_receipt_lock = threading.Lock()
+_last_receipt = 0.0
+
+def receipt_times(n):
+    global _last_receipt
+    with _receipt_lock:
+        start = max(time.time(), _last_receipt + RECEIPT_STEP)
+        _last_receipt = start + (n - 1) * RECEIPT_STEP
+    return start + np.arange(n) * RECEIPT_STEP
+
 #write
+def _template(features):
+    key = tuple(features)
+    template = _templates.get(key)
+    if template is None:
+        template = _templates[key] = field_template(features)
+    return template
+
+_templates = {}
+
 def write_to_influx(
+    device_id,
     temp,
     hum,
     mq,
@@ -24,23 +368,70 @@ def write_to_influx(
     aq_level,
     confidence,
     anomaly,
-    anomaly_score
+    anomaly_score,
+    ts=None,
+    model_version=None
 ):
-    ts = int(time.time() * 1e9)
-
-    point = (
-        Point("air_quality")
-        .time(ts)
-        .field("temp", float(temp))
-        .field("hum", float(hum))
-        .field("mq", float(mq))
-        .field("aq_level", int(aq_level))
-        .field("confidence", float(confidence))
-        .field("is_anomaly", int(anomaly))
-        .field("anomaly_score", float(anomaly_score))
-    )
+    ts = float(receipt_times(1)[0]) if ts is None else ts
 
-    for k, v in feats.items():
-        point = point.field(k, float(v))
+    values = {
+        "temp": temp,
+        "hum": hum,
+        "mq": mq,
+        "aq_level": aq_level,
+        "confidence": confidence,
+        "is_anomaly": anomaly,
+        "anomaly_score": anomaly_score,
+    }
+    values.update(feats)
 
-    write_api.write(bucket=BUCKET, record=point)
+    start = time.perf_counter()
+    line = encode_line(_template(feats), device_id, int(ts * 1e9), values, model_version)
+    metrics.ENCODE_TIME.observe(time.perf_counter() - start)
+    writer.submit(line)
+    rollups.add(
+        [device_id], [ts], [temp], [hum], [mq], [feats.get("gas_norm", np.nan)],
+        [np.nan if aq_level is None else aq_level],
+        [np.nan if anomaly is None else anomaly],
+        [anomaly_score]
+    )
+
+#batch write, one line-protocol buffer for the whole batch
+def write_batch_to_influx(
+    device_ids,
+    ts,
+    temp,
+    hum,
+    mq,
+    X,
+    features,
+    aq_levels,
+    confidence,
+    anomalies,
+    anomaly_scores,
+    model_version=None
+):
+    start = time.perf_counter()
+    data = encode_lines(
+        _template(features),
+        device_ids,
+        (np.asarray(ts, dtype=float) * 1e9).astype(np.int64),
+        temp,
+        hum,
+        mq,
+        X,
+        features,
+        aq_levels,
+        confidence,
+        anomalies,
+        anomaly_scores,
+        model_version
+    )
+    metrics.ENCODE_TIME.observe(time.perf_counter() - start)
+    writer.submit(data, len(device_ids))
+    features = list(features)
+    rollups.add(
+        device_ids, ts, temp, hum, mq,
+        X[:, features.index("gas_norm")] if "gas_norm" in features else np.full(len(device_ids), np.nan),
+        aq_levels, anomalies, anomaly_scores
+    )
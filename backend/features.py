@@ -0,0 +1,120 @@
+import math
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+#Feature engineering shared by training (scripts/) and serving (ml.py).
+# compute_features() works on whole arrays, FeatureState one reading at a
+# time; both do the same float operations in the same order, so they give
+# bit-identical results. Semantics are the original pandas ones:
+#  rolling_*_10   over the last WINDOW readings, sample std (ddof=1)
+#  gas_diff_norm  gas_diff / previous mq
+#  NaN until a device has WINDOW readings (gas_diff: until it has two)
+
+WINDOW = 10
+EPS = 1e-5
+
+FEATURES = [
+    "gas_norm",
+    "rolling_mean_10",
+    "rolling_std_10",
+    "gas_diff",
+    "gas_diff_norm",
+    "hum_adjusted_gas",
+    "temp_hum",
+    "temp_gas",
+    "hum_gas"
+]
+
+#Works on floats and arrays alike
+def _derive(temp, hum, mq, prev, rolling_mean, rolling_std):
+    gas_diff = mq - prev
+    return {
+        "gas_norm": mq / (temp * hum + 1),
+        "rolling_mean_10": rolling_mean,
+        "rolling_std_10": rolling_std,
+        "gas_diff": gas_diff,
+        "gas_diff_norm": gas_diff / (prev + EPS),
+        "hum_adjusted_gas": mq * (1 + hum / 100),
+        "temp_hum": temp * hum,
+        "temp_gas": temp * mq,
+        "hum_gas": hum * mq
+    }
+
+#Batch mode: one device's readings in time order. `history` holds the
+#readings seen before them (only the last WINDOW - 1 are used).
+def compute_features(temp, hum, mq, history=()):
+    temp = np.asarray(temp, dtype=float)
+    hum = np.asarray(hum, dtype=float)
+    mq = np.asarray(mq, dtype=float)
+    history = np.asarray(history, dtype=float)[-(WINDOW - 1):]
+
+    series = np.concatenate([np.full(WINDOW - 1 - len(history), np.nan), history, mq])
+    windows = sliding_window_view(series, WINDOW)
+
+    # summed column by column, oldest first, same as FeatureState
+    total = np.zeros(len(mq))
+    for k in range(WINDOW):
+        total += windows[:, k]
+    mean = total / WINDOW
+    sq = np.zeros(len(mq))
+    for k in range(WINDOW):
+        d = windows[:, k] - mean
+        sq += d * d
+
+    return _derive(temp, hum, mq, series[WINDOW - 2:-1], mean, np.sqrt(sq / (WINDOW - 1)))
+
+def feature_matrix(feats, features=FEATURES):
+    return np.column_stack([feats[f] for f in features])
+
+#Streaming mode: per-device ring buffer, one reading at a time
+class FeatureState:
+    __slots__ = ("buf", "idx", "count", "last")
+
+    def __init__(self):
+        self.buf = [0.0] * WINDOW
+        self.idx = 0
+        self.count = 0
+        self.last = None
+
+    def push(self, mq):
+        """Add a reading, return the previous one (None for the first)."""
+        self.buf[self.idx] = mq
+        self.idx = (self.idx + 1) % WINDOW
+        if self.count < WINDOW:
+            self.count += 1
+        prev, self.last = self.last, mq
+        return prev
+
+    def window(self):
+        """Buffered readings, oldest first."""
+        if self.count < WINDOW:
+            return self.buf[:self.count]
+        return self.buf[self.idx:] + self.buf[:self.idx]
+
+    @property
+    def ready(self):
+        return self.count == WINDOW
+
+    def stats(self):
+        if self.count < WINDOW:
+            return math.nan, math.nan
+        values = self.window()
+        total = 0.0
+        for v in values:
+            total += v
+        mean = total / WINDOW
+        sq = 0.0
+        for v in values:
+            d = v - mean
+            sq += d * d
+        return mean, math.sqrt(sq / (WINDOW - 1))
+
+    def update(self, temp, hum, mq):
+        mq = float(mq)
+        prev = self.push(mq)
+        rolling_mean, rolling_std = self.stats()
+        return _derive(
+            float(temp), float(hum), mq,
+            math.nan if prev is None else prev,
+            rolling_mean, rolling_std
+        )
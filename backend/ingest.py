@@ -0,0 +1,163 @@
+import os
+import socket
+import asyncio
+import logging
+import numpy as np
+import packed
+import metrics
+
+#CONFIG
+INGEST_HOST = os.getenv("INGEST_HOST", "0.0.0.0")
+INGEST_UDP_PORT = int(os.getenv("INGEST_UDP_PORT", 0))                # 0 = off
+INGEST_TCP_PORT = int(os.getenv("INGEST_TCP_PORT", 0))                # 0 = off
+INGEST_MAX_ROWS = int(os.getenv("INGEST_MAX_ROWS", 1024))             # frames per pipeline call
+INGEST_MAX_WAIT = float(os.getenv("INGEST_MAX_WAIT_MS", 20)) / 1000
+INGEST_MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", 65536))      # frames queued or in flight, more are dropped
+INGEST_UDP_RCVBUF = int(os.getenv("INGEST_UDP_RCVBUF", 4 * 1024 * 1024))   # bytes, capped by net.core.rmem_max
+
+TCP_READ_SIZE = 64 * 1024
+
+logger = logging.getLogger(__name__)
+
+FRAMES = metrics.Counter("aq_ingest_frames_total", "Binary ingest frames received", ["transport", "outcome"])
+
+#Binary ingestion over raw UDP and TCP, next to the HTTP endpoints.
+#Both carry packed.FRAME records back to back: one or more whole frames a
+#UDP datagram, a continuous stream of them on TCP. Nothing is sent back.
+#Frames from all connections are coalesced for up to INGEST_MAX_WAIT (or
+#INGEST_MAX_ROWS frames), decoded in one np.frombuffer and handed to
+#`handle(device_ids, ts, temp, hum, mq)`, the same pipeline call
+#/infer/packed makes. Frames without a device id are dropped as invalid,
+#frames with ts 0 are stamped by `stamp(n)` when decoded (see
+#db.receipt_times).
+class Ingest:
+    def __init__(self, handle, stamp, host=INGEST_HOST, udp_port=INGEST_UDP_PORT, tcp_port=INGEST_TCP_PORT,
+                 max_rows=INGEST_MAX_ROWS, max_wait=INGEST_MAX_WAIT, max_pending=INGEST_MAX_PENDING):
+        self.handle = handle
+        self.stamp = stamp
+        self.host = host
+        self.udp_port = udp_port
+        self.tcp_port = tcp_port
+        self.max_rows = max_rows
+        self.max_wait = max_wait
+        self.max_pending = max_pending
+
+        self._chunks = []
+        self._rows = 0
+        self._in_flight = 0
+        self._timer = None
+        self._tasks = set()
+        self._transport = None
+        self._server = None
+        self._streams = set()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.udp_port:
+            self._transport, _ = await loop.create_datagram_endpoint(
+                lambda: _Datagrams(self), local_addr=(self.host, self.udp_port)
+            )
+            # a datagram costs ~1KB of buffer whatever its size: the default
+            # fills within a few hundred while the loop is busy scoring
+            sock = self._transport.get_extra_info("socket")
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, INGEST_UDP_RCVBUF)
+            self.udp_port = self._transport.get_extra_info("sockname")[1]
+            logger.info("binary ingest on udp %s:%d", self.host, self.udp_port)
+        if self.tcp_port:
+            self._server = await asyncio.start_server(self._serve_stream, self.host, self.tcp_port)
+            self.tcp_port = self._server.sockets[0].getsockname()[1]
+            logger.info("binary ingest on tcp %s:%d", self.host, self.tcp_port)
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        if self._server is not None:
+            self._server.close()
+            # wait_closed() waits for every connection, idle sensors included
+            for writer in list(self._streams):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+        if self._chunks:
+            self._flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    #Whole frames only; partial ones are the caller's to keep or drop
+    def feed(self, data, transport):
+        n = len(data) // packed.FRAME.itemsize
+        if not n:
+            return
+        # a device id is required, as for /infer
+        frames = np.frombuffer(data, dtype=packed.FRAME, count=n)
+        anonymous = frames["device_id"] == b""
+        if anonymous.any():
+            FRAMES.labels(transport, "invalid").inc(int(anonymous.sum()))
+            data = frames[~anonymous].tobytes()
+            n = len(data) // packed.FRAME.itemsize
+            if not n:
+                return
+        if self._rows + self._in_flight + n > self.max_pending:
+            FRAMES.labels(transport, "dropped").inc(n)
+            return
+        FRAMES.labels(transport, "accepted").inc(n)
+        self._chunks.append(data)
+        self._rows += n
+
+        if self._rows >= self.max_rows:
+            self._flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+    async def _serve_stream(self, reader, writer):
+        size = packed.FRAME.itemsize
+        rest = b""
+        self._streams.add(writer)
+        try:
+            while True:
+                data = await reader.read(TCP_READ_SIZE)
+                if not data:
+                    break
+                if rest:
+                    data = rest + data
+                whole = len(data) - len(data) % size
+                rest = data[whole:]
+                self.feed(data[:whole], "tcp")
+        except ConnectionError:
+            pass
+        finally:
+            self._streams.discard(writer)
+            if rest:
+                FRAMES.labels("tcp", "invalid").inc()
+            writer.close()
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        chunks, rows = self._chunks, self._rows
+        self._chunks, self._rows = [], 0
+        if chunks:
+            self._in_flight += rows
+            task = asyncio.ensure_future(self._run(b"".join(chunks), rows))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, data, rows):
+        try:
+            await self.handle(*packed.decode_frames(data, self.stamp))
+        except Exception as e:
+            logger.error("binary ingest of %d frames failed: %s", rows, e)
+        finally:
+            self._in_flight -= rows
+
+class _Datagrams(asyncio.DatagramProtocol):
+    def __init__(self, ingest):
+        self.ingest = ingest
+
+    def datagram_received(self, data, addr):
+        if len(data) % packed.FRAME.itemsize:
+            FRAMES.labels("udp", "invalid").inc()
+            return
+        self.ingest.feed(data, "udp")
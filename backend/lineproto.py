@@ -0,0 +1,127 @@
+import math
+import numpy as np
+
+#InfluxDB line protocol, written straight from arrays
+# Output matches influxdb_client's Point.to_line_protocol(): fields
+# sorted by key, whole floats without ".0", None, non-finite floats and
+# empty tags skipped. Field kinds: "f" float, "i" integer, "b" boolean,
+# "s" string.
+
+MEASUREMENT = "air_quality"
+
+_ESCAPE_TAG = str.maketrans({",": r"\,", "=": r"\=", " ": r"\ ", "\n": r"\n", "\r": r"\r", "\t": r"\t"})
+_ESCAPE_MEASUREMENT = str.maketrans({",": r"\,", " ": r"\ ", "\n": r"\n", "\r": r"\r", "\t": r"\t"})
+_ESCAPE_STRING = str.maketrans({'"': r'\"', "\\": r"\\"})
+
+BASE_FIELDS = {
+    "temp": "f",
+    "hum": "f",
+    "mq": "f",
+    "aq_level": "i",
+    "confidence": "f",
+    "is_anomaly": "i",
+    "anomaly_score": "f",
+}
+
+_tag_cache = {}
+
+def escape_tag(value):
+    out = _tag_cache.get(value)
+    if out is None:
+        out = str(value).translate(_ESCAPE_TAG)
+        if out.endswith("\\"):
+            out += " "
+        if len(_tag_cache) < 100000:
+            _tag_cache[value] = out
+    return out
+
+#FEATURES is fixed per model, so the field order is worked out once
+def field_template(features):
+    kinds = dict(BASE_FIELDS)
+    kinds.update((f, "f") for f in features)
+    keys = sorted(kinds)
+    return [(k, kinds[k]) for k in keys]
+
+def _format_field(key, kind, v):
+    # None/NaN: no model output yet (device still warming up)
+    if v is None:
+        return ""
+    if kind == "i":
+        if v != v:
+            return ""
+        return f"{key}={int(v)}i"
+    if kind == "b":
+        return f"{key}={'true' if v else 'false'}"
+    if kind == "s":
+        return f'{key}="{str(v).translate(_ESCAPE_STRING)}"'
+    v = float(v)
+    if not math.isfinite(v):
+        return ""
+    s = repr(v)
+    return f"{key}={s[:-2] if s.endswith('.0') else s}"
+
+def _format_column(key, kind, values):
+    return [_format_field(key, kind, v) for v in values]
+
+#Point leaves out a tag whose value is empty; "device_id=" is invalid
+def _tag(key, value):
+    value = "" if value is None else escape_tag(value)
+    return f",{key}={value}" if value else ""
+
+#Single reading, values keyed by field name
+def encode_line(template, device_id, ts_ns, values, model_version=None):
+    fields = [_format_field(key, kind, values[key]) for key, kind in template]
+    return (
+        f"{MEASUREMENT}{_tag('device_id', device_id)}{_tag('model_version', model_version)} "
+        f"{','.join(f for f in fields if f)} {int(ts_ns)}"
+    ).encode()
+
+#Whole batch into one buffer
+def encode_lines(
+    template,
+    device_ids,
+    ts_ns,
+    temp,
+    hum,
+    mq,
+    X,
+    features,
+    aq_levels,
+    confidence,
+    anomalies,
+    anomaly_scores,
+    model_version=None
+):
+    columns = {
+        "temp": temp,
+        "hum": hum,
+        "mq": mq,
+        "aq_level": aq_levels,
+        "confidence": confidence,
+        "is_anomaly": anomalies,
+        "anomaly_score": anomaly_scores,
+    }
+    for j, f in enumerate(features):
+        columns[f] = X[:, j]
+
+    formatted = [
+        _format_column(key, kind, np.asarray(columns[key]).tolist())
+        for key, kind in template
+    ]
+
+    version = _tag("model_version", model_version)
+    lines = []
+    for device_id, t, *fields in zip(device_ids, ts_ns, *formatted):
+        lines.append(
+            f"{MEASUREMENT}{_tag('device_id', device_id)}{version} "
+            f"{','.join(f for f in fields if f)} {int(t)}"
+        )
+    return "\n".join(lines).encode()
+
+#One point of any measurement tagged by device, fields as (key, kind, value)
+def encode_point(measurement, device_id, fields, ts_ns):
+    formatted = (_format_field(key, kind, v) for key, kind, v in fields)
+    return (
+        f"{measurement.translate(_ESCAPE_MEASUREMENT)}{_tag('device_id', device_id)} "
+        f"{','.join(f for f in formatted if f)} {int(ts_ns)}"
+    ).encode()
@@ -0,0 +1,154 @@
+import threading
+from bisect import bisect_left
+
+#Minimal Prometheus text-format metrics.
+#Hot-path cost is a bisect plus two adds under an uncontended lock;
+#queue depths, writer counters etc. are read by callbacks at scrape time.
+
+LATENCY_BUCKETS = (
+    0.00001, 0.000025, 0.00005, 0.0001, 0.00025, 0.0005,
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5
+)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256, 512, 1024, 4096)
+
+_metrics = []
+
+def _fmt(v):
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+def _escape(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _labels(names, values, le=None):
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if le is not None:
+        parts.append(f'le="{_fmt(le)}"')
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        out = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        out.extend(self._samples())
+        return "\n".join(out)
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self.lock:
+            self.value += n
+
+    def set(self, v):
+        self.value = v
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+        if not labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, n=1):
+        self._default.inc(n)
+
+    def _samples(self):
+        if self.fn is not None:
+            return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(v)}" for k, v in self.fn()]
+        return [f"{self.name}{_labels(self.labelnames, k)} {_fmt(c.value)}" for k, c in list(self._children.items())]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, v):
+        self._default.set(v)
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "lock")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, v):
+        i = bisect_left(self.bounds, v)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += v
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+        if not labelnames:
+            self._default = self.labels()
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, v):
+        self._default.observe(v)
+
+    def _samples(self):
+        out = []
+        for key, child in list(self._children.items()):
+            with child.lock:
+                counts = list(child.counts)
+                total = child.sum
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                out.append(f"{self.name}_bucket{_labels(self.labelnames, key, bound)} {cumulative}")
+            out.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_fmt(total)}")
+            out.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return out
+
+def render():
+    return "\n".join(m.render() for m in _metrics) + "\n"
+
+#Pipeline metrics
+STAGE_SECONDS = Histogram("aq_stage_seconds", "Time spent per pipeline stage", ["stage"])
+BATCH_SIZE = Histogram("aq_batch_rows", "Rows per model call or write", ["kind"], buckets=SIZE_BUCKETS)
+REQUESTS = Counter("aq_requests_total", "Requests handled", ["endpoint"])
+REQUEST_SECONDS = Histogram("aq_request_seconds", "Request handling time", ["endpoint"])
+
+FEATURES_TIME = STAGE_SECONDS.labels("features")
+SCALER_TIME = STAGE_SECONDS.labels("scaler")
+IFOREST_TIME = STAGE_SECONDS.labels("isolation_forest")
+TREE_TIME = STAGE_SECONDS.labels("decision_tree")
+ENCODE_TIME = STAGE_SECONDS.labels("db_encode")
+INFLUX_WRITE_TIME = STAGE_SECONDS.labels("influx_write")
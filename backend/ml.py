@@ -1,50 +1,136 @@
-import joblib
+import os
+import time
+import threading
+from collections import OrderedDict
 import numpy as np
+from trees import scale, anomaly_decision_function_scaled, classifier_predict_proba
+from registry import registry
+from features import WINDOW, FeatureState, compute_features, feature_matrix
+import metrics
 
-#load ML models
-anomaly_model = joblib.load("models/anomaly_model.joblib")
-aq_model = joblib.load("models/aq_classifier_tree.joblib")
-scaler = joblib.load("models/scaler.joblib")
-FEATURES = joblib.load("models/features.joblib")
+#ML models (flattened by scripts/export_models.py, no sklearn needed)
+#are loaded lazily by the registry on first use or warmup
+def get_features():
+    return registry.get()["features"]
 
 #Rolling buffer
-WINDOW = 10
-mq_buffer = []
-
-#Feature engineering
-def engineer_features(temp, hum, mq):
-    mq_buffer.append(mq)
-    if len(mq_buffer) > WINDOW:
-        mq_buffer.pop(0)
-
-    rolling_mean = float(np.mean(mq_buffer))
-    rolling_std = float(np.std(mq_buffer))
-    gas_diff = mq_buffer[-1] - mq_buffer[-2] if len(mq_buffer) > 1 else 0.0
-
-    return {
-        "gas_norm": mq / (temp * hum + 1),
-        "rolling_mean_10": rolling_mean,
-        "rolling_std_10": rolling_std,
-        "gas_diff": gas_diff,
-        "gas_diff_norm": gas_diff / (mq + 1e-5),
-        "hum_adjusted_gas": mq * (1 + hum / 100),
-        "temp_hum": temp * hum,
-        "temp_gas": temp * mq,
-        "hum_gas": hum * mq
-    }
-
-def run_inference(temp, hum, mq):
-    feats = engineer_features(temp, hum, mq)
-    X = np.array([feats[f] for f in FEATURES]).reshape(1, -1)
-
-    # Anomaly detection
-    X_scaled = scaler.transform(X)
-    anomaly_score = float(anomaly_model.decision_function(X_scaled)[0])
-    is_anomaly = bool(anomaly_model.predict(X_scaled)[0] == -1)
-
-    # AQ classification
-    aq_level = int(aq_model.predict(X)[0])
-    confidence = float(aq_model.predict_proba(X).max())
-
-    return feats, aq_level, confidence, is_anomaly, anomaly_score
+DEFAULT_DEVICE = "default"
+DEVICE_TTL = float(os.getenv("DEVICE_TTL", 3600))   # seconds idle before a device's window is dropped
+MAX_DEVICES = int(os.getenv("MAX_DEVICES", 10000))
 
+#Per-device rolling window, see features.FeatureState
+class DeviceState(FeatureState):
+    __slots__ = ("last_seen",)
+
+    def __init__(self):
+        super().__init__()
+        self.last_seen = 0.0
+
+#Device store, least recently seen first
+devices = OrderedDict()
+devices_lock = threading.Lock()
+
+metrics.Gauge(
+    "aq_active_devices", "Devices with a rolling window in memory",
+    fn=lambda: [((), len(devices))]
+)
+
+def _evict_idle(now):
+    while devices:
+        device_id, state = next(iter(devices.items()))
+        if len(devices) <= MAX_DEVICES and now - state.last_seen < DEVICE_TTL:
+            break
+        del devices[device_id]
+
+def get_device_state(device_id):
+    now = time.monotonic()
+    state = devices.get(device_id)
+    if state is None:
+        state = devices[device_id] = DeviceState()
+    else:
+        devices.move_to_end(device_id)
+    state.last_seen = now
+    _evict_idle(now)
+    return state
+
+#Feature engineering, NaN features until the device has a full window
+def engineer_features(temp, hum, mq, device_id=DEFAULT_DEVICE):
+    start = time.perf_counter()
+    with devices_lock:
+        feats = get_device_state(device_id).update(temp, hum, mq)
+    metrics.FEATURES_TIME.observe(time.perf_counter() - start)
+    return feats
+
+#Rows with a full window; the rest are still warming up
+def ready_rows(X):
+    return ~np.isnan(X).any(axis=1)
+
+#Model scoring, each model evaluated once per matrix.
+#Stage times go to the metrics, or into `timings` when scoring runs in a
+#worker process whose metrics nobody scrapes.
+def score_features(X, models=None, timings=None):
+    if models is None:
+        models = registry.get()
+
+    # warm-up rows get NaN for every output
+    ready = ready_rows(X)
+    if not ready.all():
+        out = tuple(np.full(len(X), np.nan) for _ in range(4))
+        if ready.any():
+            for column, scored in zip(out, score_features(X[ready], models, timings)):
+                column[ready] = scored
+        return out
+
+    t0 = time.perf_counter()
+    X_scaled = scale(models, X)
+    t1 = time.perf_counter()
+
+    # Anomaly detection, predict() is just decision_function < 0
+    # (score_samples below the fitted offset_)
+    anomaly_scores = anomaly_decision_function_scaled(models, X_scaled)
+    is_anomaly = anomaly_scores < 0
+    t2 = time.perf_counter()
+
+    # AQ classification, predict() is argmax of predict_proba()
+    proba = classifier_predict_proba(models, X)
+    aq_levels = models["classifier"]["classes"].take(proba.argmax(axis=1))
+    confidence = proba.max(axis=1)
+    t3 = time.perf_counter()
+
+    if timings is None:
+        observe_score_timings((t1 - t0, t2 - t1, t3 - t2))
+    else:
+        timings.extend((t1 - t0, t2 - t1, t3 - t2))
+
+    return aq_levels, confidence, is_anomaly, anomaly_scores
+
+def observe_score_timings(timings):
+    scaler, iforest, tree = timings
+    metrics.SCALER_TIME.observe(scaler)
+    metrics.IFOREST_TIME.observe(iforest)
+    metrics.TREE_TIME.observe(tree)
+
+#Batch feature engineering, readings must be in time order per device
+def engineer_features_batch(temp, hum, mq, device_ids):
+    start = time.perf_counter()
+    temp = np.asarray(temp, dtype=float)
+    hum = np.asarray(hum, dtype=float)
+    mq = np.asarray(mq, dtype=float)
+
+    groups = {}
+    for i, device_id in enumerate(device_ids):
+        groups.setdefault(device_id, []).append(i)
+
+    X = np.empty((len(mq), len(get_features())))
+    with devices_lock:
+        for device_id, idx in groups.items():
+            idx = np.asarray(idx)
+            state = get_device_state(device_id)
+            feats = compute_features(temp[idx], hum[idx], mq[idx], state.window())
+            X[idx] = feature_matrix(feats, get_features())
+
+            for v in mq[idx][-WINDOW:]:
+                state.push(float(v))
+
+    metrics.FEATURES_TIME.observe(time.perf_counter() - start)
+    return X
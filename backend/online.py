@@ -0,0 +1,285 @@
+import os
+import time
+import random
+import shutil
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import joblib
+import numpy as np
+from registry import registry, COMPILED_NAME, CURRENT_NAME
+from trees import (
+    scale, average_path_length, flatten_isolation_forest, slice_trees, concat_trees, apply_trees
+)
+import metrics
+
+#CONFIG
+ONLINE_REFIT_INTERVAL = float(os.getenv("ONLINE_REFIT_INTERVAL", 0))     # seconds, 0 = online updates off
+ONLINE_RESERVOIR_SIZE = int(os.getenv("ONLINE_RESERVOIR_SIZE", 256))     # rows kept per device
+ONLINE_HORIZON = int(os.getenv("ONLINE_HORIZON", 2560))                  # readings a reservoir row survives, on average
+ONLINE_MAX_DEVICES = int(os.getenv("ONLINE_MAX_DEVICES", 1000))
+ONLINE_MIN_ROWS = int(os.getenv("ONLINE_MIN_ROWS", 1024))                # fewer rows: skip the refit
+ONLINE_MAX_ROWS = int(os.getenv("ONLINE_MAX_ROWS", 65536))               # sampled down to this for a refit
+ONLINE_REPLACE_FRACTION = float(os.getenv("ONLINE_REPLACE_FRACTION", 0.25))   # oldest trees replaced per refit, 1 = full refit
+ONLINE_NORMAL_CLASSES = {int(c) for c in os.getenv("ONLINE_NORMAL_CLASSES", "0,1").split(",")}
+ONLINE_CONTAMINATION = float(os.getenv("ONLINE_CONTAMINATION", 0.01))   # for bundles exported without it
+ONLINE_KEEP = int(os.getenv("ONLINE_KEEP", 3))                           # online versions kept on disk
+
+ONLINE_TAG = "-online-"
+DEFAULT_MAX_SAMPLES = 256       # IsolationForest max_samples="auto" on >= 256 rows
+
+logger = logging.getLogger(__name__)
+
+#Online anomaly model updates.
+#Rows the classifier puts in a normal class (Good/Moderate by default) are
+#sampled into a small reservoir per device. Every ONLINE_REFIT_INTERVAL
+#seconds the reservoirs are snapshotted and sent to a one-off spawn
+#process, which fits fresh isolation trees on them and swaps them in for
+#the oldest ONLINE_REPLACE_FRACTION of the forest, so the model follows
+#drift without forgetting everything at once. The result is written as a
+#new version, <base>-online-<time>, and loaded with registry.reload():
+#/infer keeps scoring on the old bundle until the reference swap.
+#
+#Memory: at most ONLINE_MAX_DEVICES * ONLINE_RESERVOIR_SIZE rows (18 MB at
+#the defaults). A reservoir keeps new rows with probability
+#size / ONLINE_HORIZON once full, so it leans towards recent readings.
+
+#Runs in the refit process: fit new trees on the reservoir rows, splice
+#them into base_path's forest and write the bundle to version_dir
+def refit_anomaly(base_path, X, version_dir, replace_fraction, seed):
+    from sklearn.ensemble import IsolationForest        #type:ignore
+    if hasattr(os, "nice"):
+        os.nice(10)                 # request handling comes first on small boxes
+
+    models = dict(joblib.load(base_path))
+    anomaly = models["anomaly"]
+    X_scaled = scale(models, X)
+
+    n_trees = len(anomaly["roots"])
+    n_new = min(n_trees, max(1, round(n_trees * replace_fraction)))
+    max_samples = int(anomaly.get("max_samples", DEFAULT_MAX_SAMPLES))
+    forest = IsolationForest(n_estimators=n_new, max_samples=max_samples, random_state=seed)
+    forest.fit(X_scaled)
+    fresh = flatten_isolation_forest(forest, len(models["features"]))
+
+    merged = fresh if n_new == n_trees else concat_trees(slice_trees(anomaly, n_new), fresh)
+    merged["max_samples"] = max_samples
+    merged["denominator"] = float(n_trees * average_path_length([max_samples])[0])
+
+    #Threshold: same contamination as the offline model, over the reservoir
+    contamination = anomaly.get("contamination", ONLINE_CONTAMINATION)
+    merged["contamination"] = contamination
+    if contamination == "auto":
+        merged["offset"] = -0.5
+    else:
+        depths = merged["path_length"][apply_trees(X_scaled, merged)].sum(axis=1)
+        merged["offset"] = float(np.percentile(-(2.0 ** (-depths / merged["denominator"])), 100.0 * contamination))
+
+    models["anomaly"] = merged
+    models["online"] = {"base_path": base_path, "rows": len(X), "replaced": n_new, "trees": n_trees}
+    os.makedirs(version_dir, exist_ok=True)
+    joblib.dump(models, os.path.join(version_dir, COMPILED_NAME))
+    return n_new
+
+def base_version(version):
+    return version.split(ONLINE_TAG)[0]
+
+class _Reservoir:
+    __slots__ = ("rows", "n", "seen")
+
+    def __init__(self, size, n_features):
+        self.rows = np.empty((size, n_features))
+        self.n = 0
+        self.seen = 0
+
+class OnlineUpdater:
+    def __init__(
+        self,
+        interval=ONLINE_REFIT_INTERVAL,
+        size=ONLINE_RESERVOIR_SIZE,
+        horizon=ONLINE_HORIZON,
+        max_devices=ONLINE_MAX_DEVICES,
+        min_rows=ONLINE_MIN_ROWS,
+        max_rows=ONLINE_MAX_ROWS,
+        replace_fraction=ONLINE_REPLACE_FRACTION,
+        normal_classes=ONLINE_NORMAL_CLASSES,
+        keep=ONLINE_KEEP
+    ):
+        self.interval = interval
+        self.size = size
+        self.horizon = max(horizon, size)
+        self.max_devices = max_devices
+        self.min_rows = min_rows
+        self.max_rows = max_rows
+        self.replace_fraction = replace_fraction
+        self.normal_classes = normal_classes
+        self.keep = keep
+
+        self.reservoirs = OrderedDict()
+        self._lock = threading.Lock()
+        self._random = random.Random()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refits = {"swapped": 0, "skipped": 0, "failed": 0}
+        self.last_refit_seconds = float("nan")
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="online-refit", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def rows(self):
+        with self._lock:
+            return sum(r.n for r in self.reservoirs.values())
+
+    #Hot path: one dict lookup and at most one row copy per reading
+    def observe(self, device_id, row, aq_level):
+        if not self.enabled or aq_level not in self.normal_classes:
+            return
+        with self._lock:
+            self._add(device_id, row)
+
+    def observe_batch(self, device_ids, X, aq_levels):
+        if not self.enabled:
+            return
+        with self._lock:
+            for i, level in enumerate(aq_levels):
+                if not np.isnan(level) and int(level) in self.normal_classes:
+                    self._add(device_ids[i], X[i])
+
+    #Reservoir sampling (Algorithm R) with `seen` capped at the horizon
+    def _add(self, device_id, row):
+        reservoir = self.reservoirs.get(device_id)
+        if reservoir is None:
+            reservoir = self.reservoirs[device_id] = _Reservoir(self.size, len(row))
+            if len(self.reservoirs) > self.max_devices:
+                self.reservoirs.popitem(last=False)
+        else:
+            self.reservoirs.move_to_end(device_id)
+
+        if reservoir.seen < self.horizon:
+            reservoir.seen += 1
+        if reservoir.n < self.size:
+            reservoir.rows[reservoir.n] = row
+            reservoir.n += 1
+        else:
+            j = self._random.randrange(reservoir.seen)
+            if j < self.size:
+                reservoir.rows[j] = row
+
+    #Copies one device at a time, so observers wait microseconds at most
+    def snapshot(self):
+        parts = []
+        with self._lock:
+            device_ids = list(self.reservoirs)
+        for device_id in device_ids:
+            with self._lock:
+                reservoir = self.reservoirs.get(device_id)
+                if reservoir is not None and reservoir.n:
+                    parts.append(reservoir.rows[:reservoir.n].copy())
+        if not parts:
+            return np.empty((0, 0))
+        X = np.concatenate(parts)
+        if len(X) > self.max_rows:
+            X = X[np.random.default_rng().choice(len(X), self.max_rows, replace=False)]
+        return X
+
+    def refit(self):
+        """Refit from the current reservoirs and swap the result in.
+        Returns the new version, or None when there are too few rows."""
+        models = registry.get()
+        max_samples = int(models["anomaly"].get("max_samples", DEFAULT_MAX_SAMPLES))
+        X = self.snapshot()
+        if len(X) < max(self.min_rows, max_samples):
+            self.refits["skipped"] += 1
+            return None
+
+        start = time.perf_counter()
+        current = self._current()
+        base = base_version(models["version"])
+        version = f"{base}{ONLINE_TAG}{time.strftime('%Y%m%d-%H%M%S')}"
+        version_dir = os.path.join(registry.model_dir, version)
+
+        # fresh process per refit: sklearn and the fit's memory go away with it
+        with ProcessPoolExecutor(
+            max_workers=1,
+            mp_context=multiprocessing.get_context("spawn"),
+            max_tasks_per_child=1
+        ) as pool:
+            replaced = pool.submit(
+                refit_anomaly, models["path"], X, version_dir, self.replace_fraction, self._random.getrandbits(32)
+            ).result()
+
+        # a version published during the fit wins over this refit of the old one
+        if self._current() != current:
+            shutil.rmtree(version_dir, ignore_errors=True)
+            self.refits["skipped"] += 1
+            logger.info("online refit of %s dropped, %s was published meanwhile", base, self._current())
+            return None
+
+        registry.reload(version)
+        self._set_current(version)
+        self._prune(base, version)
+
+        self.last_refit_seconds = time.perf_counter() - start
+        REFIT_SECONDS.observe(self.last_refit_seconds)
+        self.refits["swapped"] += 1
+        logger.info("online refit: %d rows, %d trees replaced -> %s", len(X), replaced, version)
+        return version
+
+    def _current(self):
+        try:
+            with open(os.path.join(registry.model_dir, CURRENT_NAME)) as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+
+    #Keep the model file watcher (and a restart) on the refitted version;
+    #train_model.py --publish moves CURRENT on to a new offline version
+    def _set_current(self, version):
+        current = os.path.join(registry.model_dir, CURRENT_NAME)
+        with open(current + ".tmp", "w") as f:
+            f.write(version + "\n")
+        os.replace(current + ".tmp", current)
+
+    def _prune(self, base, active):
+        online = [v for v in registry.versions() if v.startswith(base + ONLINE_TAG) and v != active]
+        for version in online[:max(0, len(online) - (self.keep - 1))]:
+            shutil.rmtree(os.path.join(registry.model_dir, version), ignore_errors=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refit()
+            except Exception as e:
+                self.refits["failed"] += 1
+                logger.error("online refit failed: %s", e)
+
+online = OnlineUpdater()
+
+REFIT_SECONDS = metrics.Histogram(
+    "aq_online_refit_seconds", "Online anomaly refit time, snapshot to swap",
+    buckets=(0.5, 1, 2, 5, 10, 30, 60, 120, 300)
+)
+metrics.Gauge(
+    "aq_online_reservoir_rows", "Normal rows held for the next online refit",
+    fn=lambda: [((), online.rows())]
+)
+metrics.Counter(
+    "aq_online_refits_total", "Online anomaly refits by outcome", ["outcome"],
+    fn=lambda: [((k,), v) for k, v in online.refits.items()]
+)
@@ -0,0 +1,88 @@
+import struct
+import numpy as np
+
+#Packed reading batches, as sent by firmware/ringbuf.py
+# header  "AQ", version u8, device id length u8, device id (utf-8), count u16
+# records count x RECORD: ts u32 (unix seconds), temp i16 and hum i16 in
+#         tenths, mq u16 (raw ADC), all little-endian
+#10 bytes a reading against ~75 for the same reading as JSON.
+
+MAGIC = b"AQ"
+VERSION = 1
+CONTENT_TYPE = "application/x-aq-packed"
+
+RECORD = np.dtype([("ts", "<u4"), ("temp", "<i2"), ("hum", "<i2"), ("mq", "<u2")])
+SCALE = 10                      # temp and hum are sent in tenths
+
+def encode(device_id, ts, temp, hum, mq):
+    device_id = device_id.encode()
+    records = np.empty(len(ts), dtype=RECORD)
+    records["ts"] = ts
+    records["temp"] = np.round(np.asarray(temp, dtype=float) * SCALE)
+    records["hum"] = np.round(np.asarray(hum, dtype=float) * SCALE)
+    records["mq"] = mq
+    return MAGIC + struct.pack("<BB", VERSION, len(device_id)) + device_id + struct.pack("<H", len(records)) + records.tobytes()
+
+#-> device_id, ts, temp, hum, mq (float arrays); ValueError on a bad frame
+def decode(data):
+    if len(data) < 4 or data[:2] != MAGIC:
+        raise ValueError("not a packed reading batch")
+    version, id_len = data[2], data[3]
+    if version != VERSION:
+        raise ValueError(f"unsupported packed batch version {version}")
+    if len(data) < 6 + id_len:
+        raise ValueError("truncated packed batch header")
+
+    device_id = bytes(data[4:4 + id_len]).decode()
+    (count,) = struct.unpack_from("<H", data, 4 + id_len)
+    body = data[6 + id_len:]
+    if len(body) != count * RECORD.itemsize:
+        raise ValueError(f"packed batch holds {len(body)} bytes, expected {count} records")
+
+    records = np.frombuffer(body, dtype=RECORD)
+    return (
+        device_id,
+        records["ts"].astype(float),
+        records["temp"] / SCALE,
+        records["hum"] / SCALE,
+        records["mq"].astype(float)
+    )
+
+#Single-reading frames for the UDP/TCP listener (ingest.py): fixed 26
+#bytes, device id NUL-padded to 16 bytes, ts 0 = time of receipt. A UDP
+#datagram or TCP stream carries any number of them back to back.
+FRAME = np.dtype([
+    ("device_id", "S16"), ("ts", "<u4"), ("temp", "<i2"), ("hum", "<i2"), ("mq", "<u2")
+])
+
+def encode_frames(device_ids, ts, temp, hum, mq):
+    frames = np.empty(len(device_ids), dtype=FRAME)
+    frames["device_id"] = [d.encode() for d in device_ids]
+    frames["ts"] = ts
+    frames["temp"] = np.round(np.asarray(temp, dtype=float) * SCALE)
+    frames["hum"] = np.round(np.asarray(hum, dtype=float) * SCALE)
+    frames["mq"] = mq
+    return frames.tobytes()
+
+#-> device_ids (list), ts, temp, hum, mq (float arrays); frames with ts 0
+#get the times `stamp(n)` returns, in frame order (distinct, so frames of
+#one device coalesced together don't overwrite each other in InfluxDB)
+def decode_frames(data, stamp):
+    if len(data) % FRAME.itemsize:
+        raise ValueError(f"{len(data)} bytes is not a whole number of {FRAME.itemsize}-byte frames")
+    frames = np.frombuffer(data, dtype=FRAME)
+
+    # few devices, many frames: decode each id once
+    ids, inverse = np.unique(frames["device_id"], return_inverse=True)
+    names = [i.decode("utf-8", "replace") for i in ids]
+    ts = frames["ts"].astype(float)
+    unset = ts == 0
+    if unset.any():
+        ts[unset] = stamp(int(unset.sum()))
+    return (
+        [names[i] for i in inverse],
+        ts,
+        frames["temp"] / SCALE,
+        frames["hum"] / SCALE,
+        frames["mq"].astype(float)
+    )
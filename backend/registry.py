@@ -0,0 +1,145 @@
+import os
+import logging
+import threading
+import joblib
+import numpy as np
+from trees import anomaly_decision_function, classifier_predict_proba
+import metrics
+
+#CONFIG
+MODEL_DIR = os.getenv("MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1") == "1"
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", 0))   # seconds, 0 = no file watch
+COMPILED_NAME = "compiled_models.joblib"
+CURRENT_NAME = "CURRENT"
+DEFAULT_VERSION = "default"
+
+REQUIRED_KEYS = ("features", "scaler", "anomaly", "classifier")
+
+logger = logging.getLogger(__name__)
+
+#Loads the compiled model artifact on first use.
+#Paths resolve against this package, not the working directory, and the
+#arrays are memory-mapped read-only so every worker process shares the
+#same page-cache pages instead of holding its own copy.
+#
+#Versions live in MODEL_DIR/<version>/compiled_models.joblib. The active
+#one is named by MODEL_DIR/CURRENT, else the highest version name, else
+#the flat MODEL_DIR/compiled_models.joblib. reload() loads and checks a
+#version off the request path, then swaps it in with a single reference
+#assignment, so in-flight requests finish on the bundle they started with.
+class ModelRegistry:
+    def __init__(self, model_dir=MODEL_DIR, mmap=MODEL_MMAP):
+        self.model_dir = model_dir
+        self.mmap = mmap
+        self._models = None
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+
+    def path(self, version=None):
+        if version is None or version == DEFAULT_VERSION:
+            return os.path.join(self.model_dir, COMPILED_NAME)
+        return os.path.join(self.model_dir, version, COMPILED_NAME)
+
+    def versions(self):
+        if not os.path.isdir(self.model_dir):
+            return []
+        return sorted(
+            name for name in os.listdir(self.model_dir)
+            if os.path.isfile(os.path.join(self.model_dir, name, COMPILED_NAME))
+        )
+
+    def latest_version(self):
+        current = os.path.join(self.model_dir, CURRENT_NAME)
+        if os.path.isfile(current):
+            with open(current) as f:
+                version = f.read().strip()
+            if version:
+                return version
+        versions = self.versions()
+        return versions[-1] if versions else DEFAULT_VERSION
+
+    def get(self):
+        models = self._models
+        if models is None:
+            with self._lock:
+                if self._models is None:
+                    self._models = self._load(self.latest_version())
+                models = self._models
+        return models
+
+    @property
+    def version(self):
+        return self.get()["version"]
+
+    def _load(self, version):
+        path = self.path(version)
+        models = dict(joblib.load(path, mmap_mode="r" if self.mmap else None))
+        models["version"] = version
+        models["path"] = path
+        return models
+
+    def validate(self, models):
+        missing = [k for k in REQUIRED_KEYS if k not in models]
+        if missing:
+            raise ValueError(f"model {models['version']} is missing {missing}")
+
+        current = self._models
+        if current is not None and list(models["features"]) != list(current["features"]):
+            raise ValueError(f"model {models['version']} expects different features, restart to change them")
+
+        X = np.zeros((1, len(models["features"])))
+        scores = anomaly_decision_function(models, X)
+        proba = classifier_predict_proba(models, X)
+        if not np.all(np.isfinite(scores)):
+            raise ValueError(f"model {models['version']} gives non-finite anomaly scores")
+        if proba.shape[1] != len(models["classifier"]["classes"]) or not np.allclose(proba.sum(axis=1), 1.0):
+            raise ValueError(f"model {models['version']} gives invalid class probabilities")
+
+    def warmup(self):
+        """Load now and run one row through every model to fault pages in."""
+        models = self.get()
+        self.validate(models)
+        return models
+
+    def reload(self, version=None):
+        """Load, check and swap in a version (default: the latest)."""
+        with self._reload_lock:
+            version = version or self.latest_version()
+            if version != DEFAULT_VERSION and version not in self.versions():
+                raise ValueError(f"unknown model version: {version}")
+            models = self._load(version)
+            self.validate(models)
+            previous = self._models
+            self._models = models
+            logger.info(
+                "model %s -> %s",
+                previous["version"] if previous else None,
+                version
+            )
+            return version
+
+    #Worker processes follow the API process's active version
+    def ensure(self, version):
+        if self._models is None or self._models["version"] != version:
+            with self._reload_lock:
+                if self._models is None or self._models["version"] != version:
+                    self._models = self._load(version)
+        return self._models
+
+    def watch(self, stop, interval=MODEL_WATCH_INTERVAL):
+        while not stop.wait(interval):
+            try:
+                latest = self.latest_version()
+                if latest != self.version:
+                    self.reload(latest)
+            except Exception as e:
+                logger.error("model reload failed: %s", e)
+
+registry = ModelRegistry()
+
+#Active model version as a label, absent until the models load
+metrics.Gauge(
+    "aq_model_info", "Active model version", ["version"],
+    fn=lambda: [((registry._models["version"],), 1)] if registry._models is not None else []
+)
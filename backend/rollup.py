@@ -0,0 +1,265 @@
+import os
+import math
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from lineproto import MEASUREMENT, encode_point
+
+#CONFIG
+ROLLUP_INTERVALS = os.getenv("ROLLUP_INTERVALS", "1m,1h")                 # "" = off
+ROLLUP_FLUSH_INTERVAL = float(os.getenv("ROLLUP_FLUSH_INTERVAL", 10))     # seconds between writes of updated buckets
+ROLLUP_LATENESS = float(os.getenv("ROLLUP_LATENESS", 300))                # seconds a past bucket still takes readings
+ROLLUP_MAX_DEVICES = int(os.getenv("ROLLUP_MAX_DEVICES", 10000))
+
+UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+VALUES = ("mq", "temp", "hum")
+
+logger = logging.getLogger(__name__)
+
+#"1m,1h" -> [("1m", 60), ("1h", 3600)]
+def parse_intervals(spec):
+    intervals = []
+    for name in spec.split(","):
+        name = name.strip()
+        if name:
+            intervals.append((name, int(name[:-1]) * UNITS[name[-1]]))
+    return intervals
+
+#Aggregates of one device over one interval
+class Bucket:
+    __slots__ = ("count", "scored", "anomalies", "score_sum", "gas_norm_sum", "gas_norm_count", "sums", "mins", "maxs", "classes")
+
+    def __init__(self):
+        self.count = 0
+        self.scored = 0
+        self.anomalies = 0
+        self.score_sum = 0.0
+        self.gas_norm_sum = 0.0
+        self.gas_norm_count = 0
+        self.sums = [0.0] * len(VALUES)
+        self.mins = [math.inf] * len(VALUES)
+        self.maxs = [-math.inf] * len(VALUES)
+        self.classes = {}
+
+    #One reading, without the numpy grouping of Rollups.add
+    def add_one(self, values, gas_norm, aq_level, anomaly, anomaly_score):
+        self.count += 1
+        for j, v in enumerate(values):
+            self.sums[j] += v
+            if v < self.mins[j]:
+                self.mins[j] = v
+            if v > self.maxs[j]:
+                self.maxs[j] = v
+        if math.isfinite(gas_norm):
+            self.gas_norm_sum += gas_norm
+            self.gas_norm_count += 1
+        if aq_level == aq_level:                 # NaN: warm-up
+            level = int(aq_level)
+            self.scored += 1
+            self.anomalies += anomaly == 1
+            self.score_sum += anomaly_score
+            self.classes[level] = self.classes.get(level, 0) + 1
+
+    def fields(self):
+        fields = [
+            ("count", "i", self.count),
+            ("scored", "i", self.scored),
+            ("anomalies", "i", self.anomalies),
+            ("anomaly_score_mean", "f", self.score_sum / self.scored if self.scored else math.nan),
+            ("gas_norm_mean", "f", self.gas_norm_sum / self.gas_norm_count if self.gas_norm_count else math.nan),
+        ]
+        for j, name in enumerate(VALUES):
+            fields.append((f"{name}_mean", "f", self.sums[j] / self.count))
+            fields.append((f"{name}_min", "f", self.mins[j]))
+            fields.append((f"{name}_max", "f", self.maxs[j]))
+        fields.extend((f"aq_level_{level}", "i", n) for level, n in sorted(self.classes.items()))
+        return fields
+
+class _Device:
+    __slots__ = ("horizon", "buckets")
+
+    def __init__(self):
+        self.horizon = -math.inf        # newest reading seen, unix seconds
+        self.buckets = {}               # (interval index, start) -> Bucket
+
+#Per-device rollups of the air_quality points, computed on the write path.
+#Every reading written is added to its bucket in each interval (1m and 1h
+#by default); buckets updated since the last flush are written every
+#ROLLUP_FLUSH_INTERVAL seconds as air_quality_<interval> points stamped
+#with the bucket start. A bucket is rewritten whole each time, so the
+#newest point (same series and time) replaces the partial one before it.
+#Readings arrive in time order per device, including a firmware catching
+#up after an outage; a bucket stays open until the device's newest reading
+#is ROLLUP_LATENESS past its end. Readings for a bucket already closed are
+#counted as late and left out. Rollups cover what this process writes, so
+#run one API process per set of devices.
+class Rollups:
+    def __init__(self, submit, intervals=ROLLUP_INTERVALS, flush_interval=ROLLUP_FLUSH_INTERVAL,
+                 lateness=ROLLUP_LATENESS, max_devices=ROLLUP_MAX_DEVICES):
+        self.submit = submit
+        self.intervals = parse_intervals(intervals) if isinstance(intervals, str) else list(intervals)
+        self.flush_interval = flush_interval
+        self.lateness = lateness
+        self.max_devices = max_devices
+
+        self.devices = OrderedDict()    # least recently updated first
+        self.dirty = set()              # (device_id, interval index, start)
+        self.late = {name: 0 for name, _ in self.intervals}
+        self.written = 0
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.intervals)
+
+    def start(self):
+        if self.enabled and self._thread is None:
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name="rollup-flush", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("rollup flush failed: %s", e)
+
+    def _bucket(self, device, i, start, seconds):
+        bucket = device.buckets.get((i, start))
+        # judged against what was seen before this call
+        if bucket is None and start + seconds + self.lateness >= device.horizon:
+            bucket = device.buckets[(i, start)] = Bucket()
+        return bucket
+
+    def _device(self, device_id):
+        device = self.devices.get(device_id)
+        if device is None:
+            device = self.devices[device_id] = _Device()
+        return device
+
+    #Readings as columns; aq_levels NaN for warm-up rows
+    def add(self, device_ids, ts, temp, hum, mq, gas_norm, aq_levels, anomalies, anomaly_scores):
+        if not self.enabled or not len(device_ids):
+            return
+        if len(device_ids) == 1:
+            return self._add_one(
+                device_ids[0], float(ts[0]), (float(mq[0]), float(temp[0]), float(hum[0])), float(gas_norm[0]),
+                float(aq_levels[0]), float(anomalies[0]), float(anomaly_scores[0])
+            )
+        codes = {}
+        device_codes = np.array([codes.setdefault(d, len(codes)) for d in device_ids])
+        ts = np.asarray(ts, dtype=float)
+        order = np.lexsort((ts, device_codes))
+        device_codes, ts = device_codes[order], ts[order]
+
+        values = np.column_stack([mq, temp, hum]).astype(float)[order]         # VALUES order
+        aq_levels = np.asarray(aq_levels, dtype=float)[order]
+        scored = ~np.isnan(aq_levels)
+        anomalies = np.asarray(anomalies, dtype=float)[order]
+        anomaly_scores = np.asarray(anomaly_scores, dtype=float)[order]
+        gas_norm = np.asarray(gas_norm, dtype=float)[order]
+        gas_norm_ok = np.isfinite(gas_norm)
+        levels = np.where(scored, aq_levels, 0).astype(int)
+        classes = np.zeros((len(ts), levels.max() + 1), dtype=int)
+        classes[np.flatnonzero(scored), levels[scored]] = 1
+
+        names = list(codes)
+        new_device = np.flatnonzero(np.diff(device_codes)) + 1
+        with self._lock:
+            horizons = {}
+            for i, (name, seconds) in enumerate(self.intervals):
+                starts = (ts // seconds).astype(np.int64) * seconds
+                first = np.union1d(new_device, np.flatnonzero(np.diff(starts)) + 1)
+                first = np.concatenate([[0], first]).astype(np.intp)
+                ends = np.append(first[1:], len(ts))
+
+                sums = np.add.reduceat(values, first)
+                mins = np.minimum.reduceat(values, first)
+                maxs = np.maximum.reduceat(values, first)
+                n_scored = np.add.reduceat(scored.astype(int), first)
+                n_anomalies = np.add.reduceat((scored & (anomalies == 1)).astype(int), first)
+                score_sums = np.add.reduceat(np.where(scored, anomaly_scores, 0.0), first)
+                gas_sums = np.add.reduceat(np.where(gas_norm_ok, gas_norm, 0.0), first)
+                gas_counts = np.add.reduceat(gas_norm_ok.astype(int), first)
+                class_counts = np.add.reduceat(classes, first)
+
+                for g, (a, b) in enumerate(zip(first.tolist(), ends.tolist())):
+                    device_id = names[device_codes[a]]
+                    device = self._device(device_id)
+                    horizons[device_id] = max(horizons.get(device_id, -math.inf), ts[b - 1])
+
+                    start = int(starts[a])
+                    bucket = self._bucket(device, i, start, seconds)
+                    if bucket is None:
+                        self.late[name] += b - a
+                        continue
+
+                    bucket.count += b - a
+                    bucket.scored += int(n_scored[g])
+                    bucket.anomalies += int(n_anomalies[g])
+                    bucket.score_sum += float(score_sums[g])
+                    bucket.gas_norm_sum += float(gas_sums[g])
+                    bucket.gas_norm_count += int(gas_counts[g])
+                    for j in range(len(VALUES)):
+                        bucket.sums[j] += float(sums[g, j])
+                        bucket.mins[j] = min(bucket.mins[j], float(mins[g, j]))
+                        bucket.maxs[j] = max(bucket.maxs[j], float(maxs[g, j]))
+                    for level in np.flatnonzero(class_counts[g]).tolist():
+                        bucket.classes[level] = bucket.classes.get(level, 0) + int(class_counts[g, level])
+                    self.dirty.add((device_id, i, start))
+
+            for device_id, horizon in horizons.items():
+                device = self.devices[device_id]
+                device.horizon = max(device.horizon, horizon)
+                self.devices.move_to_end(device_id)
+
+    def _add_one(self, device_id, ts, values, gas_norm, aq_level, anomaly, anomaly_score):
+        with self._lock:
+            device = self._device(device_id)
+            for i, (name, seconds) in enumerate(self.intervals):
+                start = int(ts // seconds) * seconds
+                bucket = self._bucket(device, i, start, seconds)
+                if bucket is None:
+                    self.late[name] += 1
+                    continue
+                bucket.add_one(values, gas_norm, aq_level, anomaly, anomaly_score)
+                self.dirty.add((device_id, i, start))
+            device.horizon = max(device.horizon, ts)
+            self.devices.move_to_end(device_id)
+
+    #Write buckets updated since the last flush, then forget closed ones
+    def flush(self):
+        with self._lock:
+            dirty, self.dirty = self.dirty, set()
+            lines = []
+            for device_id, i, start in sorted(dirty):
+                bucket = self.devices[device_id].buckets[(i, start)]
+                name = self.intervals[i][0]
+                lines.append(encode_point(f"{MEASUREMENT}_{name}", device_id, bucket.fields(), start * 1_000_000_000))
+
+            for device in self.devices.values():
+                for key in [k for k in device.buckets if k[1] + self.intervals[k[0]][1] + self.lateness < device.horizon]:
+                    del device.buckets[key]
+            while len(self.devices) > self.max_devices:
+                self.devices.popitem(last=False)
+
+        if lines:
+            self.submit(b"\n".join(lines), len(lines))
+            self.written += len(lines)
+        return len(lines)
+
+    def buckets(self):
+        with self._lock:
+            return sum(len(d.buckets) for d in self.devices.values())
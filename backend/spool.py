@@ -0,0 +1,159 @@
+import os
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+SUFFIX = ".lp"
+REJECTED = "rejected"            # chunks InfluxDB refused, kept for inspection
+
+#Append-only on-disk spool of line protocol
+# Segments are numbered files written oldest to newest. The writer appends
+# here while InfluxDB is down or falling behind and replays in bulk later.
+class Spool:
+    def __init__(self, path, segment_bytes, max_bytes, fsync=False):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.fsync = fsync
+
+        self.dropped_bytes = 0
+        self._lock = threading.Lock()
+        self._active = None
+        self._active_seq = None
+
+        os.makedirs(path, exist_ok=True)
+        self._sizes = {}
+        for name in os.listdir(path):
+            if name.endswith(SUFFIX):
+                seq = int(name[:-len(SUFFIX)])
+                self._sizes[seq] = os.path.getsize(self._name(seq))
+        self._next_seq = max(self._sizes, default=0) + 1
+        self.compact()
+
+    def _name(self, seq):
+        return os.path.join(self.path, f"{seq:012d}{SUFFIX}")
+
+    def pending_bytes(self):
+        return sum(self._sizes.values())
+
+    def __bool__(self):
+        return bool(self._sizes)
+
+    def append(self, payload):
+        with self._lock:
+            if self._active is None or self._sizes[self._active_seq] >= self.segment_bytes:
+                self._rotate()
+            data = payload + b"\n"
+            self._active.write(data)
+            self._active.flush()
+            if self.fsync:
+                os.fsync(self._active.fileno())
+            self._sizes[self._active_seq] += len(data)
+            self._enforce_cap()
+
+    def _rotate(self):
+        self._close_active()
+        self._active_seq = self._next_seq
+        self._next_seq += 1
+        self._active = open(self._name(self._active_seq), "ab")
+        self._sizes[self._active_seq] = 0
+
+    def _close_active(self):
+        if self._active is not None:
+            self._active.close()
+            self._active = None
+            self._active_seq = None
+
+    def _enforce_cap(self):
+        # oldest data goes first once the cap is hit
+        while self.pending_bytes() > self.max_bytes and len(self._sizes) > 1:
+            seq = min(self._sizes)
+            if seq == self._active_seq:
+                break
+            self.dropped_bytes += self._sizes.pop(seq)
+            os.remove(self._name(seq))
+            logger.warning("spool over %d bytes, dropped segment %d", self.max_bytes, seq)
+
+    def _read_lines(self, seq):
+        with open(self._name(seq), "rb") as f:
+            data = f.read()
+        lines = data.split(b"\n")
+        # a crash mid-append can leave a torn last line
+        if not data.endswith(b"\n"):
+            lines = lines[:-1]
+        return [line for line in lines if line]
+
+    def _write_segment(self, seq, lines):
+        tmp = self._name(seq) + ".tmp"
+        with open(tmp, "wb") as f:
+            for line in lines:
+                f.write(line + b"\n")
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._name(seq))
+        self._sizes[seq] = os.path.getsize(self._name(seq))
+
+    def _quarantine(self, chunk):
+        path = os.path.join(self.path, REJECTED)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        data = b"\n".join(chunk) + b"\n"
+        if size + len(data) > self.max_bytes:
+            logger.warning("%s over %d bytes, not keeping %d rejected lines", path, self.max_bytes, len(chunk))
+            return
+        with open(path, "ab") as f:
+            f.write(data)
+
+    def replay(self, send, chunk_lines=5000, max_lines=None, rejected=None):
+        """Send spooled lines oldest first; True once the spool is empty.
+
+        A chunk whose error `rejected(error, lines)` returns True for will
+        never be accepted: it is moved to the REJECTED file and replay
+        goes on. Any other error stops replay with the chunk kept.
+        """
+        with self._lock:
+            self._close_active()
+            sent = 0
+            for seq in sorted(self._sizes):
+                lines = self._read_lines(seq)
+                for i in range(0, len(lines), chunk_lines):
+                    if max_lines is not None and sent >= max_lines:
+                        self._write_segment(seq, lines[i:])
+                        return False
+                    chunk = lines[i:i + chunk_lines]
+                    try:
+                        send(b"\n".join(chunk), len(chunk))
+                    except Exception as e:
+                        if rejected is None or not rejected(e, len(chunk)):
+                            # keep only the part that did not make it
+                            self._write_segment(seq, lines[i:])
+                            raise
+                        self._quarantine(chunk)
+                    sent += len(chunk)
+                del self._sizes[seq]
+                os.remove(self._name(seq))
+            return True
+
+    def compact(self):
+        """Merge runs of small closed segments into full-size ones."""
+        with self._lock:
+            closed = [seq for seq in sorted(self._sizes) if seq != self._active_seq]
+            group, size = [], 0
+            for seq in closed + [None]:
+                if seq is not None and size + self._sizes[seq] <= self.segment_bytes:
+                    group.append(seq)
+                    size += self._sizes[seq]
+                    continue
+                if len(group) > 1:
+                    lines = []
+                    for g in group:
+                        lines.extend(self._read_lines(g))
+                    self._write_segment(group[0], lines)
+                    for g in group[1:]:
+                        del self._sizes[g]
+                        os.remove(self._name(g))
+                group, size = ([seq], self._sizes[seq]) if seq is not None else ([], 0)
+
+    def close(self):
+        with self._lock:
+            self._close_active()
@@ -0,0 +1,128 @@
+import numpy as np
+
+#Flattened tree evaluation
+# Models are exported by scripts/export_models.py as plain numpy arrays.
+# Every tree is packed into one node table; leaves point back to
+# themselves with threshold=+inf, so all rows walk all trees in lockstep
+# for max_depth steps without any per-tree Python loop.
+
+def apply_trees(X, trees):
+    # sklearn casts to float32 before comparing against thresholds
+    X = np.asarray(X, dtype=np.float32)
+    rows = np.arange(X.shape[0])[:, None]
+    node = np.repeat(trees["roots"][None, :], X.shape[0], axis=0)
+
+    feature = trees["feature"]
+    threshold = trees["threshold"]
+    left = trees["left"]
+    right = trees["right"]
+
+    for _ in range(int(trees["max_depth"])):
+        go_left = X[rows, feature[node]] <= threshold[node]
+        node = np.where(go_left, left[node], right[node])
+    return node
+
+def scale(compiled, X):
+    scaler = compiled["scaler"]
+    return (np.asarray(X, dtype=float) - scaler["mean"]) / scaler["scale"]
+
+#IsolationForest.decision_function
+def anomaly_decision_function(compiled, X):
+    return anomaly_decision_function_scaled(compiled, scale(compiled, X))
+
+def anomaly_decision_function_scaled(compiled, X_scaled):
+    anomaly = compiled["anomaly"]
+    leaves = apply_trees(X_scaled, anomaly)
+    depths = anomaly["path_length"][leaves].sum(axis=1)
+    score_samples = -(2.0 ** (-depths / anomaly["denominator"]))
+    return score_samples - anomaly["offset"]
+
+#DecisionTreeClassifier.predict_proba
+def classifier_predict_proba(compiled, X):
+    classifier = compiled["classifier"]
+    leaves = apply_trees(X, classifier)
+    return classifier["value"][leaves[:, 0]]
+
+#Building node tables from fitted sklearn models. Only fitted attributes
+#are read, so this module still imports without sklearn.
+
+#Same as sklearn.ensemble._iforest._average_path_length
+def average_path_length(n):
+    n = np.asarray(n, dtype=float)
+    out = np.zeros_like(n)
+    out[n == 2] = 1.0
+    big = n > 2
+    out[big] = 2.0 * (np.log(n[big] - 1.0) + np.euler_gamma) - 2.0 * (n[big] - 1.0) / n[big]
+    return out
+
+#Pack fitted sklearn trees into one flat node table
+def flatten_trees(estimators, estimator_features=None):
+    feature, threshold, left, right, is_leaf, roots = [], [], [], [], [], []
+    offset = 0
+
+    for i, est in enumerate(estimators):
+        tree = est.tree_
+        leaf = tree.children_left == -1
+        own = np.arange(tree.node_count) + offset
+
+        f = tree.feature.copy()
+        f[leaf] = 0
+        if estimator_features is not None:
+            f = np.asarray(estimator_features[i])[f]
+
+        feature.append(f)
+        threshold.append(np.where(leaf, np.inf, tree.threshold))
+        left.append(np.where(leaf, own, tree.children_left + offset))
+        right.append(np.where(leaf, own, tree.children_right + offset))
+        is_leaf.append(leaf)
+        roots.append(offset)
+        offset += tree.node_count
+
+    return {
+        "feature": np.ascontiguousarray(np.concatenate(feature), dtype=np.intp),
+        "threshold": np.ascontiguousarray(np.concatenate(threshold), dtype=np.float64),
+        "left": np.ascontiguousarray(np.concatenate(left), dtype=np.intp),
+        "right": np.ascontiguousarray(np.concatenate(right), dtype=np.intp),
+        "roots": np.asarray(roots, dtype=np.intp),
+        "max_depth": max(est.tree_.max_depth for est in estimators),
+    }, np.concatenate(is_leaf)
+
+#IsolationForest: leaf value = node depth + c(n_node_samples) - 1
+def flatten_isolation_forest(model, n_features):
+    subsample = model._max_features != n_features
+    anomaly, leaf = flatten_trees(model.estimators_, model.estimators_features_ if subsample else None)
+    path_length = np.concatenate([
+        est.tree_.compute_node_depths() + average_path_length(est.tree_.n_node_samples) - 1.0
+        for est in model.estimators_
+    ])
+    anomaly["path_length"] = np.where(leaf, path_length, 0.0)
+    anomaly["max_samples"] = int(model.max_samples_)
+    anomaly["denominator"] = float(len(model.estimators_) * average_path_length([model.max_samples_])[0])
+    anomaly["offset"] = float(model.offset_)
+    anomaly["contamination"] = model.contamination
+    return anomaly
+
+#Per-node arrays of a flattened forest; trees are stored back to back
+NODE_ARRAYS = ("feature", "threshold", "left", "right", "path_length")
+
+#Trees [start:] of a flattened forest, node indices shifted back to 0
+def slice_trees(trees, start):
+    first = int(trees["roots"][start])
+    out = {k: np.asarray(trees[k][first:]) for k in NODE_ARRAYS if k in trees}
+    out["left"] = out["left"] - first
+    out["right"] = out["right"] - first
+    out["roots"] = np.asarray(trees["roots"][start:]) - first
+    out["max_depth"] = int(trees["max_depth"])
+    return out
+
+#Forest b appended after forest a
+def concat_trees(a, b):
+    shift = len(a["feature"])
+    out = {}
+    for k in NODE_ARRAYS:
+        if k in a and k in b:
+            tail = b[k] + shift if k in ("left", "right") else b[k]
+            out[k] = np.ascontiguousarray(np.concatenate([a[k], tail]), dtype=np.asarray(a[k]).dtype)
+    out["roots"] = np.concatenate([a["roots"], np.asarray(b["roots"]) + shift]).astype(np.intp)
+    out["max_depth"] = max(int(a["max_depth"]), int(b["max_depth"]))
+    return out
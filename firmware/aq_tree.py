@@ -0,0 +1,16 @@
+#Generated by scripts/export_models.py from model unversioned, do not edit
+FEATURES = ('gas_norm', 'rolling_mean_10', 'rolling_std_10', 'gas_diff', 'gas_diff_norm', 'hum_adjusted_gas', 'temp_hum', 'temp_gas', 'hum_gas')
+CLASSES = (0, 1, 2, 3)
+LABELS = ('Good', 'Moderate', 'Poor', 'Hazardous')
+
+def predict(x):
+    if x[7] <= 4609.5:
+        return 0, 1.0
+    else:
+        if x[7] <= 5449.5:
+            return 1, 1.0
+        else:
+            if x[2] <= 14.753709316253662:
+                return 2, 1.0
+            else:
+                return 2, 0.8333333333333334
@@ -0,0 +1,75 @@
+import math
+
+#On-device feature engineering, a copy of backend/features.py (FeatureState)
+#for MicroPython: keep the two in step. Same window, same formulas, same
+#summation order; the ESP32 computes in float32, so values agree with the
+#backend's to float32 precision.
+
+WINDOW = 10
+EPS = 1e-5
+NAN = float("nan")
+
+FEATURES = (
+    "gas_norm",
+    "rolling_mean_10",
+    "rolling_std_10",
+    "gas_diff",
+    "gas_diff_norm",
+    "hum_adjusted_gas",
+    "temp_hum",
+    "temp_gas",
+    "hum_gas"
+)
+
+class FeatureState:
+    def __init__(self):
+        self.buf = [0.0] * WINDOW
+        self.idx = 0
+        self.count = 0
+        self.last = None
+
+    @property
+    def ready(self):
+        return self.count == WINDOW
+
+    def push(self, mq):
+        self.buf[self.idx] = mq
+        self.idx = (self.idx + 1) % WINDOW
+        if self.count < WINDOW:
+            self.count += 1
+        prev, self.last = self.last, mq
+        return prev
+
+    def stats(self):
+        if self.count < WINDOW:
+            return NAN, NAN
+        values = self.buf[self.idx:] + self.buf[:self.idx]
+        total = 0.0
+        for v in values:
+            total += v
+        mean = total / WINDOW
+        sq = 0.0
+        for v in values:
+            d = v - mean
+            sq += d * d
+        return mean, math.sqrt(sq / (WINDOW - 1))
+
+    #Feature dict for one reading, NaN rolling values until the window is full
+    def update(self, temp, hum, mq):
+        temp, hum, mq = float(temp), float(hum), float(mq)
+        prev = self.push(mq)
+        if prev is None:
+            prev = NAN
+        rolling_mean, rolling_std = self.stats()
+        gas_diff = mq - prev
+        return {
+            "gas_norm": mq / (temp * hum + 1),
+            "rolling_mean_10": rolling_mean,
+            "rolling_std_10": rolling_std,
+            "gas_diff": gas_diff,
+            "gas_diff_norm": gas_diff / (prev + EPS),
+            "hum_adjusted_gas": mq * (1 + hum / 100),
+            "temp_hum": temp * hum,
+            "temp_gas": temp * mq,
+            "hum_gas": hum * mq
+        }
@@ -1,14 +1,31 @@
 from machine import ADC, Pin, I2C
-import network, time, gc, urequests
+import network, time, gc, ubinascii, machine, ntptime, json
+import asyncio
 import dht
 import ssd1306
+from features import FeatureState
+from ringbuf import ReadingRing
+import aq_tree                          # generated by scripts/train_model.py --firmware
 
 #CONFIG
 WIFI_SSID = "WIFISSID"
 WIFI_PASS = "WIFIPASSWORD"
 
-BACKEND_URL = "http://<HOST:ip>/infer"
+BACKEND_URL = "http://<HOST:ip>/infer/packed"
 LOG_INTERVAL = 5  # seconds
+UPLOAD_BATCH = 12  # readings per upload (one a minute at LOG_INTERVAL 5)
+MAX_UPLOAD = 256  # readings per request when catching up after an outage
+RING_CAPACITY = 4096  # readings kept for upload, 40KB (~5.7h at LOG_INTERVAL 5), oldest dropped
+MQ_OVERSAMPLE = 16  # ADC reads averaged per MQ135 reading
+MQ_SAMPLE_GAP_MS = 5
+HTTP_TIMEOUT = 10  # seconds per connect / request / response
+WIFI_TIMEOUT = 15  # seconds per connection attempt
+RETRY_MAX = 60  # seconds, longest backoff between failed uploads
+DISPLAY_INTERVAL = 1  # seconds
+DEVICE_ID = ubinascii.hexlify(machine.unique_id()).decode()
+
+#Unix seconds; older ports count from 2000
+EPOCH_OFFSET = 946684800 if time.gmtime(0)[0] == 2000 else 0
 
 
 #MQ135
@@ -18,10 +35,20 @@ mq.atten(ADC.ATTN_11DB)
 #DHT11
 dht_sensor = dht.DHT11(Pin(4))
 
-#OLED 
+#OLED
 i2c = I2C(scl=Pin(22), sda=Pin(21), freq=400000)
 oled = ssd1306.SSD1306_I2C(128, 64, i2c)
 
+#Shared between the tasks below, all on one event loop
+status = {
+    "temp": None,
+    "hum": None,
+    "mq": None,
+    "label": "Warmup",
+    "anomaly": None,   # from the last upload, None when it failed
+    "error": None,
+}
+
 #OLED
 def oled_clear():
     oled.fill(0)
@@ -33,7 +60,7 @@ def oled_error(msg):
     oled.text(msg, 0, 16)
     oled.show()
 
-def oled_display(temp, hum, mq, resp):
+def oled_display(temp, hum, mq, label, anomaly):
     oled.fill(0)
     oled.text("AIR QUALITY", 0, 0)
 
@@ -41,103 +68,249 @@ def oled_display(temp, hum, mq, resp):
     oled.text("H:{}%".format(hum), 64, 16)
     oled.text("MQ:{}".format(mq), 0, 28)
 
-    if resp:
-        oled.text("AQ:", 0, 44)
-        oled.text(resp["aq_label"], 32, 44)
+    oled.text("AQ:", 0, 44)
+    oled.text(label, 32, 44)
 
-        if resp["anomaly"]:
-            oled.text("ANOMALY!", 0, 56)
-        else:
-            oled.text("Normal", 0, 56)
+    if anomaly is None:
+        oled.text("OFFLINE", 0, 56)
+    elif anomaly:
+        oled.text("ANOMALY!", 0, 56)
     else:
-        oled.text("BACKEND ERR", 0, 44)
+        oled.text("Normal", 0, 56)
 
     oled.show()
 
 #WIFI
-def wifi_connect():
-    wlan = network.WLAN(network.STA_IF)
+wlan = network.WLAN(network.STA_IF)
+
+async def wifi_connect():
     wlan.active(True)
+    if wlan.isconnected():
+        return True
+
+    wlan.connect(WIFI_SSID, WIFI_PASS)
+    for _ in range(WIFI_TIMEOUT * 4):
+        if wlan.isconnected():
+            break
+        await asyncio.sleep_ms(250)
 
     if not wlan.isconnected():
-        oled_clear()
-        oled.text("Connecting WiFi", 0, 0)
-        oled.show()
+        print("WiFi FAIL")
+        return False
 
-        wlan.connect(WIFI_SSID, WIFI_PASS)
+    print("WiFi connected:", wlan.ifconfig())
+    sync_clock()
+    return True
 
-        timeout = 15
-        while not wlan.isconnected() and timeout > 0:
-            time.sleep(1)
-            timeout -= 1
+#CLOCK
+#Until the first NTP sync the RTC counts from boot, so readings taken
+#before it are stamped with time since boot and moved to real time by the
+#jump settime() makes. Nothing is uploaded until then.
+clock_synced = False
 
-    if wlan.isconnected():
-        ip = wlan.ifconfig()[0]
-        oled.text("WiFi OK", 0, 16)
-        oled.text(ip, 0, 28)
-        oled.show()
-        print("WiFi connected:", wlan.ifconfig())
-        return True
-    else:
-        oled_error("WiFi FAIL")
-        return False
+def sync_clock():
+    global clock_synced
+    before = time.time()
+    try:
+        ntptime.settime()           # readings are uploaded with their own timestamps
+    except Exception as e:
+        print("NTP error:", e)
+        return clock_synced
+    if not clock_synced:
+        ring.shift(time.time() - before)
+        clock_synced = True
+    return True
+
+#LOCAL CLASSIFIER
+state = FeatureState()
+
+def classify(temp, hum, mq):
+    feats = state.update(temp, hum, mq)
+    if not state.ready:
+        return "Warmup"
+    level, confidence = aq_tree.predict([feats[f] for f in aq_tree.FEATURES])
+    return aq_tree.LABELS[level]
+
+#SENSORS
+ring = ReadingRing(RING_CAPACITY, DEVICE_ID, MAX_UPLOAD)
+readings_ready = asyncio.Event()
+
+#MQ135 is noisy: average a burst of ADC reads
+async def read_mq():
+    total = 0
+    for _ in range(MQ_OVERSAMPLE):
+        total += mq.read()
+        await asyncio.sleep_ms(MQ_SAMPLE_GAP_MS)
+    return (total + MQ_OVERSAMPLE // 2) // MQ_OVERSAMPLE
+
+#Fixed cadence: the next reading is due LOG_INTERVAL after the last one
+#was due, however long this one or the network took
+async def sampler():
+    due = time.ticks_ms()
+    while True:
+        try:
+            dht_sensor.measure()
+            temp = dht_sensor.temperature()
+            hum = dht_sensor.humidity()
+            mq_val = await read_mq()
+
+            status["label"] = classify(temp, hum, mq_val)
+            status["temp"], status["hum"], status["mq"] = temp, hum, mq_val
+            status["error"] = None
+            ring.push(time.time() + EPOCH_OFFSET, temp, hum, mq_val)
+            if len(ring) >= UPLOAD_BATCH:
+                readings_ready.set()
+            print("Read:", temp, hum, mq_val, status["label"])
+
+        except Exception as e:
+            print("Sensor error:", e)
+            status["error"] = "SENSOR ERR"
+
+        gc.collect()
+        due = time.ticks_add(due, LOG_INTERVAL * 1000)
+        wait = time.ticks_diff(due, time.ticks_ms())
+        if wait < 0:                    # fell behind, don't burst to catch up
+            due = time.ticks_ms()
+            wait = 0
+        await asyncio.sleep_ms(wait)
 
 #BACKEND
-def send_to_backend(temp, hum, mq):
-    payload = {
-        "temp": temp,
-        "hum": hum,
-        "mq": mq
-    }
+#Minimal HTTP/1.1 over one kept-alive connection, every step under a timeout
+class Backend:
+    def __init__(self, url):
+        _, _, hostport, path = url.split("/", 3)
+        host, _, port = hostport.partition(":")
+        self.host = host
+        self.port = int(port) if port else 80
+        self.path = "/" + path
+        self.reader = None
+        self.writer = None
+        self.sent = False               # whole request written on this attempt
 
-    try:
-        r = urequests.post(
-            BACKEND_URL,
-            json=payload,
-            headers={"Content-Type": "application/json"}
-        )
+    async def close(self):
+        if self.writer is not None:
+            try:
+                self.writer.close()
+                await self.writer.wait_closed()
+            except Exception:
+                pass
+        self.reader = self.writer = None
 
-        if r.status_code == 200:
-            data = r.json()
-            r.close()
-            return data
-        else:
-            r.close()
-            return None
+    #A kept-alive connection the server has since dropped gets one retry,
+    #but only if the request was not fully written: past that point the
+    #server may have taken it, and a retry would write the batch twice
+    async def post(self, body, content_type):
+        reused = self.writer is not None
+        self.sent = False
+        try:
+            return await self._post(body, content_type)
+        except Exception:
+            await self.close()
+            if not reused or self.sent:
+                raise
+        return await self._post(body, content_type)
 
-    except Exception as e:
-        print("HTTP error:", e)
-        return None
+    async def _post(self, body, content_type):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port), HTTP_TIMEOUT
+            )
+        self.writer.write(
+            "POST {} HTTP/1.1\r\nHost: {}\r\nContent-Type: {}\r\nContent-Length: {}\r\n\r\n".format(
+                self.path, self.host, content_type, len(body)
+            ).encode()
+        )
+        self.writer.write(body)
+        await asyncio.wait_for(self.writer.drain(), HTTP_TIMEOUT)
+        self.sent = True
 
-oled_clear()
-oled.text("Booting...", 0, 0)
-oled.show()
-time.sleep(1)
+        status_line = await asyncio.wait_for(self.reader.readline(), HTTP_TIMEOUT)
+        if not status_line:
+            raise OSError("connection closed")
+        code = int(status_line.split()[1])
+        length = 0
+        keep_alive = True
+        while True:
+            line = await asyncio.wait_for(self.reader.readline(), HTTP_TIMEOUT)
+            if line in (b"\r\n", b""):
+                break
+            name, _, value = line.decode().partition(":")
+            name = name.lower()
+            if name == "content-length":
+                length = int(value)
+            elif name == "connection" and value.strip().lower() == "close":
+                keep_alive = False
+        data = await asyncio.wait_for(self.reader.readexactly(length), HTTP_TIMEOUT) if length else b""
+        if not keep_alive:
+            await self.close()
+        return code, data
 
-wifi_connect()
+backend = Backend(BACKEND_URL)
 
-if not wifi_connect():
+#Packed batches (see ringbuf.py); readings leave the ring only once the
+#backend has them. Failures back off exponentially up to RETRY_MAX.
+async def uploader():
+    delay = 1
     while True:
-        time.sleep(5)
-        
-while True:
-    try:
-        dht_sensor.measure()
+        await readings_ready.wait()
+        readings_ready.clear()
 
-        temp = dht_sensor.temperature()
-        hum = dht_sensor.humidity()
-        mq_val = mq.read()
+        while len(ring) >= UPLOAD_BATCH:
+            if not wlan.isconnected() and not await wifi_connect():
+                status["anomaly"] = None
+                break
+            if not clock_synced and not sync_clock():
+                status["anomaly"] = None
+                break
+            try:
+                code, data = await backend.post(ring.pack(MAX_UPLOAD), "application/x-aq-packed")
+                if code != 200:
+                    raise OSError("HTTP {}".format(code))
+                response = json.loads(data)
+                ring.drop(response["accepted"])
+                status["anomaly"] = response["anomaly"]
+                print("Sent:", response["accepted"], "readings,", len(ring), "waiting")
+                delay = 1
+            except Exception as e:
+                print("HTTP error:", e)
+                status["anomaly"] = None
+                await backend.close()
+                break
+            gc.collect()
 
-        response = send_to_backend(temp, hum, mq_val)
+        # the connection is only reused for back-to-back uploads: the
+        # server drops idle ones long before the next batch is due
+        await backend.close()
+        if len(ring) >= UPLOAD_BATCH:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, RETRY_MAX)
+            readings_ready.set()
+
+#DISPLAY
+async def display():
+    while True:
+        if status["error"]:
+            oled_error(status["error"])
+        elif status["temp"] is not None:
+            oled_display(status["temp"], status["hum"], status["mq"], status["label"], status["anomaly"])
+        await asyncio.sleep(DISPLAY_INTERVAL)
 
-        oled_display(temp, hum, mq_val, response)
+async def main():
+    oled_clear()
+    oled.text("Booting...", 0, 0)
+    oled.text("Connecting WiFi", 0, 16)
+    oled.show()
 
-        print("Sent:", temp, hum, mq_val)
-        print("Resp:", response)
+    # sampling starts right away; readings wait in the ring while offline
+    asyncio.create_task(sampler())
+    if await wifi_connect():
+        oled.text("WiFi OK", 0, 32)
+        oled.text(wlan.ifconfig()[0], 0, 44)
+    else:
+        oled.text("WiFi FAIL", 0, 32)
+    oled.show()
 
-    except Exception as e:
-        print("Loop error:", e)
-        oled_error("SENSOR ERR")
+    asyncio.create_task(uploader())
+    await display()
 
-    gc.collect()
-    time.sleep(LOG_INTERVAL)
+asyncio.run(main())
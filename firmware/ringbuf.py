@@ -0,0 +1,72 @@
+import struct
+
+#Readings waiting for upload, in one preallocated bytearray.
+#Records use the packed batch format of backend/packed.py (keep the two in
+#step): ts u32, temp i16 and hum i16 in tenths, mq u16, little-endian.
+#When full, the oldest reading is overwritten. pack() builds a request
+#body in a second preallocated buffer, so uploads allocate nothing here.
+
+MAGIC = b"AQ"
+VERSION = 1
+RECORD = "<IhhH"
+RECORD_SIZE = 10
+
+class ReadingRing:
+    def __init__(self, capacity, device_id, max_batch):
+        self.capacity = capacity
+        self.buf = bytearray(capacity * RECORD_SIZE)
+        self.start = 0
+        self.count = 0
+        self.dropped = 0
+        self.mark = 0
+
+        device_id = device_id.encode()
+        self.header_size = len(MAGIC) + 2 + len(device_id) + 2
+        self.max_batch = max_batch
+        self.out = bytearray(self.header_size + max_batch * RECORD_SIZE)
+        self.out[0:2] = MAGIC
+        self.out[2] = VERSION
+        self.out[3] = len(device_id)
+        self.out[4:4 + len(device_id)] = device_id
+
+    def __len__(self):
+        return self.count
+
+    def push(self, ts, temp, hum, mq):
+        if self.count == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.count -= 1
+            self.dropped += 1
+        i = (self.start + self.count) % self.capacity
+        struct.pack_into(RECORD, self.buf, i * RECORD_SIZE, int(ts), round(temp * 10), round(hum * 10), mq)
+        self.count += 1
+
+    #Add `seconds` to the timestamp of every waiting reading
+    def shift(self, seconds):
+        for k in range(self.count):
+            pos = ((self.start + k) % self.capacity) * RECORD_SIZE
+            struct.pack_into("<I", self.buf, pos, struct.unpack_from("<I", self.buf, pos)[0] + seconds)
+
+    #Body with the oldest n readings (at most max_batch), as a memoryview
+    def pack(self, n):
+        n = min(n, self.count, self.max_batch)
+        self.mark = self.dropped
+        struct.pack_into("<H", self.out, self.header_size - 2, n)
+        src = memoryview(self.buf)
+        first = min(n, self.capacity - self.start)
+        pos = self.header_size
+        a = self.start * RECORD_SIZE
+        self.out[pos:pos + first * RECORD_SIZE] = src[a:a + first * RECORD_SIZE]
+        if n > first:
+            pos += first * RECORD_SIZE
+            self.out[pos:pos + (n - first) * RECORD_SIZE] = src[0:(n - first) * RECORD_SIZE]
+        return memoryview(self.out)[:self.header_size + n * RECORD_SIZE]
+
+    #Forget the oldest n readings once the backend has them; any of them
+    #overwritten since pack() are already gone
+    def drop(self, n):
+        n = min(n - (self.dropped - self.mark), self.count)
+        if n <= 0:
+            return
+        self.start = (self.start + n) % self.capacity
+        self.count -= n
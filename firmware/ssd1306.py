@@ -1,5 +1,6 @@
 # MicroPython SSD1306 OLED driver, I2C and SPI interfaces
 
+import micropython
 from micropython import const
 import framebuf
 
@@ -25,8 +26,31 @@ SET_VCOM_DESEL = const(0xDB)
 SET_CHARGE_PUMP = const(0x8D)
 
 
+# First and last index in [start, end) where a and b differ, else end / -1
+@micropython.viper
+def _first_diff(a: ptr8, b: ptr8, start: int, end: int) -> int:
+    i = start
+    while i < end:
+        if a[i] != b[i]:
+            return i
+        i += 1
+    return end
+
+
+@micropython.viper
+def _last_diff(a: ptr8, b: ptr8, start: int, end: int) -> int:
+    i = end - 1
+    while i >= start:
+        if a[i] != b[i]:
+            return i
+        i -= 1
+    return -1
+
+
 # Subclassing FrameBuffer provides support for graphics primitives
 # http://docs.micropython.org/en/latest/pyboard/library/framebuf.html
+# show() only sends what changed: `shadow` mirrors the panel's RAM, and per
+# page just the column span that differs from it is written.
 class SSD1306(framebuf.FrameBuffer):
     def __init__(self, width, height, external_vcc):
         self.width = width
@@ -34,6 +58,12 @@ class SSD1306(framebuf.FrameBuffer):
         self.external_vcc = external_vcc
         self.pages = self.height // 8
         self.buffer = bytearray(self.pages * self.width)
+        self.shadow = bytearray(self.pages * self.width)
+        self.view = memoryview(self.buffer)
+        self.shadow_view = memoryview(self.shadow)
+        # SET_COL_ADDR x0 x1 SET_PAGE_ADDR p0 p1, sent as one write
+        self.window = bytearray((SET_COL_ADDR, 0, 0, SET_PAGE_ADDR, 0, 0))
+        self.col_offset = (128 - self.width) // 2 if self.width != 128 else 0  # narrow displays use centred columns
         super().__init__(self.buffer, self.width, self.height, framebuf.MONO_VLSB)
         self.init_display()
 
@@ -74,7 +104,7 @@ class SSD1306(framebuf.FrameBuffer):
         ):  # on
             self.write_cmd(cmd)
         self.fill(0)
-        self.show()
+        self.show(full=True)
 
     def poweroff(self):
         self.write_cmd(SET_DISP)
@@ -92,22 +122,40 @@ class SSD1306(framebuf.FrameBuffer):
     def rotate(self, rotate):
         self.write_cmd(SET_COM_OUT_DIR | ((rotate & 1) << 3))
         self.write_cmd(SET_SEG_REMAP | (rotate & 1))
-
-    def show(self):
-        x0 = 0
-        x1 = self.width - 1
-        if self.width != 128:
-            # narrow displays use centred columns
-            col_offset = (128 - self.width) // 2
-            x0 += col_offset
-            x1 += col_offset
-        self.write_cmd(SET_COL_ADDR)
-        self.write_cmd(x0)
-        self.write_cmd(x1)
-        self.write_cmd(SET_PAGE_ADDR)
-        self.write_cmd(0)
-        self.write_cmd(self.pages - 1)
-        self.write_data(self.buffer)
+        # segment remap only applies to data written after it, so the
+        # panel RAM no longer matches the shadow: resend everything
+        self.show(full=True)
+
+    def set_window(self, x0, x1, p0, p1):
+        w = self.window
+        w[1] = x0 + self.col_offset
+        w[2] = x1 + self.col_offset
+        w[4] = p0
+        w[5] = p1
+        self.write_cmds(w)
+
+    # Returns the number of bytes sent
+    def show(self, full=False):
+        if full:
+            self.set_window(0, self.width - 1, 0, self.pages - 1)
+            self.write_data(self.buffer)
+            self.shadow_view[:] = self.view
+            return len(self.buffer)
+
+        sent = 0
+        width = self.width
+        for page in range(self.pages):
+            start = page * width
+            end = start + width
+            lo = _first_diff(self.buffer, self.shadow, start, end)
+            if lo == end:
+                continue
+            hi = _last_diff(self.buffer, self.shadow, lo, end) + 1
+            self.set_window(lo - start, hi - start - 1, page, page)
+            self.write_data(self.view[lo:hi])
+            self.shadow_view[lo:hi] = self.view[lo:hi]
+            sent += hi - lo
+        return sent
 
 
 class SSD1306_I2C(SSD1306):
@@ -116,6 +164,7 @@ class SSD1306_I2C(SSD1306):
         self.addr = addr
         self.temp = bytearray(2)
         self.write_list = [b"\x40", None]  # Co=0, D/C#=1
+        self.cmd_list = [b"\x00", None]  # Co=0, D/C#=0: a run of commands
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
@@ -123,6 +172,10 @@ class SSD1306_I2C(SSD1306):
         self.temp[1] = cmd
         self.i2c.writeto(self.addr, self.temp)
 
+    def write_cmds(self, cmds):
+        self.cmd_list[1] = cmds
+        self.i2c.writevto(self.addr, self.cmd_list)
+
     def write_data(self, buf):
         self.write_list[1] = buf
         self.i2c.writevto(self.addr, self.write_list)
@@ -138,6 +191,7 @@ class SSD1306_SPI(SSD1306):
         self.dc = dc
         self.res = res
         self.cs = cs
+        self.cmd = bytearray(1)
         import time
 
         self.res(1)
@@ -148,11 +202,15 @@ class SSD1306_SPI(SSD1306):
         super().__init__(width, height, external_vcc)
 
     def write_cmd(self, cmd):
+        self.cmd[0] = cmd
+        self.write_cmds(self.cmd)
+
+    def write_cmds(self, cmds):
         self.spi.init(baudrate=self.rate, polarity=0, phase=0)
         self.cs(1)
         self.dc(0)
         self.cs(0)
-        self.spi.write(bytearray([cmd]))
+        self.spi.write(cmds)
         self.cs(1)
 
     def write_data(self, buf):
@@ -0,0 +1,326 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import pyarrow.parquet as pq          #type:ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from features import WINDOW, compute_features, feature_matrix      #type:ignore
+from lineproto import field_template, encode_lines                 #type:ignore
+from registry import ModelRegistry                                 #type:ignore
+from ml import score_features                                      #type:ignore
+from data_prep import spill, peak_memory_mb, _partition, CHUNK_MB
+
+try:
+    import resource
+except ImportError:                   # Windows
+    resource = None
+
+# CONFIG
+RAW_PATH = "../dataset/raw.jsonl"
+MODEL_DIR = "../backend/models"
+CHECKPOINT_DIR = "outputs"
+DAY = 86400
+WRITE_LINES = 5000                    # points per InfluxDB write
+WRITE_MAX_RETRIES = 5
+WRITE_RETRY_DELAY = 0.5               # seconds, doubled per retry
+LOOKBACK_DAYS = 1                     # InfluxDB: how far back a day's rolling window is primed from
+
+#Re-scores stored readings with a given model version and writes the
+#results as new points tagged with that version (old points are kept).
+#The unit of work is one device-day: its raw readings are read, features
+#computed in one vectorised pass (the rolling window primed with the
+#device's readings just before the day), scored and written as line
+#protocol. Units run in a process pool; each finished unit is appended to
+#a checkpoint file, and a rerun with the same tag skips those. Memory is
+#bounded by one device-day per worker.
+#Sources: a raw JSONL capture (spilled by device/day like data_prep.py)
+#or the InfluxDB bucket itself. Sinks: InfluxDB or line-protocol files.
+
+def _day_start(day):
+    return datetime.fromtimestamp(day * DAY, tz=timezone.utc)
+
+def _day_number(date):
+    return int(datetime.strptime(date, "%Y-%m-%d").replace(tzinfo=timezone.utc).timestamp()) // DAY
+
+#Sources: units() -> [(device_id, day)], read() -> ts_ns, temp, hum, mq
+#in time order, history() -> up to WINDOW - 1 mq values before the day
+class JsonlSource:
+    def __init__(self, path, tmp_dir, chunk_mb=CHUNK_MB):
+        self.path = path
+        self.tmp_dir = tmp_dir
+        self.chunk_mb = chunk_mb
+        self.partitions = {}
+
+    def units(self, first_day, last_day):
+        _, self.partitions = spill(self.path, self.tmp_dir, int(self.chunk_mb * 1024 * 1024))
+        return [
+            (device_id, day)
+            for device_id in sorted(self.partitions)
+            for day in sorted(self.partitions[device_id])
+            if first_day <= day <= last_day
+        ]
+
+    def _read(self, device_id, day):
+        table = pq.read_table(_partition(self.tmp_dir, device_id, day))
+        order = np.argsort(table["ts"].to_numpy(), kind="stable")
+        return {c: table[c].to_numpy(zero_copy_only=False)[order] for c in ("ts", "temp", "hum", "mq")}
+
+    def read(self, device_id, day):
+        raw = self._read(device_id, day)
+        return (raw["ts"] * 1e9).astype(np.int64), raw["temp"], raw["hum"], raw["mq"]
+
+    #Carried across gaps, like data_prep.py
+    def history(self, device_id, day):
+        history = np.empty(0)
+        for earlier in sorted((d for d in self.partitions[device_id] if d < day), reverse=True):
+            history = np.concatenate([self._read(device_id, earlier)["mq"], history])
+            if len(history) >= WINDOW - 1:
+                break
+        return history[-(WINDOW - 1):]
+
+_UNITS_QUERY = """
+from(bucket: _bucket)
+  |> range(start: _start, stop: _stop)
+  |> filter(fn: (r) => r._measurement == "air_quality" and r._field == "mq"{version})
+  |> group(columns: ["device_id"])
+  |> aggregateWindow(every: 1d, fn: count, createEmpty: false, timeSrc: "_start")
+"""
+
+#Rows of every model_version tag hold the same readings: keep one per time
+_READ_QUERY = """
+from(bucket: _bucket)
+  |> range(start: _start, stop: _stop)
+  |> filter(fn: (r) => r._measurement == "air_quality" and r.device_id == _device_id{version})
+  |> filter(fn: (r) => r._field == "temp" or r._field == "hum" or r._field == "mq")
+  |> pivot(rowKey: ["_time"], columnKey: ["_field"], valueColumn: "_value")
+  |> group()
+  |> unique(column: "_time")
+  |> sort(columns: ["_time"])
+  |> keep(columns: ["_time", "temp", "hum", "mq"]){tail}
+"""
+
+_clients = {}
+
+def influx_client(url, token, org):
+    from influxdb_client import InfluxDBClient                     #type:ignore
+    key = (url, token, org)
+    if key not in _clients:
+        _clients[key] = InfluxDBClient(url=url, token=token, org=org, timeout=120_000)
+    return _clients[key]
+
+class InfluxSource:
+    def __init__(self, url, token, org, bucket, source_version=None, lookback_days=LOOKBACK_DAYS):
+        self.url, self.token, self.org, self.bucket = url, token, org, bucket
+        self.source_version = source_version
+        self.lookback_days = lookback_days
+
+    def _query(self, template, tail="", **params):
+        version = " and r.model_version == _source_version" if self.source_version else ""
+        params = dict(params, bucket=self.bucket, source_version=self.source_version)
+        # sent as Flux options, one per name
+        params = {f"_{k}": v for k, v in params.items() if v is not None}
+        query_api = influx_client(self.url, self.token, self.org).query_api()
+        return query_api.query(template.format(version=version, tail=tail), params=params)
+
+    def units(self, first_day, last_day):
+        tables = self._query(_UNITS_QUERY, start=_day_start(first_day), stop=_day_start(last_day + 1))
+        units = {
+            (record.values["device_id"], int(record.get_time().timestamp()) // DAY)
+            for table in tables for record in table.records
+        }
+        return sorted(units)
+
+    def _read(self, device_id, start, stop, tail=""):
+        tables = self._query(_READ_QUERY, tail, device_id=device_id, start=start, stop=stop)
+        records = [r for table in tables for r in table.records]
+        ts = np.array([int(r.get_time().timestamp() * 1e6) * 1000 for r in records], dtype=np.int64)
+        columns = [np.array([r.values.get(c) for r in records], dtype=float) for c in ("temp", "hum", "mq")]
+        # a reading missing a field can't be scored
+        keep = ~np.isnan(np.column_stack(columns)).any(axis=1) if len(ts) else np.zeros(0, dtype=bool)
+        return (ts[keep], *(c[keep] for c in columns))
+
+    def read(self, device_id, day):
+        return self._read(device_id, _day_start(day), _day_start(day + 1))
+
+    def history(self, device_id, day):
+        start = _day_start(day) - timedelta(days=self.lookback_days)
+        _, _, _, mq = self._read(device_id, start, _day_start(day), f"\n  |> tail(n: {WINDOW - 1})")
+        return mq
+
+#Sinks: write(device_id, day, payloads), called once per unit
+class InfluxSink:
+    def __init__(self, url, token, org, bucket):
+        self.url, self.token, self.org, self.bucket = url, token, org, bucket
+
+    def write(self, device_id, day, payloads):
+        from influxdb_client.client.write_api import SYNCHRONOUS   #type:ignore
+        write_api = influx_client(self.url, self.token, self.org).write_api(write_options=SYNCHRONOUS)
+        for payload in payloads:
+            delay = WRITE_RETRY_DELAY
+            for attempt in range(WRITE_MAX_RETRIES + 1):
+                try:
+                    write_api.write(bucket=self.bucket, record=payload)
+                    break
+                except Exception:
+                    if attempt == WRITE_MAX_RETRIES:
+                        raise
+                    time.sleep(delay)
+                    delay *= 2
+
+#One file per unit, so a rerun overwrites rather than duplicates
+class FileSink:
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+
+    def write(self, device_id, day, payloads):
+        path = os.path.join(_partition(self.output_dir, device_id, _day_start(day).strftime("%Y-%m-%d")), "points.lp")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", "wb") as f:
+            for payload in payloads:
+                f.write(payload + b"\n")
+        os.replace(path + ".tmp", path)
+
+#Worker state, set once per process
+_state = {}
+
+def _init_worker(source, sink, model_dir, version, tag):
+    models = ModelRegistry(model_dir).ensure(version)
+    _state.update(
+        source=source,
+        sink=sink,
+        models=models,
+        template=field_template(models["features"]),
+        tag=tag
+    )
+
+def rescore(unit):
+    device_id, day = unit
+    s = _state
+    features = s["models"]["features"]
+    ts, temp, hum, mq = s["source"].read(device_id, day)
+    if not len(ts):
+        return device_id, day, 0
+
+    X = feature_matrix(compute_features(temp, hum, mq, s["source"].history(device_id, day)), features)
+    aq_levels, confidence, anomalies, anomaly_scores = score_features(X, s["models"])
+
+    payloads = (
+        encode_lines(
+            s["template"], [device_id] * (end - start), ts[start:end],
+            temp[start:end], hum[start:end], mq[start:end], X[start:end], features,
+            aq_levels[start:end], confidence[start:end], anomalies[start:end], anomaly_scores[start:end],
+            s["tag"]
+        )
+        for start, end in ((i, min(i + WRITE_LINES, len(ts))) for i in range(0, len(ts), WRITE_LINES))
+    )
+    s["sink"].write(device_id, day, payloads)
+    return device_id, day, len(ts)
+
+#Checkpoint: one finished unit per line
+def load_checkpoint(path):
+    if not os.path.isfile(path):
+        return set()
+    with open(path) as f:
+        return {tuple(json.loads(line)) for line in f if line.strip()}
+
+def run(units, source, sink, model_dir, version, tag, checkpoint, jobs):
+    done = load_checkpoint(checkpoint)
+    todo = [u for u in units if tuple(u) not in done]
+    os.makedirs(os.path.dirname(os.path.abspath(checkpoint)), exist_ok=True)
+
+    rows = 0
+    with open(checkpoint, "a") as ckpt:
+        def finished(result):
+            nonlocal rows
+            device_id, day, n = result
+            rows += n
+            ckpt.write(json.dumps([device_id, day]) + "\n")
+            ckpt.flush()
+
+        if jobs == 1:
+            _init_worker(source, sink, model_dir, version, tag)
+            for unit in todo:
+                finished(rescore(unit))
+        else:
+            with ProcessPoolExecutor(
+                max_workers=jobs, initializer=_init_worker, initargs=(source, sink, model_dir, version, tag)
+            ) as pool:
+                # a few units queued per worker, not the whole backlog
+                pending = set()
+                for unit in todo:
+                    if len(pending) >= jobs * 4:
+                        completed, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in completed:
+                            finished(future.result())
+                    pending.add(pool.submit(rescore, unit))
+                for future in pending:
+                    finished(future.result())
+
+    return {"units": len(units), "skipped": len(units) - len(todo), "rows": rows}
+
+def peak_worker_memory_mb():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score stored readings with a model version")
+    parser.add_argument("--source", choices=["jsonl", "influx"], default="jsonl")
+    parser.add_argument("--input", default=RAW_PATH, help="raw JSONL readings, for --source jsonl")
+    parser.add_argument("--source-version", help="only read points tagged with this model_version (influx)")
+    parser.add_argument("--start", help="first day, YYYY-MM-DD (required for influx)")
+    parser.add_argument("--stop", help="last day, YYYY-MM-DD, default: today")
+    parser.add_argument("--model-dir", default=MODEL_DIR)
+    parser.add_argument("--version", help="model version to score with, default: the registry's active one")
+    parser.add_argument("--tag", help="model_version tag for the new points, default: the version")
+    parser.add_argument("--output", help="write line-protocol files here instead of to InfluxDB")
+    parser.add_argument("--bucket", help="InfluxDB bucket to write, default: INFLUX_BUCKET")
+    parser.add_argument("--checkpoint", help=f"finished units, default: {CHECKPOINT_DIR}/backfill-<tag>.done")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="parallel processes")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_MB, help="JSONL read per chunk")
+    parser.add_argument("--lookback-days", type=int, default=LOOKBACK_DAYS, help="influx: window priming range")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    version = args.version or ModelRegistry(args.model_dir).latest_version()
+    tag = args.tag or version
+    checkpoint = args.checkpoint or os.path.join(CHECKPOINT_DIR, f"backfill-{tag}.done")
+    first_day = _day_number(args.start) if args.start else 0
+    last_day = _day_number(args.stop) if args.stop else int(time.time()) // DAY
+
+    if args.source == "influx" or not args.output:
+        from dotenv import load_dotenv                             #type:ignore
+        load_dotenv()
+        influx = (os.getenv("INFLUX_URL"), os.getenv("INFLUX_TOKEN"), os.getenv("INFLUX_ORG"))
+        bucket = os.getenv("INFLUX_BUCKET")
+
+    sink = FileSink(args.output) if args.output else InfluxSink(*influx, args.bucket or bucket)
+    tmp_dir = None
+    if args.source == "jsonl":
+        tmp_dir = tempfile.mkdtemp(prefix="aq-backfill-", dir=os.path.dirname(os.path.abspath(args.input)))
+        source = JsonlSource(args.input, tmp_dir, args.chunk_mb)
+    else:
+        if not args.start:
+            parser.error("--start is required with --source influx")
+        source = InfluxSource(*influx, bucket, args.source_version, args.lookback_days)
+
+    try:
+        units = source.units(first_day, last_day)
+        stats = run(units, source, sink, args.model_dir, version, tag, checkpoint, args.jobs)
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    elapsed = time.perf_counter() - start
+    print(f"Backfill with model {version}, tagged model_version={tag}")
+    print(f"{stats['units']} device-days ({stats['skipped']} already done), {stats['rows']} readings re-scored")
+    print(f"{stats['rows'] / elapsed:,.0f} readings/s ({elapsed:.2f}s), peak memory "
+          f"{peak_memory_mb():.0f} MB main, {peak_worker_memory_mb():.0f} MB per worker")
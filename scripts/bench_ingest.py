@@ -0,0 +1,149 @@
+import os
+import sys
+import time
+import socket
+import argparse
+import tempfile
+import subprocess
+import http.client
+import json
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+import packed                                                          #type:ignore
+from benchmark import FakeInflux, start_fake_influx, synthetic, BACKEND_DIR
+
+#Backend CPU per reading for each way in: JSON /infer (one reading a
+#request), /infer/packed (a firmware-sized batch a request) and raw
+#UDP/TCP frames (one a datagram / send). The backend runs under uvicorn in
+#a child process; its CPU time comes from /proc (Linux), from the first
+#reading sent until the last one reaches the InfluxDB stand-in.
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+
+def cpu_seconds(pid):
+    with open(f"/proc/{pid}/stat") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLK_TCK       # utime + stime
+
+def free_port(kind=socket.SOCK_STREAM):
+    with socket.socket(socket.AF_INET, kind) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def start_backend(influx_port, http_port, udp_port, tcp_port):
+    env = dict(
+        os.environ,
+        INFLUX_URL=f"http://127.0.0.1:{influx_port}",
+        INFLUX_TOKEN="bench",
+        INFLUX_ORG="bench",
+        INFLUX_BUCKET="bench",
+        INFLUX_FLUSH_INTERVAL="0.1",
+        SPOOL_DIR=tempfile.mkdtemp(prefix="aq-bench-spool-"),
+        INGEST_HOST="127.0.0.1",
+        INGEST_UDP_PORT=str(udp_port),
+        INGEST_TCP_PORT=str(tcp_port),
+    )
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app:app", "--port", str(http_port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env
+    )
+    for _ in range(300):
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", http_port, timeout=1)
+            conn.request("GET", "/metrics")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            pass
+        time.sleep(0.1)
+    proc.kill()
+    raise RuntimeError("backend did not start")
+
+def wait_for_lines(n, timeout=60):
+    deadline = time.time() + timeout
+    while FakeInflux.lines < n and time.time() < deadline:
+        time.sleep(0.01)
+    return FakeInflux.lines
+
+def columns(readings):
+    return (
+        [r["device_id"] for r in readings],
+        [int(time.time())] * len(readings),
+        [r["temp"] for r in readings],
+        [r["hum"] for r in readings],
+        [r["mq"] for r in readings]
+    )
+
+#Senders, one per way in
+def send_json(readings, http_port, _):
+    conn = http.client.HTTPConnection("127.0.0.1", http_port)
+    for r in readings:
+        conn.request("POST", "/infer", json.dumps(r), {"Content-Type": "application/json"})
+        conn.getresponse().read()
+
+def send_packed(readings, http_port, batch):
+    conn = http.client.HTTPConnection("127.0.0.1", http_port)
+    by_device = {}
+    for r in readings:
+        by_device.setdefault(r["device_id"], []).append(r)
+    for device_id, rows in by_device.items():
+        for i in range(0, len(rows), batch):
+            chunk = rows[i:i + batch]
+            _, ts, temp, hum, mq = columns(chunk)
+            body = packed.encode(device_id, ts, temp, hum, mq)
+            conn.request("POST", "/infer/packed", body, {"Content-Type": packed.CONTENT_TYPE})
+            conn.getresponse().read()
+
+def send_udp(readings, udp_port, _):
+    frames = packed.encode_frames(*columns(readings))
+    size = packed.FRAME.itemsize
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as s:
+        for i in range(0, len(frames), size):
+            s.sendto(frames[i:i + size], ("127.0.0.1", udp_port))
+            if i % (256 * size) == 0:
+                time.sleep(0.001)       # stay inside the socket receive buffer
+
+def send_tcp(readings, tcp_port, _):
+    frames = packed.encode_frames(*columns(readings))
+    size = packed.FRAME.itemsize
+    with socket.create_connection(("127.0.0.1", tcp_port)) as s:
+        for i in range(0, len(frames), size):
+            s.sendall(frames[i:i + size])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backend CPU per reading: JSON vs packed vs binary ingest")
+    parser.add_argument("--devices", type=int, default=50)
+    parser.add_argument("--readings", type=int, default=5000, help="readings per way in")
+    parser.add_argument("--packed-batch", type=int, default=12, help="readings per /infer/packed request")
+    args = parser.parse_args()
+
+    influx = start_fake_influx(0)
+    http_port, udp_port, tcp_port = free_port(), free_port(socket.SOCK_DGRAM), free_port()
+    proc = start_backend(influx.server_port, http_port, udp_port, tcp_port)
+    readings = synthetic(args.devices, max(args.readings // args.devices, 1))
+
+    try:
+        results = {}
+        for name, send, port in (
+            ("json", send_json, http_port),
+            ("packed", send_packed, http_port),
+            ("udp", send_udp, udp_port),
+            ("tcp", send_tcp, tcp_port),
+        ):
+            # fresh device ids, so every run starts from the same warm-up
+            batch = [dict(r, device_id=f"{name}-{r['device_id']}") for r in readings]
+            expected = FakeInflux.lines + len(batch)
+            cpu, start = cpu_seconds(proc.pid), time.perf_counter()
+            send(batch, port, args.packed_batch)
+            received = wait_for_lines(expected) - expected + len(batch)
+            cpu, wall = cpu_seconds(proc.pid) - cpu, time.perf_counter() - start
+
+            results[name] = cpu / max(received, 1) * 1e6
+            print(f"{name:7s} {received:6d}/{len(batch)} readings  {wall:6.2f}s wall  "
+                  f"{results[name]:7.1f} us backend CPU per reading")
+
+        print(f"udp vs json: {results['json'] / results['udp']:.1f}x less backend CPU per reading")
+    finally:
+        proc.terminate()
+        proc.wait()
+        influx.shutdown()
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import numpy as np
+from influxdb_client import Point                                     #type:ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from lineproto import field_template, encode_line, encode_lines       #type:ignore
+from features import FEATURES                                         #type:ignore
+from dataset import load_dataset
+
+# CONFIG
+DATA_PATH = "../dataset/air_quality"
+REPEAT = 5
+
+#Reference: the Point path db.py used before
+def point_lines(device_ids, ts, temp, hum, mq, X, aq_levels, confidence, anomalies, anomaly_scores):
+    points = []
+    for i in range(len(device_ids)):
+        point = (
+            Point("air_quality")
+            .tag("device_id", device_ids[i])
+            .time(int(ts[i]))
+            .field("temp", float(temp[i]))
+            .field("hum", float(hum[i]))
+            .field("mq", float(mq[i]))
+            .field("aq_level", int(aq_levels[i]))
+            .field("confidence", float(confidence[i]))
+            .field("is_anomaly", int(anomalies[i]))
+            .field("anomaly_score", float(anomaly_scores[i]))
+        )
+        for j, k in enumerate(FEATURES):
+            point = point.field(k, float(X[i, j]))
+        points.append(point.to_line_protocol())
+    return "\n".join(points).encode()
+
+def fast_lines(template, device_ids, ts, temp, hum, mq, X, aq_levels, confidence, anomalies, anomaly_scores):
+    return encode_lines(
+        template, device_ids, ts, temp, hum, mq, X, FEATURES,
+        aq_levels, confidence, anomalies, anomaly_scores
+    )
+
+def fast_line(template, device_ids, ts, temp, hum, mq, X, aq_levels, confidence, anomalies, anomaly_scores):
+    values = {
+        "temp": temp[0],
+        "hum": hum[0],
+        "mq": mq[0],
+        "aq_level": aq_levels[0],
+        "confidence": confidence[0],
+        "is_anomaly": anomalies[0],
+        "anomaly_score": anomaly_scores[0],
+    }
+    values.update(zip(FEATURES, X[0]))
+    return encode_line(template, device_ids[0], ts[0], values)
+
+def best_of(fn, *args):
+    best = float("inf")
+    for _ in range(REPEAT):
+        t = time.perf_counter()
+        fn(*args)
+        best = min(best, time.perf_counter() - t)
+    return best
+
+if __name__ == "__main__":
+    df = load_dataset(DATA_PATH, columns=["ts", "temp", "hum", "mq"] + FEATURES)
+    n = len(df)
+    rng = np.random.default_rng(42)
+
+    X = df[FEATURES].to_numpy(dtype=float)
+    X[0, 2] = np.nan   # warm-up style row, skipped field
+    args = (
+        [f"node {i % 7}" for i in range(n)],          # tag needing escapes
+        (df["ts"].to_numpy() * 1e9).astype(np.int64),
+        df["temp"].to_numpy(dtype=float),
+        df["hum"].to_numpy(dtype=float),
+        df["mq"].to_numpy(dtype=float),
+        X,
+        rng.integers(0, 4, n),
+        rng.random(n),
+        rng.random(n) < 0.01,
+        rng.normal(0.1, 0.05, n),
+    )
+    template = field_template(FEATURES)
+
+    #Equivalence
+    expected = point_lines(*args)
+    got = fast_lines(template, *args)
+    assert got == expected, "line protocol differs from Point output"
+    for i in range(0, n, 97):
+        row = tuple(a[i:i + 1] for a in args)
+        assert fast_lines(template, *row) == point_lines(*row)
+        assert fast_line(template, *row) == point_lines(*row)
+    # empty device id: no device_id tag at all, like Point
+    row = ([""],) + tuple(a[:1] for a in args[1:])
+    assert fast_lines(template, *row) == point_lines(*row)
+    assert fast_line(template, *row) == point_lines(*row)
+    print(f"Line protocol identical to Point output for {n} rows")
+
+    #Timing
+    t_point = best_of(point_lines, *args)
+    t_fast = best_of(fast_lines, template, *args)
+    row = tuple(a[:1] for a in args)
+    t_point_1 = best_of(lambda: [point_lines(*row) for _ in range(1000)]) / 1000
+    t_fast_1 = best_of(lambda: [fast_line(template, *row) for _ in range(1000)]) / 1000
+
+    print(f"\nBatch of {n}")
+    print(f"Point       : {t_point * 1e3:8.2f} ms  ({t_point / n * 1e6:.2f} us/row)")
+    print(f"encode_lines: {t_fast * 1e3:8.2f} ms  ({t_fast / n * 1e6:.2f} us/row)")
+    print(f"Speedup     : {t_point / t_fast:.1f}x")
+    print("\nSingle row")
+    print(f"Point       : {t_point_1 * 1e6:8.2f} us")
+    print(f"encode_line : {t_fast_1 * 1e6:8.2f} us")
+    print(f"Speedup     : {t_point_1 / t_fast_1:.1f}x")
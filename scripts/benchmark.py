@@ -0,0 +1,334 @@
+import os
+import sys
+import json
+import time
+import argparse
+import asyncio
+import inspect
+import tempfile
+import threading
+import subprocess
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+
+# CONFIG
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+DATA_PATH = os.path.join(ROOT, "dataset", "raw.jsonl")
+BACKEND_DIR = os.path.join(ROOT, "backend")
+
+#Local InfluxDB stand-in: accepts /api/v2/write and counts reading
+#points (lines) and rollup points (rollup_lines)
+class FakeInflux(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    latency = 0.0
+    lines = 0
+    rollup_lines = 0
+    writes = 0
+    lock = threading.Lock()
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.latency:
+            time.sleep(self.latency)
+        total = body.count(b"\n") + 1 if body else 0
+        rollups = body.count(b"\nair_quality_") + body.startswith(b"air_quality_")
+        with FakeInflux.lock:
+            FakeInflux.lines += total - rollups
+            FakeInflux.rollup_lines += rollups
+            FakeInflux.writes += 1
+        self.send_response(204)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+def start_fake_influx(latency):
+    FakeInflux.latency = latency
+    ThreadingHTTPServer.request_queue_size = 256
+    ThreadingHTTPServer.daemon_threads = True
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeInflux)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+#Streams
+def load_raw(path=DATA_PATH):
+    with open(path) as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [{"temp": r["temp"], "hum": r["hum"], "mq": r["mq"]} for r in rows]
+
+def synthetic(n_devices, per_device, seed=42):
+    rng = np.random.default_rng(seed)
+    readings = []
+    mq = rng.integers(200, 300, n_devices).astype(float)
+    for _ in range(per_device):
+        mq = np.clip(mq + rng.normal(0, 4, n_devices).round(), 0, 4095)
+        for d in range(n_devices):
+            readings.append({
+                "device_id": f"node-{d}",
+                "temp": float(rng.integers(18, 30)),
+                "hum": float(rng.integers(40, 70)),
+                "mq": float(mq[d]),
+            })
+    return readings
+
+def percentiles(samples):
+    a = np.asarray(samples) * 1e3
+    return {
+        "mean": float(a.mean()),
+        "p50": float(np.percentile(a, 50)),
+        "p95": float(np.percentile(a, 95)),
+        "p99": float(np.percentile(a, 99)),
+    }
+
+#End-to-end through the FastAPI app (in process, no sockets)
+async def replay(app_module, readings, concurrency, batch_size):
+    import httpx                                                           #type:ignore
+
+    transport = httpx.ASGITransport(app=app_module.app)
+    latencies = []
+    queue = asyncio.Queue()
+    if batch_size > 1:
+        for i in range(0, len(readings), batch_size):
+            queue.put_nowait(("/infer/batch", {"readings": readings[i:i + batch_size]}))
+    else:
+        for r in readings:
+            queue.put_nowait(("/infer", r))
+
+    async def client(c):
+        while not queue.empty():
+            url, body = queue.get_nowait()
+            t = time.perf_counter()
+            r = await c.post(url, json=body)
+            latencies.append(time.perf_counter() - t)
+            if r.status_code != 200:
+                raise RuntimeError(f"{url} returned {r.status_code}: {r.text[:200]}")
+
+    lifespan = getattr(app_module, "lifespan", None)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as c:
+        if lifespan is not None:
+            async with lifespan(app_module.app):
+                t = time.perf_counter()
+                await asyncio.gather(*[client(c) for _ in range(concurrency)])
+                elapsed = time.perf_counter() - t
+        else:
+            t = time.perf_counter()
+            await asyncio.gather(*[client(c) for _ in range(concurrency)])
+            elapsed = time.perf_counter() - t
+
+    return {
+        "readings": len(readings),
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "batch_size": batch_size,
+        "seconds": elapsed,
+        "readings_per_sec": len(readings) / elapsed,
+        "latency_ms": percentiles(latencies),
+    }
+
+def _call(fn, **kwargs):
+    params = inspect.signature(fn).parameters
+    return fn(**{k: v for k, v in kwargs.items() if k in params})
+
+#Per-stage timings, reading by reading
+def stage_breakdown(ml, db, readings):
+    timings = {"features": [], "scaler": [], "isolation_forest": [], "decision_tree": [], "db_write": []}
+
+    compiled = None
+    if not hasattr(ml, "scaler"):
+        from registry import registry                                      #type:ignore
+        import trees                                                       #type:ignore
+        compiled = registry.warmup()
+
+    features = ml.get_features() if hasattr(ml, "get_features") else ml.FEATURES
+
+    for r in readings:
+        t0 = time.perf_counter()
+        feats = _call(ml.engineer_features, temp=r["temp"], hum=r["hum"], mq=r["mq"],
+                      device_id=r.get("device_id", "default"))
+        X = np.array([[feats[f] for f in features]])
+        t1 = time.perf_counter()
+
+        if compiled is None:
+            X_scaled = ml.scaler.transform(X)
+            t2 = time.perf_counter()
+            score = float(ml.anomaly_model.decision_function(X_scaled)[0])
+            t3 = time.perf_counter()
+            proba = ml.aq_model.predict_proba(X)
+        else:
+            X_scaled = trees.scale(compiled, X)
+            t2 = time.perf_counter()
+            score = float(trees.anomaly_decision_function_scaled(compiled, X_scaled)[0])
+            t3 = time.perf_counter()
+            proba = trees.classifier_predict_proba(compiled, X)
+        t4 = time.perf_counter()
+
+        _call(db.write_to_influx, device_id=r.get("device_id", "default"), temp=r["temp"], hum=r["hum"],
+              mq=r["mq"], feats=feats, aq_level=int(proba.argmax()), confidence=float(proba.max()),
+              anomaly=score < 0, anomaly_score=score)
+        t5 = time.perf_counter()
+
+        timings["features"].append(t1 - t0)
+        timings["scaler"].append(t2 - t1)
+        timings["isolation_forest"].append(t3 - t2)
+        timings["decision_tree"].append(t4 - t3)
+        timings["db_write"].append(t5 - t4)
+
+    return {
+        stage: {"mean_us": float(np.mean(v) * 1e6), "p99_us": float(np.percentile(v, 99) * 1e6)}
+        for stage, v in timings.items()
+    }
+
+def git_commit(path):
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=path, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run(args):
+    server = start_fake_influx(args.influx_latency / 1000)
+    backend = os.path.abspath(args.backend)
+
+    #the backend reads these at import
+    os.environ.update({
+        "INFLUX_URL": f"http://127.0.0.1:{server.server_port}",
+        "INFLUX_TOKEN": "bench",
+        "INFLUX_ORG": "bench",
+        "INFLUX_BUCKET": "bench",
+        "SPOOL_DIR": tempfile.mkdtemp(prefix="aq-bench-spool-"),
+        "MODEL_WATCH_INTERVAL": "0",
+    })
+    os.chdir(backend)                  # older trees load models/ relative to cwd
+    sys.path.insert(0, backend)
+
+    import warnings
+    warnings.filterwarnings("ignore")
+    import ml                                                              #type:ignore
+    import db                                                              #type:ignore
+    import app                                                             #type:ignore
+
+    raw = load_raw(args.data)[:args.limit or None]
+    multi = synthetic(args.devices, max(len(raw) // args.devices, 1))
+
+    def reset():
+        if hasattr(ml, "devices"):
+            ml.devices.clear()
+        elif hasattr(ml, "mq_buffer"):
+            ml.mq_buffer.clear()
+
+    scenarios = {}
+    for name, readings, batch in (
+        ("raw_replay", raw, 1),
+        ("multi_device", multi, 1),
+        ("multi_device_batch", multi, args.batch_size),
+    ):
+        if batch > 1 and not any(getattr(r, "path", None) == "/infer/batch" for r in app.app.routes):
+            continue
+        reset()
+        scenarios[name] = asyncio.run(replay(app, readings, args.concurrency, batch))
+        print(f"{name:20s} {scenarios[name]['readings_per_sec']:10.1f} readings/s  "
+              f"p50 {scenarios[name]['latency_ms']['p50']:.2f}ms  p99 {scenarios[name]['latency_ms']['p99']:.2f}ms")
+
+    reset()
+    stages = stage_breakdown(ml, db, raw)
+    for stage, v in stages.items():
+        print(f"  {stage:18s} {v['mean_us']:10.1f} us mean  {v['p99_us']:10.1f} us p99")
+
+    closer = getattr(getattr(db, "writer", None), "close", None)
+    if closer:
+        closer()
+    server.shutdown()
+
+    return {
+        "commit": git_commit(backend),
+        "timestamp": time.time(),
+        "config": {
+            "concurrency": args.concurrency,
+            "devices": args.devices,
+            "batch_size": args.batch_size,
+            "influx_latency_ms": args.influx_latency,
+        },
+        "scenarios": scenarios,
+        "stages": stages,
+        "influx": {"writes": FakeInflux.writes, "lines": FakeInflux.lines, "rollup_lines": FakeInflux.rollup_lines},
+    }
+
+#Compare two result files; non-zero exit on a regression past the threshold
+def compare(base_path, head_path, threshold):
+    with open(base_path) as f:
+        base = json.load(f)
+    with open(head_path) as f:
+        head = json.load(f)
+
+    print(f"base {base.get('commit')}  ->  head {head.get('commit')}")
+    regressions = []
+
+    def check(label, a, b, higher_is_better):
+        change = (b - a) / a * 100 if a else 0.0
+        worse = -change if higher_is_better else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{label:45s} {a:12.2f} {b:12.2f} {change:+8.1f}%{flag}")
+        if flag:
+            regressions.append(label)
+
+    for name in sorted(set(base["scenarios"]) & set(head["scenarios"])):
+        a, b = base["scenarios"][name], head["scenarios"][name]
+        check(f"{name} readings/s", a["readings_per_sec"], b["readings_per_sec"], True)
+        for p in ("p50", "p95", "p99"):
+            check(f"{name} {p} ms", a["latency_ms"][p], b["latency_ms"][p], False)
+    for stage in sorted(set(base["stages"]) & set(head["stages"])):
+        check(f"stage {stage} us", base["stages"][stage]["mean_us"], head["stages"][stage]["mean_us"], False)
+
+    return 1 if regressions else 0
+
+#Run this harness against another commit's backend in a temporary worktree
+def run_against(ref, args):
+    tmp = tempfile.mkdtemp(prefix="aq-bench-")
+    worktree = os.path.join(tmp, "tree")
+    out = os.path.join(tmp, "base.json")
+    subprocess.check_call(["git", "worktree", "add", "--detach", worktree, ref], cwd=ROOT)
+    try:
+        cmd = [
+            sys.executable, os.path.abspath(__file__),
+            "--backend", os.path.join(worktree, "backend"),
+            "--data", os.path.abspath(args.data),
+            "--output", out,
+            "--concurrency", str(args.concurrency),
+            "--devices", str(args.devices),
+            "--batch-size", str(args.batch_size),
+            "--influx-latency", str(args.influx_latency),
+            "--limit", str(args.limit),
+        ]
+        subprocess.check_call(cmd)
+    finally:
+        subprocess.call(["git", "worktree", "remove", "--force", worktree], cwd=ROOT)
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline /infer pipeline benchmark")
+    parser.add_argument("--backend", default=BACKEND_DIR, help="backend directory to benchmark")
+    parser.add_argument("--data", default=DATA_PATH, help="raw JSONL readings to replay")
+    parser.add_argument("--output", default="outputs/bench_results.json", help="where to write JSON results")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--devices", type=int, default=50, help="devices in the synthetic stream")
+    parser.add_argument("--batch-size", type=int, default=100, help="readings per /infer/batch call")
+    parser.add_argument("--influx-latency", type=float, default=5.0, help="stand-in write latency in ms")
+    parser.add_argument("--limit", type=int, default=0, help="only replay the first N raw readings")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "HEAD"), help="compare two result files")
+    parser.add_argument("--against", metavar="REF", help="also benchmark git REF and compare")
+    parser.add_argument("--threshold", type=float, default=10.0, help="regression threshold in percent")
+    args = parser.parse_args()
+
+    if args.compare:
+        sys.exit(compare(*args.compare, args.threshold))
+
+    output = os.path.abspath(args.output)
+    base = run_against(args.against, args) if args.against else None
+
+    results = run(args)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {output}")
+
+    if base:
+        sys.exit(compare(base, output, args.threshold))
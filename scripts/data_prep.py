@@ -1,42 +1,200 @@
-import pandas as pd                   #type:ignore
+import io
+import os
+import sys
+import time
+import shutil
+import argparse
+import tempfile
+from urllib.parse import quote
 import numpy as np
+import pandas as pd                   #type:ignore
+import pyarrow as pa                  #type:ignore
+import pyarrow.compute as pc          #type:ignore
+import pyarrow.json as pa_json        #type:ignore
+import pyarrow.parquet as pq          #type:ignore
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from features import WINDOW, compute_features      #type:ignore
+
+try:
+    import resource
+except ImportError:                   # Windows
+    resource = None
+
+# CONFIG
+RAW_PATH = "../dataset/raw.jsonl"
+OUTPUT_DIR = "../dataset/air_quality"          # Parquet, partitioned by device_id/date
+CSV_PATH = ""                                  # optional flat CSV copy
+CHUNK_MB = 16
+DEFAULT_DEVICE = "default"
+RAW_COLUMNS = ["hum", "mq", "ts", "temp"]
+STORED_DTYPE = np.float32                      # everything but ts (unix seconds need float64)
+
+RAW_SCHEMA = pa.schema([("device_id", pa.string())] + [(c, pa.float64()) for c in RAW_COLUMNS])
+PARSE_OPTIONS = pa_json.ParseOptions(explicit_schema=RAW_SCHEMA, unexpected_field_behavior="ignore")
+
+#Streaming prep: the capture never has to fit in memory, only one chunk
+#(pass 1) or one device-day (pass 2) at a time.
+# 1. read the JSONL in chunks, spill raw rows to a temp dir by device/day
+# 2. per device, day by day: sort by ts, compute features carrying the
+#    rolling window across days, write that partition
+#Rows with equal ts keep their file order (stable sorts throughout).
+
+def _partition(root, device_id, day):
+    return os.path.join(root, f"device_id={quote(device_id, safe='')}", f"date={day}")
+
+def _day(day_number):
+    return (pd.Timestamp(0) + pd.Timedelta(days=int(day_number))).strftime("%Y-%m-%d")
+
+#Whole lines only, about chunk_bytes at a time
+def read_chunks(path, chunk_bytes):
+    with open(path, "rb") as f:
+        tail = b""
+        while True:
+            block = f.read(chunk_bytes)
+            if not block:
+                break
+            block = tail + block
+            cut = block.rfind(b"\n") + 1
+            tail = block[cut:]
+            if cut:
+                yield block[:cut]
+        if tail.strip():
+            yield tail
+
+def parse_chunk(block):
+    try:
+        return pa_json.read_json(io.BytesIO(block), parse_options=PARSE_OPTIONS)
+    except pa.ArrowInvalid:
+        # a mistyped value somewhere: coerce like pd.to_numeric(errors="coerce")
+        df = pd.read_json(io.BytesIO(block), lines=True, dtype=False)
+        for c in RAW_SCHEMA.names:
+            if c not in df:
+                df[c] = None
+        df[RAW_COLUMNS] = df[RAW_COLUMNS].apply(pd.to_numeric, errors="coerce")
+        df["device_id"] = df["device_id"].where(df["device_id"].isna(), df["device_id"].astype(str))
+        return pa.Table.from_pandas(df[RAW_SCHEMA.names], schema=RAW_SCHEMA, preserve_index=False)
+
+def spill(path, tmp_dir, chunk_bytes=CHUNK_MB * 1024 * 1024):
+    rows = 0
+    partitions = {}                   # device_id -> {day numbers}
+    for n, block in enumerate(read_chunks(path, chunk_bytes)):
+        table = parse_chunk(block)
+
+        # no ts, no place in the series (the in-memory sort put these last)
+        ts = table["ts"].to_numpy(zero_copy_only=False)
+        keep = ~np.isnan(ts)
+        table = table.filter(pa.array(keep))
+        device_ids = table["device_id"].fill_null(DEFAULT_DEVICE)
+        days = (ts[keep] // 86400).astype(np.int64)
+        table = table.set_column(0, "device_id", device_ids).append_column("day", pa.array(days))
+
+        table = table.take(pc.sort_indices(table, [("device_id", "ascending"), ("day", "ascending")]))
+        device_ids = table["device_id"].to_numpy(zero_copy_only=False)
+        days = table["day"].to_numpy()
+        starts = np.flatnonzero((device_ids[1:] != device_ids[:-1]) | (days[1:] != days[:-1])) + 1
+
+        raw = table.select(RAW_COLUMNS)
+        for start, end in zip([0, *starts], [*starts, len(table)]):
+            device_id, day = device_ids[start], int(days[start])
+            out = _partition(tmp_dir, device_id, day)
+            os.makedirs(out, exist_ok=True)
+            pq.write_table(raw.slice(start, end - start), os.path.join(out, f"chunk-{n:06d}.parquet"))
+            partitions.setdefault(device_id, set()).add(day)
+        rows += len(table)
+    return rows, partitions
+
+def build(tmp_dir, partitions, output_dir=OUTPUT_DIR, csv_path=CSV_PATH):
+    rows = 0
+    header = True
+    for device_id in sorted(partitions):
+        history = np.empty(0)
+        for day in sorted(partitions[device_id]):
+            table = pq.read_table(_partition(tmp_dir, device_id, day))
+            order = np.argsort(table["ts"].to_numpy(), kind="stable")
+            raw = {c: table[c].to_numpy(zero_copy_only=False)[order] for c in RAW_COLUMNS}
 
-# Load JSONL directly
-df = pd.read_json("../dataset/raw.jsonl", lines=True)
+            # Feature Engineering, same code the backend serves with
+            feats = compute_features(raw["temp"], raw["hum"], raw["mq"], history)
+            history = np.concatenate([history, raw["mq"]])[-(WINDOW - 1):]
 
-# Ensure numeric
-cols = ["mq", "temp", "hum", "ts"]
-df[cols] = df[cols].apply(pd.to_numeric, errors="coerce")
+            #NaNs
+            columns = {**raw, **feats}
+            keep = ~np.isnan(np.column_stack(list(columns.values()))).any(axis=1)
+            if not keep.any():
+                continue
+            out_table = pa.table({
+                name: column[keep] if name == "ts" else column[keep].astype(STORED_DTYPE)
+                for name, column in columns.items()
+            })
 
-# Sort by timestamps
-df = df.sort_values("ts").reset_index(drop=True)
+            out = _partition(output_dir, device_id, _day(day))
+            os.makedirs(out, exist_ok=True)
+            pq.write_table(out_table, os.path.join(out, "part-0.parquet"))
+            if csv_path:
+                out_table.to_pandas().to_csv(csv_path, mode="w" if header else "a", header=header, index=False)
+                header = False
+            rows += len(out_table)
+    return rows
 
-# Feature Engineering
-# Normalized gas value
-df["gas_norm"] = df["mq"] / (df["temp"] * df["hum"] + 1)
+def peak_memory_mb():
+    if resource is None:
+        return float("nan")
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 / 1024 if sys.platform == "darwin" else peak / 1024
 
-# Rolling statistics
-WINDOW = 10
-df["rolling_mean_10"] = df["mq"].rolling(WINDOW).mean()
-df["rolling_std_10"]  = df["mq"].rolling(WINDOW).std()
+#The new dataset is built next to output_dir and swapped in at the end,
+#so a failed run leaves the previous one in place
+def prepare(path=RAW_PATH, output_dir=OUTPUT_DIR, csv_path=CSV_PATH, chunk_mb=CHUNK_MB):
+    start = time.perf_counter()
+    output_dir = os.path.abspath(output_dir)
+    real_output = os.path.realpath(output_dir)
+    if os.path.commonpath([os.path.realpath(path), real_output]) == real_output:
+        raise ValueError(f"{path} is inside {output_dir}, which is replaced: pick another --output")
 
-# Rate of change
-df["gas_diff"] = df["mq"].diff()
-df["gas_diff_norm"] = df["gas_diff"] / (df["mq"].shift(1) + 1e-5)
+    parent = os.path.dirname(output_dir)
+    os.makedirs(parent, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix="aq-prep-", dir=parent)
+    staged = tempfile.mkdtemp(prefix=".aq-dataset-", dir=parent)
+    try:
+        raw_rows, partitions = spill(path, tmp_dir, int(chunk_mb * 1024 * 1024))
+        rows = build(tmp_dir, partitions, staged, csv_path)
 
-# Humidity adjusted index
-df["hum_adjusted_gas"] = df["mq"] * (1 + df["hum"] / 100)
+        # a directory can't be replaced in one rename: move the old one aside
+        old = None
+        if os.path.exists(output_dir):
+            old = staged + ".old"
+            os.replace(output_dir, old)
+        os.replace(staged, output_dir)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        shutil.rmtree(staged, ignore_errors=True)
 
-# Interaction features
-df["temp_hum"] = df["temp"] * df["hum"]
-df["temp_gas"] = df["temp"] * df["mq"]
-df["hum_gas"]  = df["hum"] * df["mq"]
+    elapsed = time.perf_counter() - start
+    return {
+        "raw_rows": raw_rows,
+        "rows": rows,
+        "devices": len(partitions),
+        "partitions": sum(len(days) for days in partitions.values()),
+        "seconds": elapsed,
+        "rows_per_sec": raw_rows / elapsed if elapsed else float("inf"),
+        "peak_memory_mb": peak_memory_mb(),
+    }
 
-#NaNs
-df = df.dropna().reset_index(drop=True)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Feature engineering over raw JSONL captures, in chunks")
+    parser.add_argument("--input", default=RAW_PATH, help="raw JSONL readings")
+    parser.add_argument("--output", default=OUTPUT_DIR, help="Parquet dataset directory (replaced once the new one is complete)")
+    parser.add_argument("--csv", default=CSV_PATH, help="also write one flat CSV here")
+    parser.add_argument("--chunk-mb", type=float, default=CHUNK_MB, help="JSONL read per chunk")
+    args = parser.parse_args()
 
-#Save processed data
-df.to_csv("../dataset/air_quality.csv", index=False)
+    stats = prepare(args.input, args.output, args.csv, args.chunk_mb)
 
-print("Feature engineering complete")
-print(df.head())
+    print("Feature engineering complete")
+    print(f"{stats['raw_rows']} raw rows -> {stats['rows']} feature rows, "
+          f"{stats['devices']} devices, {stats['partitions']} device-day partitions")
+    print(f"{stats['rows_per_sec']:,.0f} rows/s ({stats['seconds']:.2f}s), "
+          f"peak memory {stats['peak_memory_mb']:.0f} MB")
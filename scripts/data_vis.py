@@ -1,7 +1,12 @@
-import pandas as pd                                                  #type:ignore
+import os
+import sys
 import matplotlib.pyplot as plt
+from dataset import load_dataset
 
-df = pd.read_csv("../dataset/air_quality.csv")
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from features import FEATURES                                         #type:ignore
+
+df = load_dataset(columns=["hum", "mq", "ts", "temp"] + FEATURES)
 
 
 fig = plt.figure(figsize=(18, 14))
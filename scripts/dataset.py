@@ -0,0 +1,24 @@
+import numpy as np
+import pyarrow.parquet as pq          #type:ignore
+
+# CONFIG
+DATASET_DIR = "../dataset/air_quality"         # written by data_prep.py
+
+#Prepared dataset: Parquet partitioned by device_id/date, features stored
+#as float32. Only the requested columns are read, and Arrow hands its
+#buffers to pandas without a second copy.
+def load_table(path=DATASET_DIR, columns=None, devices=None):
+    filters = [("device_id", "in", list(devices))] if devices else None
+    return pq.read_table(path, columns=columns, filters=filters, memory_map=True)
+
+def load_dataset(path=DATASET_DIR, columns=None, devices=None):
+    table = load_table(path, columns, devices)
+    return table.to_pandas(split_blocks=True, self_destruct=True)
+
+#Feature matrix straight from Arrow, no DataFrame in between
+def load_matrix(path=DATASET_DIR, columns=None, devices=None, dtype=np.float32):
+    table = load_table(path, columns, devices)
+    X = np.empty((table.num_rows, table.num_columns), dtype=dtype)
+    for j, column in enumerate(table.columns):
+        X[:, j] = column.to_numpy()
+    return X
@@ -0,0 +1,139 @@
+import os
+import sys
+import joblib
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+from trees import (                                                      #type:ignore
+    anomaly_decision_function, classifier_predict_proba, flatten_trees, flatten_isolation_forest
+)
+
+MODEL_DIR = "models"
+COMPILED_NAME = "compiled_models.joblib"
+MICROPYTHON_NAME = "aq_tree.py"                # classifier for firmware/, see export_micropython
+CHECK_ROWS = 50_000            # rows checked against sklearn, sampled on large datasets
+
+def compile_models(scaler, anomaly_model, aq_model, features):
+    #scaler
+    n_features = len(features)
+    mean = scaler.mean_ if scaler.mean_ is not None else np.zeros(n_features)
+    scale = scaler.scale_ if scaler.scale_ is not None else np.ones(n_features)
+
+    #IsolationForest
+    anomaly = flatten_isolation_forest(anomaly_model, n_features)
+
+    #DecisionTree: normalized class distribution per leaf
+    classifier, _ = flatten_trees([aq_model])
+    value = aq_model.tree_.value[:, 0, :].astype(np.float64)
+    normalizer = value.sum(axis=1, keepdims=True)
+    normalizer[normalizer == 0.0] = 1.0
+    classifier["value"] = value / normalizer
+    classifier["classes"] = np.asarray(aq_model.classes_)
+
+    return {
+        "features": list(features),
+        "scaler": {"mean": np.asarray(mean, dtype=np.float64), "scale": np.asarray(scale, dtype=np.float64)},
+        "anomaly": anomaly,
+        "classifier": classifier,
+    }
+
+#Compiled outputs must match sklearn before we ship them
+def check_compiled(compiled, scaler, anomaly_model, aq_model, X):
+    X = np.asarray(X, dtype=float)
+
+    expected = anomaly_model.decision_function(scaler.transform(X))
+    got = anomaly_decision_function(compiled, X)
+    if not np.allclose(got, expected, rtol=0, atol=1e-9):
+        raise ValueError(f"anomaly scores differ by up to {np.abs(got - expected).max()}")
+    if not np.array_equal(got < 0, anomaly_model.predict(scaler.transform(X)) == -1):
+        raise ValueError("anomaly flags differ from sklearn")
+
+    expected = aq_model.predict_proba(X)
+    got = classifier_predict_proba(compiled, X)
+    if not np.array_equal(got, expected):
+        raise ValueError("class probabilities differ from sklearn")
+
+def export_compiled(scaler, anomaly_model, aq_model, features, X, model_dir=MODEL_DIR):
+    compiled = compile_models(scaler, anomaly_model, aq_model, features)
+    if len(X) > CHECK_ROWS:
+        X = X[np.random.default_rng(0).choice(len(X), CHECK_ROWS, replace=False)]
+    check_compiled(compiled, scaler, anomaly_model, aq_model, X)
+    path = os.path.join(model_dir, COMPILED_NAME)
+    joblib.dump(compiled, path)
+    return path
+
+#DecisionTreeClassifier as MicroPython source: nested comparisons, no
+#imports or tables, so it runs on the ESP32 next to firmware/features.py.
+#predict(x) takes feature values in FEATURES order and returns
+#(class, confidence), confidence being the leaf's class share.
+def micropython_source(aq_model, features, labels=None, version=None):
+    tree = aq_model.tree_
+    value = tree.value[:, 0, :]
+    classes = [int(c) for c in aq_model.classes_]
+
+    lines = [
+        f"#Generated by scripts/export_models.py from model {version or 'unversioned'}, do not edit",
+        f"FEATURES = {tuple(features)!r}",
+        f"CLASSES = {tuple(classes)!r}",
+    ]
+    if labels is not None:
+        lines.append(f"LABELS = {tuple(labels)!r}")
+    lines += ["", "def predict(x):"]
+
+    def emit(node, depth):
+        pad = "    " * depth
+        if tree.children_left[node] == -1:
+            k = int(np.argmax(value[node]))
+            confidence = float(value[node, k] / value[node].sum())
+            lines.append(f"{pad}return {classes[k]}, {confidence!r}")
+            return
+        lines.append(f"{pad}if x[{int(tree.feature[node])}] <= {float(tree.threshold[node])!r}:")
+        emit(tree.children_left[node], depth + 1)
+        lines.append(f"{pad}else:")
+        emit(tree.children_right[node], depth + 1)
+
+    emit(0, 1)
+    return "\n".join(lines) + "\n"
+
+#Same rule as check_compiled: the generated module must agree with sklearn
+def export_micropython(aq_model, features, X, model_dir=MODEL_DIR, labels=None, version=None):
+    source = micropython_source(aq_model, features, labels, version)
+
+    if len(X) > CHECK_ROWS:
+        X = X[np.random.default_rng(0).choice(len(X), CHECK_ROWS, replace=False)]
+    X = np.asarray(X, dtype=np.float32).astype(float)       # the device computes in float32
+    module = {}
+    exec(source, module)
+    got = [module["predict"](row) for row in X.tolist()]
+    if not np.array_equal([c for c, _ in got], aq_model.predict(X)):
+        raise ValueError("generated MicroPython classifier differs from sklearn")
+    if not np.allclose([p for _, p in got], aq_model.predict_proba(X).max(axis=1)):
+        raise ValueError("generated MicroPython confidences differ from sklearn")
+
+    path = os.path.join(model_dir, MICROPYTHON_NAME)
+    with open(path, "w") as f:
+        f.write(source)
+    return path
+
+#Recompile existing artifacts: python export_models.py [model_dir] [dataset]
+if __name__ == "__main__":
+    from dataset import load_matrix, DATASET_DIR
+    from train_model import CLASS_NAMES
+
+    model_dir = sys.argv[1] if len(sys.argv) > 1 else MODEL_DIR
+    data_path = sys.argv[2] if len(sys.argv) > 2 else DATASET_DIR
+
+    features = joblib.load(f"{model_dir}/features.joblib")
+    aq_model = joblib.load(f"{model_dir}/aq_classifier_tree.joblib")
+    X = load_matrix(data_path, features, dtype=float)
+    path = export_compiled(
+        joblib.load(f"{model_dir}/scaler.joblib"),
+        joblib.load(f"{model_dir}/anomaly_model.joblib"),
+        aq_model,
+        features,
+        X,
+        model_dir
+    )
+    print(f"Compiled models saved to {path}")
+    path = export_micropython(aq_model, features, X, model_dir, CLASS_NAMES)
+    print(f"MicroPython classifier saved to {path}")
@@ -1,175 +1,279 @@
 import os
-import pandas as pd                       #type:ignore
+import json
+import time
+import shutil
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import joblib
-import matplotlib.pyplot as plt
 
 from sklearn.ensemble import IsolationForest
-from sklearn.tree import DecisionTreeClassifier, plot_tree
+from sklearn.tree import DecisionTreeClassifier
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import classification_report, confusion_matrix
+from sklearn.metrics import classification_report, confusion_matrix, f1_score, roc_auc_score
 from sklearn.preprocessing import StandardScaler
 
+from export_models import export_compiled, export_micropython, COMPILED_NAME, MICROPYTHON_NAME
+from dataset import load_dataset
+from features import FEATURES             #type:ignore    (backend/features.py, shared with serving)
+from registry import CURRENT_NAME         #type:ignore
+
 # CONFIG
-DATA_PATH = "../dataset/air_quality.csv"
+DATA_PATH = "../dataset/air_quality"            # Parquet, from data_prep.py
 MODEL_DIR = "models"
-OUTPUT_DIR = "outputs"
-
-FEATURES = [
-    "gas_norm",
-    "rolling_mean_10",
-    "rolling_std_10",
-    "gas_diff",
-    "gas_diff_norm",
-    "hum_adjusted_gas",
-    "temp_hum",
-    "temp_gas",
-    "hum_gas"
-]
 
 CLASS_NAMES = ["Good", "Moderate", "Poor", "Hazardous"]
-
-os.makedirs(MODEL_DIR, exist_ok=True)
-os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-# LOAD & CLEAN DATA
-print("\n🔹 Loading dataset...")
-df = pd.read_csv(DATA_PATH)
-
-# Drop NaNs caused by rolling / diff features
-df = df.dropna().reset_index(drop=True)
-
-X = df[FEATURES]
-
-# AQ LABELING (Heuristic)
+AQ_BINS = [220, 260, 300]                       # mq thresholds between the classes
+NORMAL_MQ = 260                                 # anomaly model trains on air below this
+RANDOM_STATE = 42
+TEST_SIZE = 0.2
+
+#Searched in parallel; the classifier is picked by validation macro F1,
+#the anomaly model by TPR - FPR on held-out rows (positives: mq >= NORMAL_MQ)
+GRID = {
+    "max_depth": [3, 5, 8],
+    "min_samples_leaf": [10, 30, 60],
+    "n_estimators": [100, 300],
+    "contamination": [0.005, 0.01, 0.02],
+}
+
+# AQ LABELING (Heuristic): <220 Good, <260 Moderate, <300 Poor, else Hazardous
 def air_quality_label(mq):
-    if mq < 220:
-        return 0  # Good
-    elif mq < 260:
-        return 1  # Moderate
-    elif mq < 300:
-        return 2  # Poor
-    else:
-        return 3  # Hazardous
-
-df["aq_label"] = df["mq"].apply(air_quality_label)
-y = df["aq_label"]
-
-#ANOMALY DETECTION (Isolation Forest)
-print("\n🔹 Training Anomaly Detection Model...")
-
-#Train only on NORMAL air 
-normal_df = df[df["mq"] < 260]
-X_anomaly = normal_df[FEATURES]
-
-# Scale features 
-scaler = StandardScaler()
-X_anomaly_scaled = scaler.fit_transform(X_anomaly)
-
-anomaly_model = IsolationForest(
-    n_estimators=300,
-    contamination=0.01,
-    random_state=42
-)
-
-anomaly_model.fit(X_anomaly_scaled)
-
-#Save anomaly artifacts
-joblib.dump(anomaly_model, f"{MODEL_DIR}/anomaly_model.joblib")
-joblib.dump(scaler, f"{MODEL_DIR}/scaler.joblib")
-
-print("Anomaly model saved")
-
-# Anomaly Evaluation
-X_all_scaled = scaler.transform(df[FEATURES])
-
-df["anomaly_score"] = anomaly_model.decision_function(X_all_scaled)
-df["is_anomaly"] = anomaly_model.predict(X_all_scaled)  # -1 = anomaly
-
-total = len(df)
-anomalies = (df["is_anomaly"] == -1).sum()
-
-print("\n Anomaly Detection Summary")
-print(f"Total samples       : {total}")
-print(f"Detected anomalies  : {anomalies}")
-print(f"Anomaly percentage  : {anomalies / total * 100:.2f}%")
-
-print("\n AQ distribution among anomalies:")
-print(
-    df[df["is_anomaly"] == -1]["aq_label"]
-    .value_counts()
-    .sort_index()
-)
-
-#Plot anomaly score distribution
-plt.figure(figsize=(10, 4))
-plt.hist(df["anomaly_score"], bins=50)
-plt.xlabel("Anomaly Score")
-plt.ylabel("Frequency")
-plt.title("Isolation Forest Anomaly Score Distribution")
-plt.tight_layout()
-plt.savefig(f"{OUTPUT_DIR}/anomaly_score_distribution.png", dpi=300)
-plt.show()
-
-#AQ CLASSIFICATION (Decision Tree)
-print("\n🔹 Training AQ classifier (Decision Tree)...")
-
-X_train, X_val, y_train, y_val = train_test_split(
-    X, y,
-    test_size=0.2,
-    random_state=42,
-    stratify=y
-)
-
-model = DecisionTreeClassifier(
-    max_depth=5,
-    min_samples_leaf=30,
-    random_state=42
-)
-
-model.fit(X_train, y_train)
-
-#Evaluation
-y_pred = model.predict(X_val)
-y_prob = model.predict_proba(X_val)
-
-print("\nClassification Report:")
-print(classification_report(y_val, y_pred, target_names=CLASS_NAMES))
-
-print("\nConfusion Matrix:")
-print(confusion_matrix(y_val, y_pred))
-
-#Confidence analysis
-pred_df = pd.DataFrame({
-    "True_Label": y_val.values,
-    "Pred_Label": y_pred,
-    "Confidence": y_prob.max(axis=1)
-})
-
-print("\nSample predictions with confidence:")
-print(pred_df.head(10))
-
-low_conf = pred_df[pred_df["Confidence"] < 0.6]
-print(f"\nLow-confidence predictions (<0.6): {len(low_conf)}")
-
-#Decision Tree Visualization
-plt.figure(figsize=(22, 10))
-plot_tree(
-    model,
-    feature_names=FEATURES,
-    class_names=CLASS_NAMES,
-    filled=True,
-    rounded=True,
-    fontsize=9
-)
-plt.title("Decision Tree for Air Quality Classification")
-plt.tight_layout()
-plt.savefig(f"{OUTPUT_DIR}/aq_decision_tree.png", dpi=300)
-plt.show()
-
-#Save Artifacts
-joblib.dump(model, f"{MODEL_DIR}/aq_classifier_tree.joblib")
-joblib.dump(FEATURES, f"{MODEL_DIR}/features.joblib")
-
-print("\nDecision Tree AQ classifier saved")
-print("Training complete")
+    return np.digitize(mq, AQ_BINS)
+
+#Worker state, sent once per process instead of once per grid point
+_data = {}
+
+def _init_worker(data):
+    _data.update(data)
+
+def fit_classifier(params):
+    d = _data
+    model = DecisionTreeClassifier(random_state=RANDOM_STATE, **params)
+    model.fit(d["X_train"], d["y_train"])
+    y_pred = model.predict(d["X_val"])
+    return {
+        "params": params,
+        "accuracy": float((y_pred == d["y_val"]).mean()),
+        "macro_f1": float(f1_score(d["y_val"], y_pred, average="macro")),
+    }
+
+def fit_anomaly(params):
+    d = _data
+    normal = d["mq_train"] < NORMAL_MQ
+    scaler = StandardScaler().fit(d["X_train"][normal])
+    model = IsolationForest(random_state=RANDOM_STATE, **params)
+    model.fit(scaler.transform(d["X_train"][normal]))
+
+    X_val = scaler.transform(d["X_val"])
+    positive = d["mq_val"] >= NORMAL_MQ
+    flagged = model.predict(X_val) == -1
+    tpr = float(flagged[positive].mean()) if positive.any() else float("nan")
+    fpr = float(flagged[~positive].mean())
+    auc = float(roc_auc_score(positive, -model.decision_function(X_val))) if 0 < positive.sum() < len(positive) else float("nan")
+    score = (0.0 if np.isnan(tpr) else tpr) - fpr
+    return {"params": params, "tpr": tpr, "fpr": fpr, "auc": auc, "score": score}
+
+def grid_points(grid, keys):
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+def search(grid, data, jobs):
+    classifier_points = grid_points(grid, ["max_depth", "min_samples_leaf"])
+    anomaly_points = grid_points(grid, ["n_estimators", "contamination"])
+
+    if jobs == 1:
+        _init_worker(data)
+        return [fit_classifier(p) for p in classifier_points], [fit_anomaly(p) for p in anomaly_points]
+
+    with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(data,)) as pool:
+        # slowest first so the pool doesn't end on one big forest
+        anomaly = pool.map(fit_anomaly, sorted(anomaly_points, key=lambda p: -p["n_estimators"]))
+        classifier = pool.map(fit_classifier, classifier_points)
+        return list(classifier), list(anomaly)
+
+def save_plots(version_dir, anomaly_scores, model):
+    import matplotlib                     #type:ignore
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt       #type:ignore
+    from sklearn.tree import plot_tree
+
+    #Anomaly score distribution
+    plt.figure(figsize=(10, 4))
+    plt.hist(anomaly_scores, bins=50)
+    plt.xlabel("Anomaly Score")
+    plt.ylabel("Frequency")
+    plt.title("Isolation Forest Anomaly Score Distribution")
+    plt.tight_layout()
+    plt.savefig(os.path.join(version_dir, "anomaly_score_distribution.png"), dpi=300)
+    plt.close()
+
+    #Decision Tree Visualization
+    plt.figure(figsize=(22, 10))
+    plot_tree(
+        model,
+        feature_names=FEATURES,
+        class_names=CLASS_NAMES,
+        filled=True,
+        rounded=True,
+        fontsize=9
+    )
+    plt.title("Decision Tree for Air Quality Classification")
+    plt.tight_layout()
+    plt.savefig(os.path.join(version_dir, "aq_decision_tree.png"), dpi=300)
+    plt.close()
+
+def train(args):
+    start = time.perf_counter()
+    grid = dict(GRID)
+    if args.config:
+        with open(args.config) as f:
+            grid.update(json.load(f))
+    for key in GRID:
+        if getattr(args, key) is not None:
+            grid[key] = getattr(args, key)
+
+    version = args.version or time.strftime("%Y%m%d-%H%M%S")
+    version_dir = os.path.join(args.model_dir, version)
+    if os.path.exists(version_dir):
+        raise SystemExit(f"{version_dir} already exists")
+
+    # LOAD & CLEAN DATA
+    print("\n🔹 Loading dataset...")
+    df = load_dataset(args.data, columns=FEATURES + ["mq"]).dropna()
+
+    # stored as float32, fit in float64 like the backend scores
+    X = df[FEATURES].to_numpy(dtype=float)
+    mq = df["mq"].to_numpy(dtype=float)
+    y = air_quality_label(mq)
+    print(f"{len(X)} rows")
+
+    X_train, X_val, y_train, y_val, mq_train, mq_val = train_test_split(
+        X, y, mq,
+        test_size=TEST_SIZE,
+        random_state=RANDOM_STATE,
+        stratify=y
+    )
+    data = {"X_train": X_train, "X_val": X_val, "y_train": y_train, "y_val": y_val,
+            "mq_train": mq_train, "mq_val": mq_val}
+
+    # HYPERPARAMETER SEARCH
+    print(f"\n🔹 Searching {len(grid_points(grid, ['max_depth', 'min_samples_leaf']))} classifier and "
+          f"{len(grid_points(grid, ['n_estimators', 'contamination']))} anomaly settings on {args.jobs} processes...")
+    search_start = time.perf_counter()
+    classifier_results, anomaly_results = search(grid, data, args.jobs)
+    search_seconds = time.perf_counter() - search_start
+
+    best_classifier = max(classifier_results, key=lambda r: (r["macro_f1"], r["accuracy"]))
+    best_anomaly = max(anomaly_results, key=lambda r: (r["score"], r["auc"]))
+    print(f"Classifier   : {best_classifier['params']}  macro F1 {best_classifier['macro_f1']:.4f}")
+    print(f"Anomaly model: {best_anomaly['params']}  TPR {best_anomaly['tpr']:.3f}  FPR {best_anomaly['fpr']:.3f}")
+
+    #ANOMALY DETECTION (Isolation Forest), refit on all NORMAL air
+    print("\n🔹 Training Anomaly Detection Model...")
+    normal = mq < NORMAL_MQ
+    scaler = StandardScaler()
+    X_anomaly_scaled = scaler.fit_transform(X[normal])
+    anomaly_model = IsolationForest(random_state=RANDOM_STATE, n_jobs=args.jobs, **best_anomaly["params"])
+    anomaly_model.fit(X_anomaly_scaled)
+
+    # Anomaly Evaluation
+    X_all_scaled = scaler.transform(X)
+    anomaly_scores = anomaly_model.decision_function(X_all_scaled)
+    is_anomaly = anomaly_scores < 0
+    print("\n Anomaly Detection Summary")
+    print(f"Total samples       : {len(X)}")
+    print(f"Detected anomalies  : {is_anomaly.sum()}")
+    print(f"Anomaly percentage  : {is_anomaly.mean() * 100:.2f}%")
+
+    #AQ CLASSIFICATION (Decision Tree)
+    print("\n🔹 Training AQ classifier (Decision Tree)...")
+    model = DecisionTreeClassifier(random_state=RANDOM_STATE, **best_classifier["params"])
+    model.fit(X_train, y_train)
+
+    #Evaluation
+    y_pred = model.predict(X_val)
+    confidence = model.predict_proba(X_val).max(axis=1)
+    labels = list(range(len(CLASS_NAMES)))
+
+    print("\nClassification Report:")
+    print(classification_report(y_val, y_pred, labels=labels, target_names=CLASS_NAMES, zero_division=0))
+    print("\nConfusion Matrix:")
+    print(confusion_matrix(y_val, y_pred, labels=labels))
+    print(f"\nLow-confidence predictions (<0.6): {(confidence < 0.6).sum()}")
+
+    #Save Artifacts
+    os.makedirs(version_dir)
+    joblib.dump(anomaly_model, os.path.join(version_dir, "anomaly_model.joblib"))
+    joblib.dump(scaler, os.path.join(version_dir, "scaler.joblib"))
+    joblib.dump(model, os.path.join(version_dir, "aq_classifier_tree.joblib"))
+    joblib.dump(FEATURES, os.path.join(version_dir, "features.joblib"))
+
+    #Flattened models for serving (checked against sklearn on the dataset)
+    compiled_path = export_compiled(scaler, anomaly_model, model, FEATURES, X, version_dir)
+    #Same classifier as a MicroPython module for on-device labels
+    micropython_path = export_micropython(model, FEATURES, X, version_dir, CLASS_NAMES, version)
+
+    metrics = {
+        "version": version,
+        "data": os.path.abspath(args.data),
+        "rows": int(len(X)),
+        "features": FEATURES,
+        "grid": grid,
+        "jobs": args.jobs,
+        "search_seconds": search_seconds,
+        "train_seconds": time.perf_counter() - start,
+        "classifier": {
+            "params": best_classifier["params"],
+            "report": classification_report(
+                y_val, y_pred, labels=labels, target_names=CLASS_NAMES, output_dict=True, zero_division=0
+            ),
+            "confusion_matrix": confusion_matrix(y_val, y_pred, labels=labels).tolist(),
+            "low_confidence": int((confidence < 0.6).sum()),
+            "search": classifier_results,
+        },
+        "anomaly": {
+            "params": best_anomaly["params"],
+            "anomaly_rate": float(is_anomaly.mean()),
+            "search": anomaly_results,
+        },
+    }
+    with open(os.path.join(version_dir, "metrics.json"), "w") as f:
+        json.dump(metrics, f, indent=2)
+
+    if args.plot:
+        save_plots(version_dir, anomaly_scores, model)
+
+    # Hand the compiled bundle to a backend model dir, see Model Versions in the README
+    if args.publish:
+        target = os.path.join(args.publish, version)
+        os.makedirs(target, exist_ok=True)
+        shutil.copy2(compiled_path, os.path.join(target, COMPILED_NAME))
+        # the registry prefers CURRENT (online refits write it), so point it here
+        current = os.path.join(args.publish, CURRENT_NAME)
+        with open(current + ".tmp", "w") as f:
+            f.write(version + "\n")
+        os.replace(current + ".tmp", current)
+        print(f"Published to {target}, {current} -> {version}")
+    if args.firmware:
+        shutil.copy2(micropython_path, os.path.join(args.firmware, MICROPYTHON_NAME))
+        print(f"Classifier for the device written to {os.path.join(args.firmware, MICROPYTHON_NAME)}")
+
+    print(f"\nModel version {version} saved to {version_dir} ({metrics['train_seconds']:.1f}s)")
+    return version_dir
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the AQ classifier and anomaly model")
+    parser.add_argument("--data", default=DATA_PATH, help="prepared Parquet dataset")
+    parser.add_argument("--model-dir", default=MODEL_DIR, help="versions are written to <model-dir>/<version>/")
+    parser.add_argument("--version", help="version name, default: current time as YYYYmmdd-HHMMSS")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count(), help="parallel processes for the search")
+    parser.add_argument("--config", help="JSON file overriding the search grid")
+    parser.add_argument("--max-depth", type=int, nargs="+")
+    parser.add_argument("--min-samples-leaf", type=int, nargs="+")
+    parser.add_argument("--n-estimators", type=int, nargs="+")
+    parser.add_argument("--contamination", type=float, nargs="+")
+    parser.add_argument("--plot", action="store_true", help="also save plots into the version directory")
+    parser.add_argument("--publish", metavar="DIR", help="copy the compiled models to DIR/<version>/ and make it DIR/CURRENT, e.g. ../backend/models")
+    parser.add_argument("--firmware", metavar="DIR", help=f"copy {MICROPYTHON_NAME} to DIR, e.g. ../firmware")
+    train(parser.parse_args())
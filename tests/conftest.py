@@ -0,0 +1,47 @@
+import os
+import sys
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.join(ROOT, "scripts"))
+
+from features import FEATURES                     #type:ignore
+from dataset import load_dataset                  #type:ignore
+
+DATA_PATH = os.path.join(ROOT, "dataset", "air_quality")
+AQ_BINS = [220, 260, 300]                         # as in scripts/train_model.py
+
+@pytest.fixture(scope="session")
+def dataset():
+    return load_dataset(DATA_PATH, columns=["ts", "temp", "hum", "mq"] + FEATURES)
+
+#Scorable rows (past the warm-up) as float64 like serving, and AQ classes
+@pytest.fixture(scope="session")
+def training(dataset):
+    X = dataset[FEATURES].to_numpy(dtype=float)
+    ready = ~np.isnan(X).any(axis=1)
+    return X[ready], np.digitize(dataset["mq"].to_numpy()[ready], AQ_BINS)
+
+@pytest.fixture(scope="session")
+def X(training):
+    return training[0]
+
+#Small sklearn models, fitted the way train_model.py does
+@pytest.fixture(scope="session")
+def sklearn_models(training):
+    from sklearn.ensemble import IsolationForest      #type:ignore
+    from sklearn.preprocessing import StandardScaler  #type:ignore
+    from sklearn.tree import DecisionTreeClassifier   #type:ignore
+
+    X, y = training
+    scaler = StandardScaler().fit(X)
+    anomaly = IsolationForest(n_estimators=50, contamination=0.01, random_state=0).fit(scaler.transform(X))
+    classifier = DecisionTreeClassifier(max_depth=8, min_samples_leaf=5, random_state=0).fit(X, y)
+    return scaler, anomaly, classifier
+
+@pytest.fixture(scope="session")
+def compiled(sklearn_models):
+    from export_models import compile_models      #type:ignore
+    return compile_models(*sklearn_models, FEATURES)
@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+from features import FEATURES, WINDOW, EPS, FeatureState, compute_features     #type:ignore
+
+#compute_features (training, /infer/batch) and FeatureState (/infer) must
+#give bit-identical features, and both the original pandas ones
+
+#The feature engineering data_prep.py did with pandas before features.py
+def pandas_reference(temp, hum, mq):
+    df = pd.DataFrame({"temp": temp, "hum": hum, "mq": mq})
+    df["gas_norm"] = df["mq"] / (df["temp"] * df["hum"] + 1)
+    df["rolling_mean_10"] = df["mq"].rolling(WINDOW).mean()
+    df["rolling_std_10"] = df["mq"].rolling(WINDOW).std()
+    df["gas_diff"] = df["mq"].diff()
+    df["gas_diff_norm"] = df["gas_diff"] / (df["mq"].shift(1) + 1e-5)
+    df["hum_adjusted_gas"] = df["mq"] * (1 + df["hum"] / 100)
+    df["temp_hum"] = df["temp"] * df["hum"]
+    df["temp_gas"] = df["temp"] * df["mq"]
+    df["hum_gas"] = df["hum"] * df["mq"]
+    return df
+
+def streaming(temp, hum, mq, state=None):
+    state = state or FeatureState()
+    rows = [state.update(t, h, m) for t, h, m in zip(temp, hum, mq)]
+    return {f: np.array([row[f] for row in rows]) for f in FEATURES}
+
+@pytest.fixture(scope="module")
+def readings(dataset):
+    return tuple(dataset[c].to_numpy(dtype=float) for c in ("temp", "hum", "mq"))
+
+def test_batch_equals_streaming(readings):
+    batch = compute_features(*readings)
+    stream = streaming(*readings)
+    for f in FEATURES:
+        np.testing.assert_array_equal(batch[f], stream[f], err_msg=f)
+
+def test_push_stats_equal_batch_window(readings):
+    batch = compute_features(*readings)
+    state = FeatureState()
+    stats = []
+    for m in readings[2]:
+        state.push(m)
+        stats.append(state.stats())
+    means, stds = np.array(stats).T
+    np.testing.assert_array_equal(means, batch["rolling_mean_10"])
+    np.testing.assert_array_equal(stds, batch["rolling_std_10"])
+
+#history primes the window: a batch split anywhere gives the same rows
+@pytest.mark.parametrize("split", [1, WINDOW - 2, WINDOW, 500])
+def test_history_continues_the_window(readings, split):
+    whole = compute_features(*readings)
+    tail = compute_features(*(r[split:] for r in readings), history=readings[2][:split])
+
+    state = FeatureState()
+    for m in readings[2][:split]:
+        state.push(m)
+    stream = streaming(*(r[split:] for r in readings), state)
+
+    for f in FEATURES:
+        np.testing.assert_array_equal(tail[f], whole[f][split:], err_msg=f)
+        np.testing.assert_array_equal(tail[f], stream[f], err_msg=f)
+
+def test_matches_pandas(readings):
+    batch = compute_features(*readings)
+    expected = pandas_reference(*readings)
+    for f in FEATURES:
+        np.testing.assert_allclose(batch[f], expected[f].to_numpy(), rtol=1e-9, atol=1e-9, err_msg=f)
+
+def test_warmup_rows(readings):
+    feats = compute_features(*(r[:WINDOW + 2] for r in readings))
+    for f in ("rolling_mean_10", "rolling_std_10"):
+        assert np.isnan(feats[f][:WINDOW - 1]).all()
+        assert np.isfinite(feats[f][WINDOW - 1:]).all()
+    for f in ("gas_diff", "gas_diff_norm"):
+        assert np.isnan(feats[f][0])
+        assert np.isfinite(feats[f][1:]).all()
+
+#gas_diff over the previous reading, not the current one
+def test_gas_diff_norm(readings):
+    mq = readings[2]
+    feats = compute_features(*readings)
+    np.testing.assert_array_equal(feats["gas_diff_norm"][1:], (mq[1:] - mq[:-1]) / (mq[:-1] + EPS))
@@ -0,0 +1,33 @@
+import numpy as np
+from ml import score_features                     #type:ignore
+from trees import apply_trees, scale              #type:ignore
+
+#score_features evaluates each model once; its outputs must be what the
+#separate sklearn predict / predict_proba / decision_function calls gave
+
+def test_score_features_matches_sklearn(X, sklearn_models, compiled):
+    scaler, anomaly, classifier = sklearn_models
+    aq_levels, confidence, is_anomaly, anomaly_scores = score_features(X, compiled, timings=[])
+
+    np.testing.assert_array_equal(aq_levels, classifier.predict(X))
+    np.testing.assert_array_equal(confidence, classifier.predict_proba(X).max(axis=1))
+    np.testing.assert_array_equal(is_anomaly, anomaly.predict(scaler.transform(X)) == -1)
+    np.testing.assert_allclose(anomaly_scores, anomaly.decision_function(scaler.transform(X)), rtol=0, atol=1e-12)
+
+def test_warmup_rows_are_nan(X, compiled):
+    X = X[:20].copy()
+    X[::3, 1] = np.nan
+    out = score_features(X, compiled, timings=[])
+    expected = score_features(X[1::3], compiled, timings=[])
+    for got, want in zip(out, expected):
+        assert np.isnan(got[::3]).all()
+        np.testing.assert_array_equal(got[1::3], want)
+
+def test_apply_trees_matches_sklearn(X, sklearn_models, compiled):
+    scaler, anomaly, classifier = sklearn_models
+    np.testing.assert_array_equal(apply_trees(X, compiled["classifier"])[:, 0], classifier.apply(X.astype(np.float32)))
+
+    X_scaled = scale(compiled, X)
+    leaves = apply_trees(X_scaled, compiled["anomaly"]) - compiled["anomaly"]["roots"]
+    for k, (tree, features) in enumerate(zip(anomaly.estimators_, anomaly.estimators_features_)):
+        np.testing.assert_array_equal(leaves[:, k], tree.apply(X_scaled[:, features].astype(np.float32)))
@@ -0,0 +1,98 @@
+import math
+import numpy as np
+import pytest
+from influxdb_client import Point                  #type:ignore
+from features import FEATURES                      #type:ignore
+from lineproto import MEASUREMENT, field_template, encode_line, encode_lines, encode_point      #type:ignore
+
+#The direct encoder must give the bytes influxdb_client's Point did
+
+TEMPLATE = field_template(FEATURES)
+DEVICE_IDS = ["node-1", "node 1", "a,b=c", "back\\", "tab\there", "new\nline", "", None]
+TS_NS = 1767860000123456789                        # ns precision, beyond a float64
+
+def point(measurement, tags, fields, ts_ns):
+    p = Point(measurement).time(ts_ns)
+    for k, v in tags.items():
+        p = p.tag(k, v)
+    for k, v in fields.items():
+        p = p.field(k, v)
+    return p.to_line_protocol().encode()
+
+def reading(rng, warmup=False):
+    values = {
+        "temp": float(rng.integers(15, 35)),       # whole floats lose their ".0"
+        "hum": float(rng.integers(30, 80)),
+        "mq": float(rng.integers(150, 400)),
+        "aq_level": None if warmup else int(rng.integers(0, 4)),
+        "confidence": float(rng.random()),
+        "is_anomaly": None if warmup else int(rng.random() < 0.1),
+        "anomaly_score": float(rng.normal(0.1, 0.05)),
+    }
+    values.update((f, float(rng.normal(100, 50))) for f in FEATURES)
+    if warmup:
+        values["rolling_mean_10"] = values["rolling_std_10"] = math.nan
+    return values
+
+#Point skips None and NaN fields the same way
+def point_fields(values):
+    return {k: v for k, v in values.items() if v is not None and not (isinstance(v, float) and math.isnan(v))}
+
+@pytest.mark.parametrize("device_id", DEVICE_IDS)
+@pytest.mark.parametrize("model_version", [None, "", "20260108-120000", "v 2,b=1"])
+def test_encode_line_matches_point(device_id, model_version):
+    rng = np.random.default_rng(0)
+    for warmup in (False, True):
+        values = reading(rng, warmup)
+        expected = point(
+            MEASUREMENT, {"device_id": device_id, "model_version": model_version}, point_fields(values), TS_NS
+        )
+        assert encode_line(TEMPLATE, device_id, TS_NS, values, model_version) == expected
+
+def test_encode_lines_matches_point():
+    rng = np.random.default_rng(1)
+    rows = [reading(rng, warmup=i % 5 == 0) for i in range(40)]
+    device_ids = [DEVICE_IDS[i % len(DEVICE_IDS)] for i in range(40)]
+    ts = np.array([TS_NS + i for i in range(40)], dtype=np.int64)
+
+    def column(key):
+        return np.array([np.nan if r[key] is None else r[key] for r in rows], dtype=float)
+
+    got = encode_lines(
+        TEMPLATE, device_ids, ts, column("temp"), column("hum"), column("mq"),
+        np.column_stack([column(f) for f in FEATURES]), FEATURES,
+        column("aq_level"), column("confidence"), column("is_anomaly") == 1, column("anomaly_score"),
+        "v1"
+    )
+    # is_anomaly goes in as a flag column, so warm-up rows carry 0 too
+    expected = []
+    for d, r, t in zip(device_ids, rows, ts):
+        fields = dict(point_fields(r), is_anomaly=int(r["is_anomaly"] == 1))
+        expected.append(point(MEASUREMENT, {"device_id": d, "model_version": "v1"}, fields, int(t)))
+    assert got == b"\n".join(expected)
+
+def test_encode_point_kinds_and_measurement_escaping():
+    fields = [
+        ("count", "i", 12),
+        ("mean", "f", 21.0),
+        ("score", "f", -0.125),
+        ("skipped_nan", "f", math.nan),
+        ("skipped_inf", "f", math.inf),
+        ("skipped_none", "i", None),
+        ("ok", "b", True),
+        ("bad", "b", False),
+        ("note", "s", 'say "hi" \\ bye'),
+    ]
+    values = {k: v for k, _, v in fields}
+    for measurement in ("air_quality_1m", "air quality,1m"):
+        expected = point(measurement, {"device_id": "node 1"}, point_fields(values), TS_NS)
+        assert encode_point(measurement, "node 1", sorted(fields), TS_NS) == expected
+
+def test_timestamp_precision():
+    values = reading(np.random.default_rng(2))
+    line = encode_line(TEMPLATE, "node-1", TS_NS, values)
+    assert line.endswith(b" %d" % TS_NS)
+    # ts in float seconds, as db.py converts it
+    ts = 1767860000.123456
+    line = encode_line(TEMPLATE, "node-1", int(ts * 1e9), values)
+    assert line == point(MEASUREMENT, {"device_id": "node-1"}, point_fields(values), int(ts * 1e9))
@@ -0,0 +1,93 @@
+import numpy as np
+import pytest
+from sklearn.ensemble import IsolationForest            #type:ignore
+from trees import (                                     #type:ignore
+    apply_trees, anomaly_decision_function_scaled, average_path_length,
+    flatten_trees, flatten_isolation_forest, slice_trees, concat_trees
+)
+
+#The flattened node tables against the sklearn models they come from.
+#flatten_isolation_forest reads IsolationForest._max_features and
+#estimators_features_, so a sklearn upgrade that changes them fails here.
+
+@pytest.fixture(scope="module")
+def X_scaled(X, sklearn_models):
+    return sklearn_models[0].transform(X)
+
+def fit_forest(X_scaled, seed, **params):
+    return IsolationForest(n_estimators=20, random_state=seed, **params).fit(X_scaled)
+
+#Leaf of every row in every tree, as sklearn's own node ids
+def tree_leaves(trees, X):
+    return apply_trees(X, trees) - trees["roots"]
+
+def sklearn_leaves(forest, X):
+    return np.column_stack([
+        tree.apply(X[:, features].astype(np.float32))
+        for tree, features in zip(forest.estimators_, forest.estimators_features_)
+    ])
+
+#Path length per row and tree the way sklearn scores it
+def sklearn_path_lengths(forest, X):
+    from sklearn.ensemble._iforest import _average_path_length      #type:ignore
+    leaves = sklearn_leaves(forest, X)
+    return np.column_stack([
+        tree.tree_.compute_node_depths()[leaves[:, k]] + _average_path_length(tree.tree_.n_node_samples[leaves[:, k]]) - 1.0
+        for k, tree in enumerate(forest.estimators_)
+    ])
+
+def test_average_path_length():
+    from sklearn.ensemble._iforest import _average_path_length      #type:ignore
+    n = np.array([0, 1, 2, 3, 10, 256, 10000])
+    np.testing.assert_allclose(average_path_length(n), _average_path_length(n), rtol=0, atol=1e-12)
+
+def test_flatten_trees_classifier(X, sklearn_models, compiled):
+    classifier = sklearn_models[2]
+    trees, is_leaf = flatten_trees([classifier])
+    leaves = tree_leaves(trees, X)[:, 0]
+    np.testing.assert_array_equal(leaves, classifier.apply(X.astype(np.float32)))
+    assert is_leaf[leaves].all()
+    np.testing.assert_array_equal(compiled["classifier"]["value"][leaves], classifier.predict_proba(X))
+
+@pytest.mark.parametrize("max_features", [1.0, 0.5])
+def test_flatten_isolation_forest(X_scaled, max_features):
+    forest = fit_forest(X_scaled, 0, max_features=max_features, contamination=0.01)
+    trees = flatten_isolation_forest(forest, X_scaled.shape[1])
+
+    np.testing.assert_array_equal(tree_leaves(trees, X_scaled), sklearn_leaves(forest, X_scaled))
+    np.testing.assert_allclose(
+        anomaly_decision_function_scaled({"anomaly": trees}, X_scaled), forest.decision_function(X_scaled),
+        rtol=0, atol=1e-12
+    )
+    assert trees["offset"] == forest.offset_
+    assert trees["max_samples"] == forest.max_samples_
+
+def test_slice_trees(X_scaled):
+    forest = fit_forest(X_scaled, 0)
+    trees = flatten_isolation_forest(forest, X_scaled.shape[1])
+    tail = slice_trees(trees, 5)
+
+    assert len(tail["roots"]) == 15 and tail["roots"][0] == 0
+    np.testing.assert_array_equal(tree_leaves(tail, X_scaled), sklearn_leaves(forest, X_scaled)[:, 5:])
+    np.testing.assert_allclose(
+        tail["path_length"][apply_trees(X_scaled, tail)], sklearn_path_lengths(forest, X_scaled)[:, 5:],
+        rtol=0, atol=1e-12
+    )
+
+def test_concat_trees(X_scaled):
+    a = fit_forest(X_scaled, 0)
+    b = fit_forest(X_scaled, 1, max_features=0.5)
+    n_features = X_scaled.shape[1]
+    merged = concat_trees(slice_trees(flatten_isolation_forest(a, n_features), 5), flatten_isolation_forest(b, n_features))
+
+    assert len(merged["roots"]) == 35
+    for k in ("feature", "left", "right"):
+        assert merged[k].dtype == np.intp
+    np.testing.assert_array_equal(
+        tree_leaves(merged, X_scaled),
+        np.column_stack([sklearn_leaves(a, X_scaled)[:, 5:], sklearn_leaves(b, X_scaled)])
+    )
+    expected = np.column_stack([sklearn_path_lengths(a, X_scaled)[:, 5:], sklearn_path_lengths(b, X_scaled)])
+    np.testing.assert_allclose(merged["path_length"][apply_trees(X_scaled, merged)], expected, rtol=0, atol=1e-12)
+    # what the online refit splits back off is forest b again
+    np.testing.assert_array_equal(tree_leaves(slice_trees(merged, 15), X_scaled), sklearn_leaves(b, X_scaled))